@@ -1,46 +1,550 @@
 import pymongo
+from pymongo import UpdateOne
+from pymongo.errors import BulkWriteError
+import argparse
+import glob
 import json
+import os
+import re
+import sys
+import threading
+import time
+import zlib
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from datetime import datetime, timezone
+
+from Task1 import iter_ndjson
+from cache import bump_generation
+from column_index import COLUMN_INDEX_DIR, ColumnIndexUpdates, build_index
+from crawl_state import content_hash
+from indexes import ensure_indexes
+from rollups import ROLLUP_FIELDS, apply_deltas, count_changes, ensure_rollups, rebuild_rollups
+from search import SEARCH_VERSION, ensure_search, search_fields
+from sketches import SketchStore, ensure_sketches, rebuild_sketches
+from vocabulary import Vocabulary, encode_collection, ensure_vocabulary
 
-# Connect to MongoDB
 try:
-    client = pymongo.MongoClient("mongodb://localhost:27017/")
+    import zstandard
+except ImportError:
+    zstandard = None
+
+# Documents sent to MongoDB per insert_many call
+BATCH_SIZE = 1000
+# Files loaded in parallel
+WORKERS = 4
+# Bytes read at a time when streaming a JSON array file
+CHUNK_SIZE = 1 << 20
+# Scraper output files picked up when no paths are given
+DEFAULT_PATTERNS = ['output/articles_*.json', 'output/articles_*.ndjson*']
+# Raised while reading a corrupt or cut-off .gz / .zst file
+DECOMPRESSION_ERRORS = (EOFError, zlib.error) + ((zstandard.ZstdError,) if zstandard is not None else ())
+# Whitespace and commas between the items of a JSON array
+_SEPARATORS = re.compile(r'[\s,]*')
+
+
+def connect(mongo_uri="mongodb://localhost:27017/"):
+    client = pymongo.MongoClient(mongo_uri)
     db = client["almayadeen"]
-    collection = db["articles"]
-    print("MongoDB connected successfully!")
-except Exception as e:
-    print(f"Error connecting to MongoDB: {e}")
-    exit()
-
-# List of JSON file names
-files = [
-    'output/articles_2024_8.xml.json',
-    'output/articles_2024_7.xml.json',
-    'output/articles_2024_6.xml.json',
-    'output/articles_2024_5.xml.json',
-    'output/articles_2024_4.xml.json',
-    'output/articles_2024_3.xml.json',
-    # Add more file paths as needed
-]
-
-# Load and insert JSON data
-try:
-    for file_path in files:
+    return db["articles"]
+
+
+def discover_files(patterns):
+    """Expand glob patterns into a sorted list of files, without duplicates."""
+    files = set()
+    for pattern in patterns:
+        files.update(path for path in glob.glob(pattern) if os.path.isfile(path))
+    return sorted(files)
+
+
+def iter_json_array(file_path, chunk_size=CHUNK_SIZE):
+    """Yield the items of a JSON array file one at a time without loading the whole file."""
+    decoder = json.JSONDecoder()
+    with open(file_path, encoding='utf-8') as f:
+        buffer = f.read(chunk_size)
+        pos = _SEPARATORS.match(buffer).end()
+        if buffer[pos:pos + 1] != '[':
+            raise ValueError(f"{file_path} does not contain a JSON array")
+        pos += 1
+        eof = False
+        while True:
+            pos = _SEPARATORS.match(buffer, pos).end()
+            if buffer[pos:pos + 1] == ']':
+                return
+            try:
+                item, pos = decoder.raw_decode(buffer, pos)
+            except json.JSONDecodeError:
+                # The next item is cut off by the chunk boundary; read more
+                if eof:
+                    raise
+                chunk = f.read(chunk_size)
+                eof = not chunk
+                buffer = buffer[pos:] + chunk
+                pos = 0
+                continue
+            yield item
+
+
+def iter_documents(file_path):
+    if '.ndjson' in os.path.basename(file_path):
+        return iter_ndjson(file_path)
+    return iter_json_array(file_path)
+
+
+def _document_label(document):
+    if isinstance(document, dict):
+        return document.get('post_id') or document.get('url') or '<no post_id/url>'
+    return repr(document)[:80]
+
+
+def _document_key(document):
+    """Upsert key: post_id, or the URL for the odd article without one."""
+    if document.get('post_id'):
+        return {'post_id': document['post_id']}
+    return {'url': document.get('url')}
+
+
+# Placeholders the scraper writes when a page has no such field
+NO_VIDEO = "No video duration available"
+NO_AUTHOR = 'No author available'
+
+
+def _parse_datetime(value):
+    """ISO string from the scraper -> timezone-aware UTC datetime (None if missing/invalid)."""
+    if isinstance(value, datetime):
+        parsed = value
+    elif isinstance(value, str) and value.strip():
+        try:
+            parsed = datetime.fromisoformat(value.strip().replace('Z', '+00:00'))
+        except ValueError:
+            return None
+    else:
+        return None
+    if parsed.tzinfo is None:
+        parsed = parsed.replace(tzinfo=timezone.utc)
+    return parsed.astimezone(timezone.utc)
+
+
+def _clean_list(values):
+    """Trim entries, drop empty ones and duplicates, keep the original order."""
+    if not isinstance(values, list):
+        return []
+    cleaned = []
+    for value in values:
+        value = str(value).strip()
+        if value and value not in cleaned:
+            cleaned.append(value)
+    return cleaned
+
+
+def _to_int(value):
+    try:
+        return int(str(value).strip())
+    except (TypeError, ValueError):
+        return None
+
+
+def normalize_document(document):
+    """Give a scraped article the types and derived fields app.py queries on.
+
+    Dates become BSON datetimes (`published_time`, `last_updated`), counts become
+    ints, keyword/class arrays are trimmed, the scraper's placeholder strings become
+    None, and per-article flags and date parts are precomputed so the endpoints can
+    use equality or range lookups on indexed fields instead of scanning.
+    """
+    published_time = _parse_datetime(document.get('publication_date'))
+    last_updated = _parse_datetime(document.get('last_updated'))
+
+    keywords = _clean_list(document.get('keywords'))
+    classes = _clean_list(document.get('classes'))
+
+    video_duration = document.get('video_duration')
+    if video_duration in (None, '', NO_VIDEO):
+        video_duration = None
+    elif _to_int(video_duration) is not None:
+        # Durations are whole seconds
+        video_duration = _to_int(video_duration)
+
+    thumbnail = document.get('thumbnail') or None
+    word_count = _to_int(document.get('word_count'))
+    author = (document.get('author') or NO_AUTHOR).strip()
+
+    document.update({
+        'published_time': published_time,
+        'last_updated': last_updated,
+        'keywords': keywords,
+        'classes': classes,
+        'video_duration': video_duration,
+        'thumbnail': thumbnail,
+        'word_count': word_count if word_count is not None else 0,
+        'author': author,
+        'keyword_count': len(keywords),
+        'has_video': video_duration is not None,
+        'has_thumbnail': thumbnail is not None,
+        'updated_after_publication': bool(published_time and last_updated and last_updated > published_time),
+        'published_year': published_time.year if published_time else None,
+        'published_month': published_time.month if published_time else None,
+        'published_day': published_time.day if published_time else None,
+    })
+    # Folded copies of the text fields (only the lead of the body) for the search index
+    document['search'] = search_fields(document)
+    return document
+
+
+def normalize_collection(collection, batch_size=BATCH_SIZE):
+    """Backfill normalized types and derived fields on documents loaded before normalization."""
+    updated = 0
+    operations = []
+    # Documents missing keyword_count or with older search fields predate the current normalize_document
+    for document in collection.find({'$or': [{'keyword_count': {'$exists': False}},
+                                             {'search.version': {'$ne': SEARCH_VERSION}}]}):
+        document_id = document.pop('_id')
+        operations.append(UpdateOne({'_id': document_id}, {'$set': normalize_document(document)}))
+        if len(operations) >= batch_size:
+            updated += collection.bulk_write(operations, ordered=False).modified_count
+            operations = []
+    if operations:
+        updated += collection.bulk_write(operations, ordered=False).modified_count
+    if updated:
+        bump_generation(collection.database)
+    print(f"Normalized {updated} existing documents")
+    return updated
+
+
+def _count_written(collection, written, trackers):
+    """Fold the (new, old) pairs of written documents into the rollups and the trackers (sketches, column index)."""
+    deltas = Counter()
+    for document, existing in written:
+        count_changes(deltas, new=document, old=existing)
+        for tracker in trackers or ():
+            tracker.add(document, old=existing)
+    apply_deltas(collection.database, deltas)
+
+
+class _KeyClaims:
+    """Document keys some loader thread is currently reading and writing.
+
+    An upsert batch compares against the stored versions of its documents, so two
+    batches holding the same post_id (one file loaded twice, or an article in two
+    files) must not run at the same time or both count the same old version. A batch
+    waits until none of its keys is claimed, then claims them all at once, so batches
+    over different articles still run in parallel.
+    """
+
+    def __init__(self):
+        self._keys = set()
+        self._released = threading.Condition()
+
+    @contextmanager
+    def claim(self, keys):
+        with self._released:
+            self._released.wait_for(lambda: self._keys.isdisjoint(keys))
+            self._keys.update(keys)
+        try:
+            yield
+        finally:
+            with self._released:
+                self._keys.difference_update(keys)
+                self._released.notify_all()
+
+
+# Shared by every loader thread of the process
+_claims = _KeyClaims()
+
+
+def _insert_batch(collection, batch, stats, failed, trackers=None):
+    rejected = set()
+    try:
+        result = collection.insert_many(batch, ordered=False)
+        stats['inserted'] += len(result.inserted_ids)
+    except BulkWriteError as e:
+        stats['inserted'] += e.details.get('nInserted', 0)
+        for error in e.details.get('writeErrors', []):
+            rejected.add(error['index'])
+            failed.append((_document_label(batch[error['index']]), error.get('errmsg')))
+
+    _count_written(collection, [(document, None) for index, document in enumerate(batch) if index not in rejected],
+                   trackers)
+
+
+def _upsert_batch(collection, batch, stats, failed, trackers=None):
+    # Only the last version of an article repeated within the batch is written; the
+    # earlier ones would otherwise all be compared against the same stored document
+    latest = {}
+    for document in batch:
+        key = next(iter(_document_key(document).items()))
+        latest.pop(key, None)
+        latest[key] = document
+    stats['superseded'] += len(batch) - len(latest)
+    batch = list(latest.values())
+    for document in batch:
+        document['content_hash'] = content_hash(document)
+
+    with _claims.claim(latest.keys()):
+        _write_changed(collection, batch, stats, failed, trackers)
+
+
+def _write_changed(collection, batch, stats, failed, trackers):
+    # One query per batch tells us which documents are already stored unchanged
+    post_ids = [document['post_id'] for document in batch if document.get('post_id')]
+    urls = [document.get('url') for document in batch if not document.get('post_id')]
+    # The stored versions also carry the rollup fields, so changed documents can be un-counted
+    projection = dict(ROLLUP_FIELDS, post_id=1, url=1, content_hash=1)
+    stored = {}
+    if post_ids:
+        for existing in collection.find({'post_id': {'$in': post_ids}}, projection):
+            stored[('post_id', existing['post_id'])] = existing
+    if urls:
+        for existing in collection.find({'url': {'$in': urls}, 'post_id': {'$in': [None, '']}}, projection):
+            stored[('url', existing['url'])] = existing
+
+    operations, changed = [], []
+    for document in batch:
+        (field, value), = _document_key(document).items()
+        existing = stored.get((field, value))
+        if existing is not None and existing.get('content_hash') == document['content_hash']:
+            stats['unchanged'] += 1
+            continue
+        operations.append(UpdateOne({field: value}, {'$set': document}, upsert=True))
+        changed.append((document, existing))
+    if not operations:
+        return
+
+    rejected = set()
+    try:
+        result = collection.bulk_write(operations, ordered=False)
+        details = result.bulk_api_result
+    except BulkWriteError as e:
+        details = e.details
+        for error in details.get('writeErrors', []):
+            rejected.add(error['index'])
+            failed.append((_document_label(changed[error['index']][0]), error.get('errmsg')))
+    stats['inserted'] += details.get('nUpserted', 0)
+    stats['updated'] += details.get('nModified', 0)
+
+    _count_written(collection, [pair for index, pair in enumerate(changed) if index not in rejected], trackers)
+
+
+def load_documents(collection, documents, batch_size=BATCH_SIZE, mode='upsert', trackers=None, vocabulary=None):
+    """Write scraped article dicts to MongoDB in unordered batches.
+
+    Every document goes through normalize_document first. In 'upsert' mode documents are written by post_id and skipped when their
+    content hash matches the stored one, so loading a file twice changes nothing; an
+    article repeated within a batch is only written in its last version.
+    'insert' appends every document. Returns (stats, failed) where failed lists
+    (post_id or url, reason) for every document that could not be written; a bad
+    document never aborts its batch. Written documents are counted in the rollups
+    and, when given, in each tracker (anything with add(document, old)). With a
+    Vocabulary, documents also get their keyword/class/author ids before being written.
+    """
+    stats = {'inserted': 0, 'updated': 0, 'unchanged': 0, 'superseded': 0}
+    failed = []
+    write_batch = _upsert_batch if mode == 'upsert' else _insert_batch
+
+    batch = []
+    for document in documents:
+        if not isinstance(document, dict):
+            failed.append((_document_label(document), 'not a JSON object'))
+            continue
+        batch.append(normalize_document(document))
+        if len(batch) >= batch_size:
+            if vocabulary is not None:
+                vocabulary.encode_batch(batch)
+            write_batch(collection, batch, stats, failed, trackers)
+            batch = []
+    if batch:
+        if vocabulary is not None:
+            vocabulary.encode_batch(batch)
+        write_batch(collection, batch, stats, failed, trackers)
+    return stats, failed
+
+
+def load_file(collection, file_path, batch_size=BATCH_SIZE, mode='upsert', trackers=None, vocabulary=None):
+    """Stream one JSON or NDJSON file through load_documents()."""
+    return load_documents(collection, iter_documents(file_path), batch_size, mode, trackers, vocabulary)
+
+
+def remove_duplicate_post_ids(collection):
+    """Keep only the most recently stored document of each post_id; returns how many were deleted.
+
+    Collections filled in 'insert' mode before the unique post_id index existed can
+    hold an article several times, and the index cannot be built until they are gone.
+    """
+    pipeline = [
+        {'$match': {'post_id': {'$type': 'string'}}},
+        {'$sort': {'_id': 1}},
+        {'$group': {'_id': '$post_id', 'ids': {'$push': '$_id'}, 'count': {'$sum': 1}}},
+        {'$match': {'count': {'$gt': 1}}},
+    ]
+    stale = []
+    for group in collection.aggregate(pipeline, allowDiskUse=True):
+        stale.extend(group['ids'][:-1])
+    deleted = 0
+    for start in range(0, len(stale), BATCH_SIZE):
+        deleted += collection.delete_many({'_id': {'$in': stale[start:start + BATCH_SIZE]}}).deleted_count
+    if deleted:
+        print(f"Removed {deleted} duplicate documents sharing a post_id")
+    return deleted
+
+
+def rebuild_derived(collection):
+    """Recount the rollups, sketches and (when one was built) the column index from the stored articles."""
+    rebuild_rollups(collection)
+    rebuild_sketches(collection)
+    if os.path.isdir(COLUMN_INDEX_DIR):
+        build_index(collection)
+
+
+def ensure_unique_post_ids(collection):
+    """Create the indexes, first removing duplicate post_ids that would block the unique one.
+
+    Upserts without that index would race into new duplicates, so loading stops if it
+    still cannot be built.
+    """
+    deduplicated = False
+    if 'post_id_unique' not in collection.index_information():
+        deduplicated = remove_duplicate_post_ids(collection) > 0
+    ensure_indexes(collection)
+    if 'post_id_unique' not in collection.index_information():
+        raise RuntimeError("The unique post_id index could not be created; not loading without it")
+    return deduplicated
+
+
+def prepare_load(collection):
+    """Get the collection ready for loading; returns the (trackers, vocabulary) to write with."""
+    deduplicated = ensure_unique_post_ids(collection)
+    # Before the rollups: articles stored without vocabulary ids are backfilled and re-counted
+    ensure_vocabulary(collection)
+    ensure_rollups(collection)
+    ensure_sketches(collection)
+    # Articles folded for search by an older search_fields() are refolded, as --normalize-existing would
+    ensure_search(collection)
+    if deduplicated:
+        # The deleted copies were counted too
+        rebuild_derived(collection)
+    return [SketchStore(collection.database), ColumnIndexUpdates(collection.database)], Vocabulary(collection.database)
+
+
+def finish_load(collection, trackers, changed=True):
+    """Flush the trackers and, if anything was written, tell the API its cached aggregates are stale."""
+    sketches, column_updates = trackers
+    sketches.flush()
+    if changed:
+        bump_generation(collection.database)
+    # After the bump: the column index is stamped with the generation current once it is patched
+    column_updates.flush()
+
+
+def store_articles(collection, documents, batch_size=BATCH_SIZE):
+    """Upsert article dicts from any source (not a file) exactly like the file loader does."""
+    trackers, vocabulary = prepare_load(collection)
+    stats = None
+    try:
+        stats, failed = load_documents(collection, documents, batch_size, 'upsert', trackers, vocabulary)
+    finally:
+        finish_load(collection, trackers, changed=stats is None or stats['inserted'] or stats['updated'])
+    return stats, failed
+
+
+def load_files(collection, files, batch_size=BATCH_SIZE, workers=WORKERS, mode='upsert'):
+    """Load several files in parallel and report throughput and failures."""
+    trackers, vocabulary = prepare_load(collection)
+
+    lock = threading.Lock()
+    totals = {'inserted': 0, 'updated': 0, 'unchanged': 0, 'superseded': 0, 'failed': []}
+    # Files abandoned partway; their earlier batches are already written
+    interrupted = []
+    start = time.perf_counter()
+
+    def load(file_path):
         print(f"Processing file: {file_path}")
+        try:
+            stats, failed = load_file(collection, file_path, batch_size, mode, trackers, vocabulary)
+        except FileNotFoundError:
+            print(f"File not found: {file_path}")
+            return
+        except (json.JSONDecodeError, ValueError) as e:
+            print(f"Error decoding JSON in {file_path}: {e}")
+            interrupted.append(file_path)
+            return
+        except UnicodeDecodeError:
+            print(f"Error decoding {file_path}. Please check the file's encoding.")
+            interrupted.append(file_path)
+            return
+        except DECOMPRESSION_ERRORS as e:
+            print(f"Error decompressing {file_path}, documents before the damage were loaded: {e}")
+            interrupted.append(file_path)
+            return
+        with lock:
+            for key in stats:
+                totals[key] += stats[key]
+            totals['failed'].extend((file_path, label, reason) for label, reason in failed)
+        print(f"Data from {file_path}: {stats['inserted']} inserted, {stats['updated']} updated, "
+              f"{stats['unchanged']} unchanged, {stats['superseded']} superseded, {len(failed)} failed")
+
+    try:
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            list(executor.map(load, files))
+    finally:
+        # Whatever was written, even if a worker died, is already in the rollups; the
+        # sketches, column index and API cache must follow it
+        finish_load(collection, trackers, changed=bool(totals['inserted'] or totals['updated'] or interrupted
+                                                      or sys.exc_info()[0] is not None))
+
+    elapsed = time.perf_counter() - start
+    processed = totals['inserted'] + totals['updated'] + totals['unchanged'] + totals['superseded']
+    rate = processed / elapsed if elapsed else 0.0
+    print(f"Processed {processed} documents from {len(files)} files in {elapsed:.1f}s ({rate:.0f} docs/sec): "
+          f"{totals['inserted']} inserted, {totals['updated']} updated, {totals['unchanged']} unchanged, "
+          f"{totals['superseded']} superseded by a later version")
+    if interrupted:
+        print(f"{len(interrupted)} files were only partly loaded: {', '.join(interrupted)}")
+    if totals['failed']:
+        print(f"{len(totals['failed'])} documents failed:")
+        for file_path, label, reason in totals['failed']:
+            print(f"  {file_path}: {label}: {reason}")
+    return totals
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Load scraped articles into MongoDB.')
+    parser.add_argument('patterns', nargs='*', default=DEFAULT_PATTERNS,
+                        help='JSON/NDJSON files or glob patterns (default: output/articles_*)')
+    parser.add_argument('--mongo-uri', default="mongodb://localhost:27017/")
+    parser.add_argument('--batch-size', type=int, default=BATCH_SIZE)
+    parser.add_argument('--workers', type=int, default=WORKERS, help='files loaded in parallel')
+    parser.add_argument('--normalize-existing', action='store_true',
+                        help='backfill normalized types on documents already in the collection')
+    parser.add_argument('--mode', choices=('upsert', 'insert'), default='upsert',
+                        help='upsert by post_id skipping unchanged documents (default), or plain inserts')
+    args = parser.parse_args()
+
+    # Connect to MongoDB
+    try:
+        collection = connect(args.mongo_uri)
+        collection.database.client.admin.command('ping')
+        print("MongoDB connected successfully!")
+    except Exception as e:
+        print(f"Error connecting to MongoDB: {e}")
+        exit()
+
+    if args.normalize_existing:
+        if normalize_collection(collection, batch_size=args.batch_size):
+            # Backfilled dates and counts change what the rollups, sketches and column index count
+            encode_collection(collection)
+            rebuild_derived(collection)
+
+    files = discover_files(args.patterns)
+    if not files:
+        print("No files matched. Please check the file paths and patterns.")
+        return
+
+    try:
+        load_files(collection, files, batch_size=args.batch_size, workers=args.workers, mode=args.mode)
+    except Exception as e:
+        print(f"An error occurred: {e}")
+
 
-        with open(file_path, encoding='utf-8') as f:
-            data = json.load(f)
-
-            # Ensure data is a list of dictionaries
-            if isinstance(data, list) and all(isinstance(item, dict) for item in data):
-                collection.insert_many(data)
-                print(f"Data from {file_path} inserted successfully!")
-            else:
-                print(f"The JSON data in {file_path} is not in the expected format. It should be a list of dictionaries.")
-except FileNotFoundError:
-    print("One or more files were not found. Please check the file paths and names.")
-except json.JSONDecodeError:
-    print("Error decoding JSON. Please ensure all files contain valid JSON.")
-except UnicodeDecodeError:
-    print("Error decoding one or more files. Please check the files' encodings.")
-except Exception as e:
-    print(f"An error occurred: {e}")
\ No newline at end of file
+if __name__ == '__main__':
+    main()
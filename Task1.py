@@ -1,9 +1,40 @@
 import os
 import json
+import argparse
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 from dataclasses import dataclass
 import requests
+from requests.adapters import HTTPAdapter
+import urllib3
 from bs4 import BeautifulSoup
+from bs4.dammit import EncodingDetector
+import lxml.html
+from lxml import etree
 import re
+import gzip
+import time
+import zlib
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+from crawl_controller import CrawlController
+from crawl_state import CrawlState, content_hash
+from metrics import CrawlMetrics
+
+SITEMAP_INDEX_URL = 'https://www.almayadeen.net/sitemaps/all.xml'
+# Number of articles fetched in parallel and size of the shared connection pool
+DEFAULT_CONCURRENCY = 16
+# Stop the crawl once this many articles have been scraped
+ARTICLE_BUDGET = 10000
+# Flush the NDJSON output to the OS after this many articles
+NDJSON_FLUSH_EVERY = 100
+NDJSON_SUFFIXES = {None: '', 'gzip': '.gz', 'zstd': '.zst'}
+# Bytes read at a time when reading or repairing an NDJSON file
+NDJSON_READ_CHUNK = 1 << 16
 
 @dataclass
 class Article:
@@ -22,113 +53,327 @@ class Article:
     description: str
     classes : list
 
+def create_session(pool_size=DEFAULT_CONCURRENCY):
+    """Create a keep-alive session whose connection pool can serve `pool_size` workers."""
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    return session
+
+def _parse_html(content):
+    """Parse page bytes with lxml, picking the encoding the way BeautifulSoup does."""
+    detector = EncodingDetector(content, is_html=True)
+    encoding = next(iter(detector.encodings), None)
+    parser = lxml.html.HTMLParser(encoding=encoding)
+    try:
+        return etree.fromstring(detector.markup, parser)
+    except etree.XMLSyntaxError:
+        # Empty or unparseable document; treat it as having no elements
+        return None
+
+# BeautifulSoup's get_text() leaves out the contents of these elements
+_NON_TEXT_TAGS = ('script', 'style', 'template')
+
+def _element_text(element):
+    """Return the text of `element` the way BeautifulSoup's get_text() does."""
+    if next(element.iter(*_NON_TEXT_TAGS), None) is None:
+        return element.text_content()
+    parts = []
+    _collect_text(element, parts)
+    return ''.join(parts)
+
+def _collect_text(element, parts):
+    # Comments and processing instructions have a non-string tag and are skipped too
+    if not isinstance(element.tag, str) or element.tag in _NON_TEXT_TAGS:
+        return
+    if element.text:
+        parts.append(element.text)
+    for child in element:
+        _collect_text(child, parts)
+        if child.tail:
+            parts.append(child.tail)
+
+@dataclass
+class SitemapEntry:
+    url: str
+    lastmod: str
+
 class SitemapParser:
-    def __init__(self, sitemap_url):
+    def __init__(self, sitemap_url, session=None):
         self.sitemap_url = sitemap_url
+        self.session = session if session is not None else requests.Session()
 
     def get_monthly_sitemap(self):
-        try:
-            response = requests.get(self.sitemap_url, timeout=10)
-            response.raise_for_status()
-            soup = BeautifulSoup(response.content, "lxml")
-            return [loc.text for loc in soup.find_all('loc')]
-        except requests.RequestException as e:
-            print(f"Error fetching sitemap: {e}")
-            return []
+        return [entry.url for entry in self.iter_entries(self.sitemap_url)]
 
     def get_article_urls(self, sitemap_url):
+        return [entry.url for entry in self.iter_entries(sitemap_url)]
+
+    def iter_entries(self, sitemap_url):
+        """Stream the <url>/<sitemap> entries of a sitemap as SitemapEntry objects.
+
+        The response body is parsed incrementally while it downloads and each entry
+        is discarded once yielded, so memory stays flat for any sitemap size.
+        """
         try:
-            response = requests.get(sitemap_url, timeout=10)
-            response.raise_for_status()
-            soup = BeautifulSoup(response.content, "lxml")
-            return [loc.text for loc in soup.find_all('loc')]
-        except requests.RequestException as e:
+            with self.session.get(sitemap_url, timeout=10, stream=True) as response:
+                response.raise_for_status()
+                # Let urllib3 undo any gzip/deflate transfer encoding for us
+                response.raw.decode_content = True
+                for _, element in etree.iterparse(response.raw, events=('end',), tag=('{*}url', '{*}sitemap')):
+                    loc = element.findtext('{*}loc')
+                    lastmod = element.findtext('{*}lastmod')
+                    # Free the entry and everything parsed before it
+                    element.clear()
+                    while element.getprevious() is not None:
+                        del element.getparent()[0]
+                    if loc:
+                        yield SitemapEntry(url=loc.strip(), lastmod=lastmod.strip() if lastmod else None)
+        except (requests.RequestException, urllib3.exceptions.HTTPError) as e:
+            # urllib3 errors surface directly when the stream breaks mid-read
             print(f"Error fetching {sitemap_url}: {e}")
-            return []
+        except etree.XMLSyntaxError as e:
+            print(f"Error parsing sitemap {sitemap_url}: {e}")
 
 class ArticleScraper:
-    def __init__(self, url):
+    def __init__(self, url, session=None, lastmod=None, controller=None, metrics=None):
         self.url = url
+        # Fall back to the module-level requests API when no shared session is given
+        self.session = session if session is not None else requests
+        # Sitemap <lastmod> of the article, recorded in the crawl state after fetching
+        self.lastmod = lastmod
+        # Optional CrawlController that paces and retries the request
+        self.controller = controller
+        # Optional CrawlMetrics (or StageRecorder) that receives per-stage timings
+        self.metrics = metrics
     def _calculate_word_count(self, text):
         words = re.findall(r'\w+', text)
         return len(words)
 
-    def scrape(self):
+    def scrape(self, crawl_state=None, archive=None):
+        """Fetch and extract the article. Returns (article, crawl_record).
+
+        With a CrawlState the request is made conditional on the previous fetch, and
+        the article is None when the server answers 304 or the extracted content
+        hashes the same as last time. Otherwise crawl_record holds what to store in
+        the CrawlState; the caller records it once the article has been persisted,
+        so an article that is never written is fetched again on the next run.
+        With a PageArchive the raw page is archived as well.
+        """
+        response = self.fetch(crawl_state, archive)
+        if response is None:
+            return None, None
+        article = self.parse(response.content)
+        if archive is not None:
+            archive.set_post_id(self.url, article.post_id)
+        if crawl_state is None:
+            return article, None
+        record = self.check_crawl_state(crawl_state, article, response.headers)
+        if record is None:
+            return None, None
+        return article, record
+
+    def fetch(self, crawl_state=None, archive=None):
+        """Download (and optionally archive) the page. Returns the response, or None on errors and 304s."""
         try:
-            response = requests.get(self.url, timeout=10)
+            start = time.perf_counter()
+            headers = crawl_state.conditional_headers(self.url) if crawl_state is not None else None
+            if self.controller is not None:
+                response = self.controller.get(self.session, self.url, headers=headers)
+            else:
+                response = self.session.get(self.url, timeout=10, headers=headers)
+            if crawl_state is not None and response.status_code == 304:
+                print(f"Not modified: {self.url}")
+                crawl_state.record(self.url, lastmod=self.lastmod)
+                return None
             response.raise_for_status()
-            soup = BeautifulSoup(response.content, "lxml")
-
-            # Extracting title
-            title_tag = soup.find('h2')
-            title = title_tag.get_text() if title_tag else "No Title Found"
-
-            # Extracting keywords
-            meta_keywords = soup.find('meta', attrs={'name': 'keywords'})
-            keywords = meta_keywords.get('content').split(',') if meta_keywords else []
-
-            # Extracting post_id
-            postid_meta_tag = soup.find('meta', attrs={'name': 'postid'})
-            post_id = postid_meta_tag['content'] if postid_meta_tag else None
-
-            # Extracting thumbnail
-            thumbnail_tag = soup.find('meta', property='og:image')
-            thumbnail = thumbnail_tag['content'] if thumbnail_tag else ""
-
-            # Extracting publication date
-            publication_date_tag = soup.find('meta', property='article:published_time')
-            publication_date = publication_date_tag['content'] if publication_date_tag else ""
-
-            # Extracting last updated date
-            modified_time_meta_tag = soup.find('meta', attrs={'property': 'article:modified_time'})
-            modified_time = modified_time_meta_tag['content'] if modified_time_meta_tag else None
-
-            # Extracting author
-            author_meta = soup.find('meta', attrs={'name': 'author'})
-            author = author_meta['content'] if author_meta else 'No author available'
-
-            # Extracting full text
-            paragraphs = soup.find_all('p')
-            full_text = ' '.join([p.get_text() for p in paragraphs])
-
-            # Extract video duration
-            video_meta = soup.find('meta', attrs={'property': 'og:video_duration'})
-            video_duration = video_meta['content'] if video_meta else "No video duration available"
-            # Extracting language
-            language_tag = soup.find('html')
-            language = language_tag.get('lang') if language_tag else "No language available"
-            # Extracting word count
-            word_count = self._calculate_word_count(full_text)
-            # Extracting description
-            meta_description = soup.find('meta', attrs={'name': 'description'})
-            description = meta_description['content'] if meta_description else None
-
-            # Extracting classes
-            classes_content = soup.find('script', attrs={'type': 'text/tawsiyat'})
-            classes = json.loads(classes_content.string)['classes'] if classes_content else []
-
-
-            return Article(
-                url=self.url,
-                post_id=post_id,
-                title=title,
-                keywords=keywords,
-                thumbnail=thumbnail,
-                publication_date=publication_date,
-                last_updated=modified_time,
-                author=author,
-                full_text=full_text,
-                video_duration = video_duration,
-                language = language,
-                word_count=word_count,
-                description = description,
-                classes=classes
-
-            )
+            if self.metrics is not None:
+                self.metrics.observe_stage('fetch', time.perf_counter() - start)
+                self.metrics.observe_stage('server', response.elapsed.total_seconds())
+                self.metrics.bytes_in(len(response.content))
+            if archive is not None:
+                archive.store(self.url, response.content, response.headers)
+            return response
 
         except requests.RequestException as e:
             print(f"Error scraping article {self.url}: {e}")
+            if self.metrics is not None:
+                self.metrics.error('fetch', e)
+            if self.controller is not None:
+                self.controller.add_failed(SitemapEntry(url=self.url, lastmod=self.lastmod), e)
+            return None
+
+    def check_crawl_state(self, crawl_state, article, headers):
+        """Compare a fetched article with the crawl state.
+
+        Returns the fields to record once the article is persisted, or None if its
+        content hash is unchanged. An unchanged article was already persisted, so it
+        is recorded (with the new <lastmod> and validators) right away.
+        """
+        previous = crawl_state.get(self.url)
+        record = {
+            'lastmod': self.lastmod,
+            'etag': headers.get('ETag'),
+            'last_modified': headers.get('Last-Modified'),
+            'post_id': article.post_id,
+            'content_hash': content_hash(article),
+        }
+        if previous is not None and previous['content_hash'] == record['content_hash']:
+            print(f"Unchanged: {self.url}")
+            crawl_state.record(self.url, **record)
             return None
+        return record
+
+    def parse(self, content):
+        """Extract an Article from raw page bytes in a single walk over the lxml tree.
+
+        Returns the same values as `parse_with_soup`, but collects every field while
+        visiting each element once instead of running a find() per field.
+        """
+        start = time.perf_counter()
+        root = _parse_html(content)
+        parsed = time.perf_counter()
+
+        title_tag = None
+        language_tag = None
+        classes_content = None
+        paragraphs = []
+        # First <meta> seen for each name=/property= value, like soup.find()
+        meta_names = {}
+        meta_properties = {}
+
+        for element in (root.iter() if root is not None else ()):
+            tag = element.tag
+            if tag == 'meta':
+                name = element.get('name')
+                if name is not None and name not in meta_names:
+                    meta_names[name] = element
+                prop = element.get('property')
+                if prop is not None and prop not in meta_properties:
+                    meta_properties[prop] = element
+            elif tag == 'p':
+                paragraphs.append(element)
+            elif tag == 'h2':
+                if title_tag is None:
+                    title_tag = element
+            elif tag == 'script':
+                if classes_content is None and element.get('type') == 'text/tawsiyat':
+                    classes_content = element
+            elif tag == 'html':
+                if language_tag is None:
+                    language_tag = element
+
+        def meta_content(tags, key, default):
+            meta = tags.get(key)
+            return meta.get('content') if meta is not None else default
+
+        title = _element_text(title_tag) if title_tag is not None else "No Title Found"
+        meta_keywords = meta_names.get('keywords')
+        keywords = meta_keywords.get('content').split(',') if meta_keywords is not None else []
+        full_text = ' '.join([_element_text(p) for p in paragraphs])
+        language = language_tag.get('lang') if language_tag is not None else "No language available"
+        classes_start = time.perf_counter()
+        classes = json.loads(classes_content.text)['classes'] if classes_content is not None else []
+        classes_end = time.perf_counter()
+
+        article = Article(
+            url=self.url,
+            post_id=meta_content(meta_names, 'postid', None),
+            title=title,
+            keywords=keywords,
+            thumbnail=meta_content(meta_properties, 'og:image', ""),
+            publication_date=meta_content(meta_properties, 'article:published_time', ""),
+            last_updated=meta_content(meta_properties, 'article:modified_time', None),
+            author=meta_content(meta_names, 'author', 'No author available'),
+            full_text=full_text,
+            video_duration=meta_content(meta_properties, 'og:video_duration', "No video duration available"),
+            language=language,
+            word_count=self._calculate_word_count(full_text),
+            description=meta_content(meta_names, 'description', None),
+            classes=classes
+        )
+
+        if self.metrics is not None:
+            self.metrics.observe_stage('parse', parsed - start)
+            self.metrics.observe_stage('classes_json', classes_end - classes_start)
+            # Extraction time excludes the JSON decode reported on its own above
+            self.metrics.observe_stage('extract', time.perf_counter() - parsed - (classes_end - classes_start))
+        return article
+
+    def parse_with_soup(self, content):
+        """Reference extraction with one BeautifulSoup find() per field.
+
+        Kept to check and benchmark `parse` against; the crawler uses `parse`.
+        """
+        soup = BeautifulSoup(content, "lxml")
+
+        # Extracting title
+        title_tag = soup.find('h2')
+        title = title_tag.get_text() if title_tag else "No Title Found"
+
+        # Extracting keywords
+        meta_keywords = soup.find('meta', attrs={'name': 'keywords'})
+        keywords = meta_keywords.get('content').split(',') if meta_keywords else []
+
+        # Extracting post_id
+        postid_meta_tag = soup.find('meta', attrs={'name': 'postid'})
+        post_id = postid_meta_tag['content'] if postid_meta_tag else None
+
+        # Extracting thumbnail
+        thumbnail_tag = soup.find('meta', property='og:image')
+        thumbnail = thumbnail_tag['content'] if thumbnail_tag else ""
+
+        # Extracting publication date
+        publication_date_tag = soup.find('meta', property='article:published_time')
+        publication_date = publication_date_tag['content'] if publication_date_tag else ""
+
+        # Extracting last updated date
+        modified_time_meta_tag = soup.find('meta', attrs={'property': 'article:modified_time'})
+        modified_time = modified_time_meta_tag['content'] if modified_time_meta_tag else None
+
+        # Extracting author
+        author_meta = soup.find('meta', attrs={'name': 'author'})
+        author = author_meta['content'] if author_meta else 'No author available'
+
+        # Extracting full text
+        paragraphs = soup.find_all('p')
+        full_text = ' '.join([p.get_text() for p in paragraphs])
+
+        # Extract video duration
+        video_meta = soup.find('meta', attrs={'property': 'og:video_duration'})
+        video_duration = video_meta['content'] if video_meta else "No video duration available"
+        # Extracting language
+        language_tag = soup.find('html')
+        language = language_tag.get('lang') if language_tag else "No language available"
+        # Extracting word count
+        word_count = self._calculate_word_count(full_text)
+        # Extracting description
+        meta_description = soup.find('meta', attrs={'name': 'description'})
+        description = meta_description['content'] if meta_description else None
+
+        # Extracting classes
+        classes_content = soup.find('script', attrs={'type': 'text/tawsiyat'})
+        classes = json.loads(classes_content.string)['classes'] if classes_content else []
+
+
+        return Article(
+            url=self.url,
+            post_id=post_id,
+            title=title,
+            keywords=keywords,
+            thumbnail=thumbnail,
+            publication_date=publication_date,
+            last_updated=modified_time,
+            author=author,
+            full_text=full_text,
+            video_duration = video_duration,
+            language = language,
+            word_count=word_count,
+            description = description,
+            classes=classes
+
+        )
 
 class FileUtility:
     def __init__(self, output_dir):
@@ -140,9 +385,273 @@ class FileUtility:
         with open(file_path, 'w', encoding='utf-8') as file:
             json.dump([article.__dict__ for article in articles], file, ensure_ascii=False, indent=4)
 
-def main():
-    sitemap_parser = SitemapParser('https://www.almayadeen.net/sitemaps/all.xml')
-    file_utility = FileUtility(output_dir='output')
+    def merge_into_json(self, articles, year, month):
+        """Update the month's file in place, replacing articles by URL and appending new ones."""
+        file_path = os.path.join(self.output_dir, f'articles_{year}_{month}.json')
+        existing = []
+        if os.path.exists(file_path):
+            with open(file_path, encoding='utf-8') as file:
+                existing = json.load(file)
+
+        updated = {article.url: article.__dict__ for article in articles}
+        merged = [updated.pop(item['url'], item) for item in existing]
+        merged.extend(updated.values())
+
+        with open(file_path, 'w', encoding='utf-8') as file:
+            json.dump(merged, file, ensure_ascii=False, indent=4)
+
+    def open_ndjson(self, year, month, compression=None, flush_every=NDJSON_FLUSH_EVERY, fsync=False):
+        """Open the month's NDJSON file for appending articles one at a time."""
+        suffix = NDJSON_SUFFIXES[compression]
+        file_path = os.path.join(self.output_dir, f'articles_{year}_{month}.ndjson{suffix}')
+        return NDJSONWriter(file_path, compression=compression, flush_every=flush_every, fsync=fsync)
+
+class NDJSONWriter:
+    """Append articles to a file as one compact JSON object per line.
+
+    Each article is written as soon as it is scraped, so a crash only loses what
+    has not been flushed yet. Output can be gzip or zstd compressed; reopening an
+    existing file appends a new compressed member, which iter_ndjson reads through.
+    A file left cut short by a crash is first repaired (see _repair_tail), so the
+    new member never lands behind a truncated one.
+    """
+
+    def __init__(self, path, compression=None, flush_every=NDJSON_FLUSH_EVERY, fsync=False):
+        self.path = path
+        self.flush_every = flush_every
+        self.fsync = fsync
+        self.count = 0
+        if compression not in NDJSON_SUFFIXES:
+            raise ValueError(f"Unknown compression: {compression}")
+        if compression == 'zstd' and zstandard is None:
+            raise RuntimeError("zstd compression needs the 'zstandard' package")
+        salvaged = _repair_tail(path, compression) if os.path.exists(path) else b''
+        # Appending: only what this writer adds counts towards bytes_written
+        self._start_size = os.path.getsize(path) if os.path.exists(path) else 0
+        self.bytes_written = 0
+        self._raw = open(path, 'ab')
+        if compression is None:
+            self._file = self._raw
+        elif compression == 'gzip':
+            self._file = gzip.GzipFile(fileobj=self._raw, mode='ab')
+        else:
+            self._file = zstandard.ZstdCompressor().stream_writer(self._raw, closefd=False)
+        if salvaged:
+            # The complete records of the truncated member go first into the new one
+            self._file.write(salvaged)
+            recovered = salvaged.count(b'\n')
+            print(f"Recovered {recovered} records from the truncated end of {path}")
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def write(self, article):
+        record = article if isinstance(article, dict) else article.__dict__
+        line = json.dumps(record, ensure_ascii=False, separators=(',', ':'))
+        self._file.write(line.encode('utf-8') + b'\n')
+        self.count += 1
+        if self.count % self.flush_every == 0:
+            self.flush()
+            return True
+        return False
+
+    def flush(self):
+        if self._file is not self._raw:
+            # Push compressed data for the lines so far out of the compressor
+            self._file.flush()
+        self._raw.flush()
+        if self.fsync:
+            os.fsync(self._raw.fileno())
+
+    def close(self):
+        if self._file is not self._raw:
+            self._file.close()
+        self._raw.flush()
+        if self.fsync:
+            os.fsync(self._raw.fileno())
+        self._raw.close()
+        self.bytes_written = os.path.getsize(self.path) - self._start_size
+
+def _compression_of(path):
+    return next((compression for compression, suffix in NDJSON_SUFFIXES.items()
+                 if suffix and path.endswith(suffix)), None)
+
+def _decompressor(compression):
+    if compression == 'gzip':
+        # 16 + MAX_WBITS: expect a gzip header and trailer
+        return zlib.decompressobj(16 + zlib.MAX_WBITS)
+    if zstandard is None:
+        raise RuntimeError("Reading .zst files needs the 'zstandard' package")
+    return zstandard.ZstdDecompressor().decompressobj()
+
+def _read_members(raw, compression):
+    """Decompress a file of concatenated gzip members or zstd frames.
+
+    Yields (data, end) pairs: decompressed bytes, and the offset just past the
+    last member read to its end. A member cut off by a crash yields what could
+    be decompressed of it and leaves `end` before it; corrupt data still raises.
+    """
+    decompressor = _decompressor(compression)
+    position = end = 0
+    for chunk in iter(lambda: raw.read(NDJSON_READ_CHUNK), b''):
+        while chunk:
+            data = decompressor.decompress(chunk)
+            if decompressor.eof:
+                position += len(chunk) - len(decompressor.unused_data)
+                end = position
+                chunk = decompressor.unused_data
+                decompressor = _decompressor(compression)
+            else:
+                position += len(chunk)
+                chunk = b''
+            yield data, end
+
+def _repair_tail(path, compression):
+    """Cut a file left by a crash back to its last complete record.
+
+    Plain files lose their partial last line. Compressed files are cut back to the
+    end of their last complete member; the complete lines decompressed from the
+    truncated member after it are returned, for the writer to put back.
+    Reading the whole file on reopen is the price of appending safely.
+    """
+    with open(path, 'rb+') as raw:
+        size = raw.seek(0, os.SEEK_END)
+        if compression is None:
+            keep = 0
+            while size > keep:
+                step = min(NDJSON_READ_CHUNK, size - keep)
+                raw.seek(size - step)
+                newline = raw.read(step).rfind(b'\n')
+                if newline != -1:
+                    keep = size - step + newline + 1
+                    break
+                size -= step
+            if keep < raw.seek(0, os.SEEK_END):
+                raw.truncate(keep)
+            return b''
+
+        raw.seek(0)
+        end = 0
+        for _, end in _read_members(raw, compression):
+            pass
+        if end == size:
+            return b''
+        raw.seek(end)
+        tail = b''.join(data for data, _ in _read_members(raw, compression))
+        raw.truncate(end)
+        print(f"Truncated an incomplete compressed member at the end of {path}")
+        return tail[:tail.rfind(b'\n') + 1]
+
+def iter_ndjson(path):
+    """Lazily yield the article dicts stored in an NDJSON file (.gz/.zst aware).
+
+    A file cut short by a crash (a truncated compressed member, a partial last
+    line) yields every complete record and then stops instead of raising.
+    """
+    compression = _compression_of(path)
+    with open(path, 'rb') as raw:
+        if compression is None:
+            chunks = iter(lambda: raw.read(NDJSON_READ_CHUNK), b'')
+        else:
+            chunks = (data for data, _ in _read_members(raw, compression))
+        pending = b''
+        for data in chunks:
+            lines = (pending + data).split(b'\n')
+            pending = lines.pop()
+            for line in lines:
+                if line.strip():
+                    yield json.loads(line)
+    if pending.strip():
+        try:
+            record = json.loads(pending)
+        except ValueError:
+            print(f"Skipping the truncated last record of {path}")
+            return
+        yield record
+
+def scrape_articles(entries, session, concurrency=DEFAULT_CONCURRENCY, crawl_state=None, archive=None,
+                    controller=None, metrics=None):
+    """Scrape sitemap entries on a bounded thread pool sharing one session.
+
+    `entries` may be a lazy iterable such as SitemapParser.iter_entries(); only a
+    small window of URLs is submitted ahead of the results being consumed.
+    Yields (url, article, crawl_record) in input order; failed or unchanged articles
+    give None. With a CrawlState, entries whose <lastmod> has not moved are skipped,
+    and the caller records crawl_record once it has persisted the article.
+    With a CrawlController, `concurrency` is the ceiling and the controller decides
+    how many requests are actually in flight.
+    """
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        in_flight = deque()
+        try:
+            for entry in entries:
+                if crawl_state is not None and crawl_state.is_unchanged(entry.url, entry.lastmod):
+                    continue
+                scraper = ArticleScraper(entry.url, session, lastmod=entry.lastmod, controller=controller,
+                                         metrics=metrics)
+                in_flight.append((entry.url, executor.submit(scraper.scrape, crawl_state, archive)))
+                if metrics is not None:
+                    metrics.queue_depth('in_flight', len(in_flight))
+                if len(in_flight) >= 2 * concurrency:
+                    url, future = in_flight.popleft()
+                    yield (url, *future.result())
+            while in_flight:
+                url, future = in_flight.popleft()
+                yield (url, *future.result())
+        finally:
+            # Don't fetch queued pages nobody is going to read
+            for _, future in in_flight:
+                future.cancel()
+
+def write_ndjson(writer, article, metrics=None):
+    """Write one article; returns True if the write flushed the file."""
+    if metrics is None:
+        return writer.write(article)
+    with metrics.stage('persist'):
+        return writer.write(article)
+
+def record_crawl_state(crawl_state, pending):
+    """Record the crawl state of persisted articles, given as (url, crawl_record) pairs."""
+    if crawl_state is not None:
+        for url, record in pending:
+            crawl_state.record(url, **record)
+    pending.clear()
+
+def sitemap_month(sitemap):
+    """(year, month) a monthly sitemap's output files are named by, e.g. ('2024', '1.xml') for sitemap-2024-1.xml."""
+    year, month = sitemap.split('/')[-1].split('-')[1:3]
+    return year, month
+
+def main(concurrency=DEFAULT_CONCURRENCY, state_path=None, parsers=None, archive_dir=None,
+         output_format='json', compression=None, sitemap_url=SITEMAP_INDEX_URL, output_dir='output',
+         budget=ARTICLE_BUDGET, adaptive=False, metrics_dir=None, metrics_port=None):
+    session = create_session(concurrency)
+    sitemap_parser = SitemapParser(sitemap_url, session=session)
+    file_utility = FileUtility(output_dir=output_dir)
+    # An incremental re-crawl only fetches new or changed articles
+    crawl_state = CrawlState(state_path) if state_path else None
+    # Keep the raw pages so extraction can be re-run without re-crawling
+    archive = None
+    if archive_dir:
+        from page_archive import PageArchive
+        archive = PageArchive(archive_dir)
+    # Per-stage timings, bytes, errors and queue depths
+    metrics = CrawlMetrics() if metrics_dir or metrics_port else None
+    if metrics_port:
+        metrics.serve(metrics_port)
+        print(f"Serving crawl metrics on http://127.0.0.1:{metrics_port}/metrics")
+    # Adapt in-flight requests to how the site is coping, and retry failures
+    controller = CrawlController(max_concurrency=concurrency, metrics=metrics) if adaptive else None
+    # With parser processes, fetching, parsing and writing run as separate pipeline stages
+    crawl_pipeline = None
+    if parsers:
+        from pipeline import CrawlPipeline
+        crawl_pipeline = CrawlPipeline(session, fetchers=concurrency, parsers=parsers,
+                                       crawl_state=crawl_state, archive=archive, controller=controller,
+                                       metrics=metrics)
 
     monthly_sitemaps = sitemap_parser.get_monthly_sitemap()
     print(f"Found {len(monthly_sitemaps)} monthly sitemaps.")
@@ -150,33 +659,126 @@ def main():
     total_articles_scraped = 0
 
     for sitemap in monthly_sitemaps:
-        if total_articles_scraped >= 10000:
+        if total_articles_scraped >= budget:
             break
 
         print(f"Processing sitemap: {sitemap}")
-        article_urls = sitemap_parser.get_article_urls(sitemap)
-        print(f"Found {len(article_urls)} articles in this sitemap.")
+        # Scraping starts as soon as the first <loc> of the sitemap has been parsed
+        article_entries = sitemap_parser.iter_entries(sitemap)
 
+        year, month = sitemap_month(sitemap)
         articles = []
-
-        for url in article_urls:
-            if total_articles_scraped >= 10000:
-                break
-
-            print(f"Scraping article: {url}")
-            scraper = ArticleScraper(url)
-            article = scraper.scrape()
-
-            if article is not None:
-                articles.append(article)
-                total_articles_scraped += 1
-                print(f"Articles scraped so far: {total_articles_scraped}")
-
-        year, month = sitemap.split('/')[-1].split('-')[1:3]
-        file_utility.save_to_json(articles, year, month)
-        print(f"Saved {len(articles)} articles for {year}-{month}")
+        # (url, crawl_record) of scraped articles not yet on disk; recorded in the crawl
+        # state only once written, so a crash or the budget cut-off never marks them done
+        pending_state = []
+        # NDJSON output is written article by article instead of once per month
+        ndjson_writer = file_utility.open_ndjson(year, month, compression) if output_format == 'ndjson' else None
+
+        def collect(results, message):
+            """Persist (or queue for the month's JSON file) each scraped article until the budget is reached."""
+            nonlocal total_articles_scraped
+            for url, article, record in results:
+                if article is not None:
+                    if archive is not None:
+                        archive.set_sitemap(url, sitemap)
+                    if record is not None:
+                        pending_state.append((url, record))
+                    if ndjson_writer is not None:
+                        if write_ndjson(ndjson_writer, article, metrics):
+                            record_crawl_state(crawl_state, pending_state)
+                    else:
+                        articles.append(article)
+                    total_articles_scraped += 1
+                    if metrics is not None:
+                        metrics.page_scraped()
+                    print(f"{message}: {url} ({total_articles_scraped} so far)")
+                if total_articles_scraped >= budget:
+                    break
+            results.close()
+
+        if crawl_pipeline is not None:
+            results = crawl_pipeline.run(article_entries)
+        else:
+            results = scrape_articles(article_entries, session, concurrency, crawl_state, archive, controller,
+                                      metrics)
+        collect(results, "Scraped article")
+
+        # Give articles that kept failing one more go once the month's crawl has cooled down
+        failed_entries = controller.take_failed() if controller is not None else []
+        if failed_entries and total_articles_scraped < budget:
+            print(f"Retrying {len(failed_entries)} failed articles")
+            collect(scrape_articles(failed_entries, session, concurrency, crawl_state, archive, controller, metrics),
+                    "Scraped article on retry")
+            # Anything still failing is reported, not silently dropped
+            still_failed = controller.take_failed()
+            if still_failed:
+                print(f"Gave up on {len(still_failed)} articles: {', '.join(entry.url for entry in still_failed)}")
+
+        if ndjson_writer is not None:
+            # Each article's write was already timed as a 'persist' stage by write_ndjson
+            ndjson_writer.close()
+            print(f"Wrote {ndjson_writer.count} articles for {year}-{month} to {ndjson_writer.path}")
+            if metrics is not None:
+                metrics.bytes_out(ndjson_writer.bytes_written)
+        else:
+            # JSON output is persisted once per month, and timed once
+            persist_start = time.perf_counter()
+            if crawl_state is not None:
+                file_utility.merge_into_json(articles, year, month)
+                print(f"Updated {len(articles)} articles for {year}-{month}")
+            else:
+                file_utility.save_to_json(articles, year, month)
+                print(f"Saved {len(articles)} articles for {year}-{month}")
+            if metrics is not None:
+                metrics.observe_stage('persist', time.perf_counter() - persist_start)
+                metrics.bytes_out(os.path.getsize(os.path.join(output_dir, f'articles_{year}_{month}.json')))
+        record_crawl_state(crawl_state, pending_state)
+
+    if crawl_pipeline is not None:
+        crawl_pipeline.close()
+    if crawl_state is not None:
+        crawl_state.close()
+    if archive is not None:
+        archive.close()
 
     print(f"Total articles scraped: {total_articles_scraped}")
 
+    if metrics is not None:
+        summary = metrics.summary()
+        print(f"Crawl rate: {summary['pages_per_second']} pages/sec")
+        if metrics_dir:
+            os.makedirs(metrics_dir, exist_ok=True)
+            metrics.write_prometheus(os.path.join(metrics_dir, 'crawl_metrics.prom'))
+            metrics.write_summary(os.path.join(metrics_dir, 'crawl_metrics.json'))
+            print(f"Crawl metrics written to {metrics_dir}")
+
 if __name__ == '__main__':
-    main()
\ No newline at end of file
+    parser = argparse.ArgumentParser(description='Scrape almayadeen.net articles.')
+    parser.add_argument('--sitemap', default=SITEMAP_INDEX_URL,
+                        help='sitemap index listing the monthly sitemaps')
+    parser.add_argument('--output', default='output',
+                        help='directory for the monthly output files')
+    parser.add_argument('--budget', type=int, default=ARTICLE_BUDGET,
+                        help='stop after this many articles')
+    parser.add_argument('--concurrency', type=int, default=DEFAULT_CONCURRENCY,
+                        help='number of articles fetched in parallel')
+    parser.add_argument('--state', metavar='PATH',
+                        help='crawl state database; enables incremental re-crawls')
+    parser.add_argument('--parsers', type=int, default=0,
+                        help='run as a pipeline with this many parser processes (0 parses in the fetch threads)')
+    parser.add_argument('--archive', metavar='DIR',
+                        help='archive raw pages here for later re-extraction (see page_archive.py)')
+    parser.add_argument('--format', choices=('json', 'ndjson'), default='json',
+                        help='monthly JSON arrays, or NDJSON streamed as articles are scraped')
+    parser.add_argument('--compress', choices=('gzip', 'zstd'),
+                        help='compress NDJSON output')
+    parser.add_argument('--adaptive', action='store_true',
+                        help='adapt concurrency to latency/errors and retry failed articles')
+    parser.add_argument('--metrics', metavar='DIR',
+                        help='write crawl_metrics.prom and crawl_metrics.json here at the end of the run')
+    parser.add_argument('--metrics-port', type=int,
+                        help='serve live crawl metrics on this port')
+    args = parser.parse_args()
+    main(concurrency=args.concurrency, state_path=args.state, parsers=args.parsers, archive_dir=args.archive,
+         output_format=args.format, compression=args.compress, sitemap_url=args.sitemap, output_dir=args.output,
+         budget=args.budget, adaptive=args.adaptive, metrics_dir=args.metrics, metrics_port=args.metrics_port)
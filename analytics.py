@@ -0,0 +1,124 @@
+import argparse
+import json
+import time
+
+from parquet_export import SNAPSHOT_DIR
+from vocabulary import display_order, vocabulary_key
+
+try:
+    import pyarrow as pa
+    import pyarrow.compute as pc
+    import pyarrow.dataset as ds
+except ImportError:
+    pa = pc = ds = None
+
+
+def _counts(array):
+    """(value, count) pairs of an Arrow array, nulls included, most frequent first."""
+    counts = pc.value_counts(array)
+    values = counts.field('values')
+    if pa.types.is_dictionary(values.type):
+        values = values.cast(values.type.value_type)
+    pairs = list(zip(values.to_pylist(), counts.field('counts').to_pylist()))
+    pairs.sort(key=lambda pair: -pair[1])
+    return pairs
+
+
+def _folded(pairs):
+    """Merge the counts of spellings the vocabulary gives one id, as the id-keyed rollups do.
+
+    Each merged value is shown by its preferred spelling, like the vocabulary's display value.
+    """
+    counts, spellings = {}, {}
+    for value, count in pairs:
+        if value is not None:
+            value = ' '.join(str(value).split())
+            if not vocabulary_key(value):
+                continue
+        key = vocabulary_key(value) if value is not None else None
+        counts[key] = counts.get(key, 0) + count
+        spellings.setdefault(key, []).append(value)
+    folded = [(min(spellings[key], key=display_order) if key is not None else None, count)
+              for key, count in counts.items()]
+    folded.sort(key=lambda pair: -pair[1])
+    return folded
+
+
+def _by_key(pairs):
+    """Like the rollup collections sorted by _id: nulls first, then ascending keys."""
+    return sorted(pairs, key=lambda pair: (pair[0] is not None, pair[0] if pair[0] is not None else 0))
+
+
+def _top(pairs, limit=10):
+    return [{"_id": key, "count": count} for key, count in pairs[:limit]]
+
+
+def _days(table):
+    dated = pc.drop_null(table['published_time'])
+    return pc.strftime(dated, format='%Y-%m-%d')
+
+
+# The statistics of app.py's STATISTICS, in the same response shapes, computed with
+# columnar scans of the snapshot instead of the rollup collections. Keywords, classes
+# and authors are folded by vocabulary key, as the API counts them by vocabulary id.
+STATISTICS = {
+    'top_keywords': (['keywords'], lambda t: _top(_folded(_counts(pc.list_flatten(t['keywords']))))),
+    'top_authors': (['author'], lambda t: _top(_folded(_counts(t['author'])))),
+    'top_classes': (['classes'], lambda t: {
+        str(key): f"({count} articles)" for key, count in _folded(_counts(pc.list_flatten(t['classes'])))[:10]}),
+    'articles_by_date': (['published_time'], lambda t: dict(_by_key(_counts(_days(t))))),
+    'articles_by_word_count': (['word_count'], lambda t: {
+        f"{key} words": count for key, count in _by_key(_counts(t['word_count']))}),
+    'articles_by_language': (['language'], lambda t: {
+        f"{key}": count for key, count in _by_key(_counts(t['language']))}),
+    'articles_by_classes': (['classes'], lambda t: {
+        f"{key}": count for key, count in sorted(_folded(_counts(pc.list_flatten(t['classes']))),
+                                                 key=lambda pair: str(pair[0]))}),
+    'articles_by_keyword_count': (['keyword_count'], lambda t: [
+        {"keyword_count": key, "article_count": count} for key, count in _by_key(_counts(t['keyword_count']))]),
+}
+
+
+def open_snapshot(path=SNAPSHOT_DIR):
+    if ds is None:
+        raise RuntimeError("Reading snapshots needs the 'pyarrow' package")
+    return ds.dataset(path, format='parquet', partitioning='hive')
+
+
+def compute(dataset, names, year=None, month=None):
+    """Run the named statistics over one scan of only the columns they need.
+
+    year/month select partitions, so other months' files are never opened.
+    """
+    columns = sorted({column for name in names for column in STATISTICS[name][0]})
+    condition = None
+    if year is not None:
+        condition = ds.field('year') == year
+    if month is not None:
+        condition = (ds.field('month') == month) if condition is None else condition & (ds.field('month') == month)
+    table = dataset.to_table(columns=columns, filter=condition)
+    return {name: STATISTICS[name][1](table) for name in names}
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Compute the API statistics offline from a Parquet snapshot.')
+    parser.add_argument('stats', nargs='*', help=f"statistics to compute (default: all): {', '.join(STATISTICS)}")
+    parser.add_argument('--snapshot', default=SNAPSHOT_DIR)
+    parser.add_argument('--year', type=int)
+    parser.add_argument('--month', type=int)
+    args = parser.parse_args()
+
+    names = args.stats or list(STATISTICS)
+    unknown = [name for name in names if name not in STATISTICS]
+    if unknown:
+        print(f"Unknown statistics: {', '.join(unknown)}")
+        return
+
+    start = time.perf_counter()
+    result = compute(open_snapshot(args.snapshot), names, args.year, args.month)
+    print(json.dumps(result, ensure_ascii=False, indent=2))
+    print(f"Computed {len(names)} statistics in {time.perf_counter() - start:.3f}s")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,98 @@
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+from pymongo import monitoring
+
+from metrics import MetricsRegistry
+
+# Mongo commands slower than this (seconds) are logged with their query plan
+SLOW_COMMAND_SECONDS = 0.1
+# Slow commands kept for /metrics/slow_queries
+SLOW_LOG_SIZE = 100
+# Commands that carry a query worth explaining
+EXPLAINABLE = frozenset(['find', 'aggregate', 'count', 'distinct'])
+# Driver-added fields that the explain command does not accept inside the explained command
+_SESSION_FIELDS = ('lsid', 'txnNumber', 'autocommit', 'startTransaction')
+
+
+class ApiMetrics(MetricsRegistry):
+    """API instrumentation: per-route request latency, errors, and Mongo command timings."""
+
+    def __init__(self):
+        super().__init__('api')
+
+    def request(self, route, method, status, seconds):
+        self.observe('request_seconds', seconds, route=route, method=method)
+        self.inc('requests_total', route=route, method=method, status=status)
+
+    def error(self, route, error):
+        self.inc('errors_total', route=route, type=type(error).__name__)
+
+    def command(self, name, seconds, ok):
+        self.observe('mongo_command_seconds', seconds, command=name)
+        self.inc('mongo_commands_total', command=name, outcome='ok' if ok else 'failed')
+
+
+class CommandMetrics(monitoring.CommandListener):
+    """pymongo listener that times every command and keeps a log of slow ones with their plans.
+
+    Plans are fetched on a background thread (the listener must not block the driver),
+    with the command re-run as `explain` at queryPlanner verbosity.
+    """
+
+    def __init__(self, metrics, threshold=SLOW_COMMAND_SECONDS, log_size=SLOW_LOG_SIZE):
+        self.metrics = metrics
+        self.threshold = threshold
+        self.client = None
+        self.slow_commands = deque(maxlen=log_size)
+        self._started = {}
+        self._lock = threading.Lock()
+        self._explainer = ThreadPoolExecutor(max_workers=1)
+
+    def attach(self, client):
+        """The client used to run explain; set once the MongoClient exists."""
+        self.client = client
+
+    def started(self, event):
+        if event.command_name in EXPLAINABLE:
+            with self._lock:
+                self._started[(event.connection_id, event.request_id)] = (event.database_name, event.command)
+
+    def succeeded(self, event):
+        self._finished(event, ok=True)
+
+    def failed(self, event):
+        self._finished(event, ok=False)
+
+    def _finished(self, event, ok):
+        seconds = event.duration_micros / 1e6
+        self.metrics.command(event.command_name, seconds, ok)
+        with self._lock:
+            started = self._started.pop((event.connection_id, event.request_id), None)
+        if started is not None and seconds >= self.threshold:
+            database, command = started
+            entry = {
+                'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+                'command': event.command_name,
+                'database': database,
+                'seconds': round(seconds, 4),
+                'query': {key: value for key, value in command.items()
+                          if not key.startswith('$') and key not in _SESSION_FIELDS},
+                'plan': None,
+            }
+            self.slow_commands.append(entry)
+            if self.client is not None:
+                self._explainer.submit(self._explain, entry)
+
+    def _explain(self, entry):
+        try:
+            result = self.client[entry['database']].command('explain', entry['query'], verbosity='queryPlanner')
+            planner = result.get('queryPlanner') or result.get('stages', [{}])[0].get('$cursor', {}).get('queryPlanner', {})
+            entry['plan'] = planner.get('winningPlan')
+        except Exception as e:
+            entry['plan'] = f'explain failed: {e}'
+
+    def slow_log(self):
+        return list(self.slow_commands)
@@ -1,108 +1,288 @@
-from flask import Flask, jsonify
+from flask import Flask, Response, g, jsonify, request, stream_with_context
 from pymongo import MongoClient
+from bson import ObjectId, json_util
+from bson.errors import InvalidId
 from datetime import datetime, timedelta, timezone
-import re
+import json
+import threading
+import time
+
+from api_metrics import ApiMetrics, CommandMetrics
+from cache import ResultCache
+from column_index import ColumnIndex
+from indexes import ensure_indexes
+from queries import (AUTHOR_COLLATION, article_details_query, author_filter, coverage_filter, day_range, flag_filter,
+                     longest_articles_pipeline, month_range, popular_keywords_pipeline, range_filter,
+                     recent_articles_query, shortest_articles_pipeline, titles_query, year_range)
+from rollups import rollup_collection
+from search import search_articles
+from sketches import HEAVY_HITTERS, available as sketches_available, load_sketches
+from trending import TrendingEngine
+from vocabulary import Vocabulary
 
 app = Flask(__name__)
 
+# Per-route latency, errors and the timing of every Mongo command, served on /metrics
+metrics = ApiMetrics()
+command_metrics = CommandMetrics(metrics)
+
 # Connect to MongoDB
-client = MongoClient("mongodb://localhost:27017/")
+client = MongoClient("mongodb://localhost:27017/", event_listeners=[command_metrics])
+command_metrics.attach(client)
 db = client["almayadeen"]
 collection = db["articles"]
 
+# Whole-collection aggregates only change when the loader ingests, so their responses are cached
+cache = ResultCache(db)
+
+# Hourly keyword counts of recent articles; started on the first trending request
+trending = TrendingEngine()
+
+# Sorted, memory-mapped published_time/word_count/keyword_count arrays (see column_index.py).
+# When built, the range-count endpoints answer from it instead of querying Mongo.
+column_index = ColumnIndex()
+
+# Id -> keyword/class/author lookups for the id-keyed rollups and class filters
+vocabulary = Vocabulary(db)
+
+
+def create_indexes():
+    try:
+        ensure_indexes(collection)
+    except Exception as e:
+        print(f"Could not create the indexes: {e}")
+
+
+# Whenever the app is loaded, by app.run() or a WSGI server, make sure the indexes exist; in the
+# background, since building them on a large collection can outlast a worker's startup timeout
+threading.Thread(target=create_indexes, daemon=True).start()
+
+# Page size of the list endpoints when no ?limit= is given, and the largest page allowed
+DEFAULT_PAGE_SIZE = 100
+MAX_PAGE_SIZE = 1000
+
+
+@app.before_request
+def start_timer():
+    g.request_start = time.perf_counter()
+
+
+@app.after_request
+def record_request(response):
+    # Streamed responses are timed up to their first byte
+    start = g.pop('request_start', None)
+    if start is not None:
+        metrics.request(request.endpoint or 'unmatched', request.method, response.status_code,
+                        time.perf_counter() - start)
+    return response
+
+
+def report_error(error):
+    """Count an endpoint's error and log it with its traceback; call from the except block."""
+    metrics.error(request.endpoint, error)
+    app.logger.exception(f"An error occurred in {request.endpoint}: {error}")
+
+
+@app.route('/metrics', methods=['GET'])
+def prometheus_metrics():
+    metrics.set_gauge('cache_entries', len(cache))
+    metrics.set_gauge('cache_hits', cache.hits)
+    metrics.set_gauge('cache_misses', cache.misses)
+    return Response(metrics.to_prometheus(), mimetype='text/plain; version=0.0.4')
+
+
+@app.route('/metrics/summary', methods=['GET'])
+def metrics_summary():
+    return jsonify(metrics.summary())
+
+
+@app.route('/metrics/slow_queries', methods=['GET'])
+def slow_queries():
+    # json_util keeps the datetimes and ObjectIds in queries and plans serializable
+    return Response(json_util.dumps(command_metrics.slow_log()), mimetype='application/json')
+
+
+def top_rollup(dimension, limit=10):
+    """Most frequent keys of a rollup collection, as [{"_id": key, "count": n}]."""
+    return list(rollup_collection(db, dimension).find().sort("count", -1).limit(limit))
+
+
+def rollup_counts(dimension):
+    """Every key of a rollup collection with its count, sorted by key."""
+    return list(rollup_collection(db, dimension).find().sort("_id", 1))
+
+
+def named(items):
+    """Rollup items keyed by vocabulary id (author, class, keyword), with each id replaced by its value."""
+    names = vocabulary.values([item['_id'] for item in items], cache.generation())
+    return [dict(item, _id=names[item['_id']]) for item in items]
+
+
+# The statistics behind the aggregate routes, by route name. Each reads only a small rollup
+# collection maintained by the loader, so /dashboard can combine any of them in one request.
+STATISTICS = {
+    'top_keywords': lambda: named(top_rollup('keyword')),
+    'top_authors': lambda: named(top_rollup('author')),
+    'top_classes': lambda: {str(item['_id']): f"({item['count']} articles)" for item in named(top_rollup('class'))},
+    'articles_by_date': lambda: {item['_id']: item['count'] for item in rollup_counts('day')},
+    'articles_by_word_count': lambda: {f"{item['_id']} words": item['count'] for item in rollup_counts('word_count')},
+    'articles_by_language': lambda: {f"{item['_id']}": item['count'] for item in rollup_counts('language')},
+    'articles_by_classes': lambda: {f"{item['_id']}": item['count']
+                                    for item in sorted(named(rollup_counts('class')), key=lambda item: str(item['_id']))},
+    'articles_by_keyword_count': lambda: [
+        {"keyword_count": item.get('_id', 0), "article_count": item.get('count', 0)}
+        for item in rollup_counts('keyword_count')
+    ],
+}
+
+
+def no_sketches():
+    return jsonify({"error": "Approximate answers need the 'numpy' package."}), 501
+
+
+def approximate_top(kind, days=None):
+    """?approx=1 answer from the Count-Min sketch of `kind` ('keyword' or 'class') over the last
+    `days` days (whole archive if None): the top ?limit= keys (default 10) with the error bound.
+
+    Every vocabulary id of the kind is estimated against the merged sketch, so keys heavy only
+    across several days are found too. Keys are shown by their display value as in the exact
+    answers. Counts never undershoot; each may overshoot by at most `max_overcount` with the
+    given probability.
+    """
+    try:
+        limit = int(request.args.get('limit', 10))
+    except ValueError:
+        return jsonify({"error": "Invalid limit parameter."}), 400
+    if not 0 < limit <= HEAVY_HITTERS:
+        return jsonify({"error": f"limit must be between 1 and {HEAVY_HITTERS}."}), 400
+    if not sketches_available():
+        return no_sketches()
+    merged = load_sketches(db, days)
+    sketch = merged.keywords if kind == 'keyword' else merged.classes
+    top = sketch.top(limit, vocabulary.ids(kind, cache.generation()))
+    return jsonify({
+        "approximate": True,
+        "results": named([{"_id": key, "count": count} for key, count in top]),
+        "total": sketch.total,
+        "error_bound": sketch.error_bound(),
+    })
+
+
+@app.route('/distinct_counts', methods=['GET'])
+@cache.cached(ttl=300)
+def distinct_counts():
+    """Approximate distinct authors and keywords, for the last ?days= days or the whole archive."""
+    try:
+        days = int(request.args['days']) if 'days' in request.args else None
+    except ValueError:
+        return jsonify({"error": "Invalid days parameter."}), 400
+    if not sketches_available():
+        return no_sketches()
+
+    merged = load_sketches(db, days)
+    return jsonify({
+        "approximate": True,
+        "articles": merged.articles,
+        "distinct_authors": merged.authors.count(),
+        "distinct_keywords": merged.distinct_keywords.count(),
+        "relative_error": merged.authors.relative_error(),
+    })
+
+
 # Route for getting top keywords
 @app.route('/top_keywords', methods=['GET'])
+@cache.cached(ttl=600)
 def top_keywords():
-    pipeline = [
-        {"$unwind": "$keywords"},
-        {"$group": {"_id": "$keywords", "count": {"$sum": 1}}},
-        {"$sort": {"count": -1}},
-        {"$limit": 10}
-    ]
-    result = list(collection.aggregate(pipeline))
-    return jsonify(result)
+    if request.args.get('approx') == '1':
+        return approximate_top('keyword')
+    return jsonify(STATISTICS['top_keywords']())
 # Route for getting top authors
 @app.route('/top_authors', methods=['GET'])
+@cache.cached(ttl=600)
 def top_authors():
-    pipeline = [
-        {"$group": {"_id": "$author", "count": {"$sum": 1}}},
-        {"$sort": {"count": -1}},
-        {"$limit": 10}
-    ]
-    result = list(collection.aggregate(pipeline))
-    return jsonify(result)
+    return jsonify(STATISTICS['top_authors']())
 
 # Route for getting articles by publication date
 @app.route('/articles_by_date', methods=['GET'])
+@cache.cached(ttl=300)
 def articles_by_date():
-    pipeline = [
-        {"$match": {"published_time": {"$ne": None}}},
-        {"$group": {
-            "_id": {"$dateToString": {"format": "%Y-%m-%d", "date": "$published_time"}},
-            "count": {"$sum": 1}
-        }},
-        {"$sort": {"_id": 1}}
-    ]
-    result = list(collection.aggregate(pipeline))
-
-    # Format the result
-    formatted_result = {item['_id']: item['count'] for item in result}
-
-    return jsonify(formatted_result)
+    return jsonify(STATISTICS['articles_by_date']())
 
 # Route for getting articles by word count
 @app.route('/articles_by_word_count', methods=['GET'])
+@cache.cached(ttl=600)
 def articles_by_word_count():
-    pipeline = [
-        {"$group": {
-            "_id": "$word_count",
-            "count": {"$sum": 1}
-        }},
-        {"$sort": {"_id": 1}}
-    ]
+    return jsonify(STATISTICS['articles_by_word_count']())
 
-    result = list(collection.aggregate(pipeline))
 
-    # Format the result
-    formatted_result = {f"{item['_id']} words": item['count'] for item in result}
+@app.route('/articles_by_language', methods=['GET'])
+@cache.cached(ttl=600)
+def articles_by_language():
+    return jsonify(STATISTICS['articles_by_language']())
 
-    return jsonify(formatted_result)
 
+@app.route('/articles_by_classes', methods=['GET'])
+@cache.cached(ttl=600)
+def articles_by_classes():
+    return jsonify(STATISTICS['articles_by_classes']())
 
-@app.route('/articles_by_language', methods=['GET'])
-def articles_by_language():
-    pipeline = [
-        {"$group": {
-            "_id": "$language",  # Group by the language field
-            "count": {"$sum": 1}  # Count the number of articles per language
-        }},
-        {"$sort": {"_id": 1}}  # Sort by language alphabetically
-    ]
 
-    result = list(collection.aggregate(pipeline))
+@app.route('/dashboard', methods=['GET'])
+@cache.cached(ttl=300)
+def dashboard():
+    """Several statistics in one response: ?stats=top_keywords,top_authors (default: all)."""
+    requested = [name.strip() for name in request.args.get('stats', '').split(',') if name.strip()]
+    unknown = [name for name in requested if name not in STATISTICS]
+    if unknown:
+        return jsonify({"error": f"Unknown statistics: {', '.join(unknown)}",
+                        "available": sorted(STATISTICS)}), 400
 
-    # Format the result
-    formatted_result = {f"{item['_id']}": item['count'] for item in result}
+    try:
+        return jsonify({name: STATISTICS[name]() for name in requested or STATISTICS})
 
-    return jsonify(formatted_result)
+    except Exception as e:
+        # Log and count the exception and return a 500 status code with error message
+        report_error(e)
+        return jsonify({"error": f"An error occurred while building the dashboard: {e}"}), 500
 
 
-@app.route('/articles_by_classes', methods=['GET'])
-def articles_by_classes():
-    pipeline = [
-        {"$group": {
-            "_id": "$classes",  # Group by the classes field
-            "count": {"$sum": 1}  # Count the number of articles per class
-        }},
-        {"$sort": {"_id": 1}}  # Sort by class in ascending order
-    ]
+def list_titles(query, not_found=None, collation=None):
+    """Titles of the articles matching `query`, one keyset page at a time.
 
-    result = list(collection.aggregate(pipeline))
+    `?limit=` sets the page size and `?after=` continues from the _id given in the
+    previous page's X-Next-After header, so no request holds more than one page.
+    `?stream=1` instead streams every match as NDJSON straight from the cursor.
+    """
+    try:
+        limit = int(request.args.get('limit', DEFAULT_PAGE_SIZE))
+        after = request.args.get('after')
+        query_filter, projection, sort, collation = titles_query(query, ObjectId(after) if after else None,
+                                                                 collation)
+    except (ValueError, InvalidId):
+        return jsonify({"error": "Invalid limit or after parameter."}), 400
+    if not 0 < limit <= MAX_PAGE_SIZE:
+        return jsonify({"error": f"limit must be between 1 and {MAX_PAGE_SIZE}."}), 400
 
-    # Format the result
-    formatted_result = {f"{item['_id']}": item['count'] for item in result}
+    if request.args.get('stream') == '1':
+        cursor = collection.find(query_filter, projection, collation=collation, batch_size=DEFAULT_PAGE_SIZE)
+
+        def generate():
+            with cursor:
+                for article in cursor:
+                    line = {"id": str(article['_id']), "title": article.get('title', 'No Title')}
+                    yield json.dumps(line, ensure_ascii=False) + '\n'
+
+        return Response(stream_with_context(generate()), mimetype='application/x-ndjson')
 
-    return jsonify(formatted_result)
+    # One extra document tells us whether there is a next page
+    articles = list(collection.find(query_filter, projection, collation=collation).sort(sort).limit(limit + 1))
+    if not articles and not after and not_found:
+        return jsonify({"message": not_found}), 404
+
+    response = jsonify([article.get('title', 'No Title') for article in articles[:limit]])
+    if len(articles) > limit:
+        response.headers['X-Next-After'] = str(articles[limit - 1]['_id'])
+    return response
 
 
 def format_date(date):
@@ -121,7 +301,8 @@ def format_date(date):
 @app.route('/recent_articles', methods=['GET'])
 def recent_articles():
     # Find the 10 most recently published articles
-    articles = collection.find({}).sort("published_time", -1).limit(10)
+    query_filter, projection, sort, _ = recent_articles_query()
+    articles = collection.find(query_filter, projection).sort(sort).limit(10)
 
     # Format the result
     result = {}
@@ -133,80 +314,82 @@ def recent_articles():
     return jsonify(result)
 
 
-@app.route('/articles_by_keyword/<keyword>', methods=['GET'])
-def articles_by_keyword(keyword):
-    # Escape the keyword to prevent regex injection attacks
-    escaped_keyword = re.escape(keyword)
-
-    # Debugging output
-    print(f"Searching for articles with keyword: {escaped_keyword}")
+def search_page(query, to_json):
+    """Respond with one page of ranked search results for `query`.
 
+    Pages are chosen with ?limit= and ?page= (1-based); a full page sets
+    X-Next-Page. `to_json` turns each article into its entry in the response.
+    """
     try:
-        # Perform a case-insensitive search in the 'title' field
-        articles = collection.find({
-            'title': {'$regex': escaped_keyword, '$options': 'i'}
-        })
+        limit = int(request.args.get('limit', DEFAULT_PAGE_SIZE))
+        page = int(request.args.get('page', 1))
+    except ValueError:
+        return jsonify({"error": "Invalid limit or page parameter."}), 400
+    if not 0 < limit <= MAX_PAGE_SIZE or page < 1:
+        return jsonify({"error": f"limit must be between 1 and {MAX_PAGE_SIZE} and page at least 1."}), 400
 
-        # Collect the titles of the articles that match the keyword
-        result = [article.get('title', 'No Title') for article in articles]
+    # One extra result tells us whether there is a next page
+    articles = search_articles(collection, query, limit=limit + 1, skip=(page - 1) * limit)
+    response = jsonify([to_json(article) for article in articles[:limit]])
+    if len(articles) > limit:
+        response.headers['X-Next-Page'] = str(page + 1)
+    return response
 
-        # Debugging output
-        print(f"Found articles: {result}")
 
-        return jsonify(result)
+@app.route('/articles_by_keyword/<keyword>', methods=['GET'])
+def articles_by_keyword(keyword):
+    try:
+        # Full-text search over title, keywords, description and body, best matches first
+        return search_page(keyword, lambda article: article.get('title', 'No Title'))
 
     except Exception as e:
-        # Print the exception and return a 500 status code with error message
-        print(f"An error occurred: {e}")
+        # Log and count the exception and return a 500 status code with error message
+        report_error(e)
         return jsonify({"error": "An error occurred while fetching articles."}), 500
 
 
-@app.route('/articles_by_author/<author_name>', methods=['GET'])
-def articles_by_author(author_name):
+@app.route('/search', methods=['GET'])
+def search():
+    query = request.args.get('q', '').strip()
+    if not query:
+        return jsonify({"error": "Missing q parameter."}), 400
+
     try:
-        # Perform a case-insensitive search in the 'author' field
-        articles = collection.find({
-            'author': {'$regex': f'^{author_name}$', '$options': 'i'}
+        return search_page(query, lambda article: {
+            "title": article.get('title', 'No Title'),
+            "url": article.get('url'),
+            "post_id": article.get('post_id'),
+            "score": round(article['score'], 3),
         })
 
-        # Collect the titles of the articles written by the specified author
-        result = [article.get('title', 'No Title') for article in articles]
+    except Exception as e:
+        # Log and count the exception and return a 500 status code with error message
+        report_error(e)
+        return jsonify({"error": f"An error occurred while searching articles: {e}"}), 500
 
-        # Check if no articles are found
-        if not result:
-            return jsonify({"message": "No articles found for the specified author."}), 404
 
-        return jsonify(result)
+@app.route('/articles_by_author/<author_name>', methods=['GET'])
+def articles_by_author(author_name):
+    try:
+        # Case-insensitive exact match on 'author', answered by the author_ci collation index
+        return list_titles(author_filter(author_name), not_found="No articles found for the specified author.",
+                           collation=AUTHOR_COLLATION)
 
     except Exception as e:
-        # Print the exception and return a 500 status code with error message
-        print(f"An error occurred: {e}")
+        # Log and count the exception and return a 500 status code with error message
+        report_error(e)
         return jsonify({"error": "An error occurred while fetching articles."}), 500
 
 
 @app.route('/top_classes', methods=['GET'])
+@cache.cached(ttl=600)
 def top_classes():
-    try:
-        # Define the aggregation pipeline
-        pipeline = [
-            {"$unwind": "$classes"},  # Flatten the 'classes' array if it's an array
-            {"$group": {
-                "_id": "$classes",  # Group by each class
-                "count": {"$sum": 1}  # Count occurrences
-            }},
-            {"$sort": {"count": -1}},  # Sort by count in descending order
-            {"$limit": 10}  # Limit to top 10 results
-        ]
+    if request.args.get('approx') == '1':
+        return approximate_top('class')
 
-        # Perform aggregation
-        results = collection.aggregate(pipeline)
-
-        # Format the result
-        result = {}
-        for item in results:
-            # Ensure '_id' is a string and use it as the key
-            class_name = str(item['_id'])
-            result[class_name] = f"({item['count']} articles)"
+    try:
+        # Top 10 classes from the per-class rollup
+        result = STATISTICS['top_classes']()
 
         # Check if no classes are found
         if not result:
@@ -215,8 +398,8 @@ def top_classes():
         return jsonify(result)
 
     except Exception as e:
-        # Print the exception with a more detailed error message
-        print(f"An error occurred: {e}")
+        # Count the error and return a detailed error message
+        report_error(e)
         return jsonify({"error": f"An error occurred while fetching top classes: {e}"}), 500
 
 
@@ -226,23 +409,12 @@ def articles_with_video():
         return jsonify({"error": "MongoDB connection error."}), 500
 
     try:
-        # Query the database for articles where video_duration is not null
-        articles = collection.find({
-            'video_duration': {'$ne': None}  # $ne means "not equal to"
-        })
-
-        # Collect the titles of the articles that contain a video
-        result = [article.get('title', 'No Title') for article in articles]
-
-        # Check if no articles are found
-        if not result:
-            return jsonify({"message": "No articles with video found."}), 404
-
-        return jsonify(result)
+        # Query the database for articles flagged as having a video at ingest
+        return list_titles(flag_filter('has_video'), not_found="No articles with video found.")
 
     except Exception as e:
-        # Print the exception and return a 500 status code with error message
-        print(f"An error occurred: {e}")
+        # Log and count the exception and return a 500 status code with error message
+        report_error(e)
         return jsonify({"error": f"An error occurred while fetching articles with video: {e}"}), 500
 
 @app.route('/article_details/<postid>', methods=['GET'])
@@ -251,19 +423,13 @@ def article_details(postid):
         return jsonify({"error": "MongoDB connection error."}), 500
 
     try:
-        # Debug: Print the postid being queried
-        print(f"Querying for postid: {postid}")
-
-        # Find the article by postid
-        article = collection.find_one({'postid': postid})
+        # Find the article by postid, fetching only the fields the response uses (not full_text)
+        query_filter, projection, _, _ = article_details_query(postid)
+        article = collection.find_one(query_filter, projection)
 
-        # Debug: Print the result of the query
         if article is None:
-            print("No article found.")
             return jsonify({"error": "Article not found."}), 404
 
-        print(f"Article found: {article}")
-
         # Extract relevant details
         details = {
             "URL": article.get('url', 'No URL'),
@@ -274,11 +440,18 @@ def article_details(postid):
         return jsonify(details)
 
     except Exception as e:
-        # Print the exception and return a 500 status code with error message
-        print(f"An error occurred: {e}")
+        # Log and count the exception and return a 500 status code with error message
+        report_error(e)
         return jsonify({"error": f"An error occurred while fetching article details: {e}"}), 500
 
 
+def range_count(field, low, high, include_high=True):
+    """Articles with low <= field <= high (or < high), from the column index when it is built and current."""
+    if column_index.current(cache.generation()):
+        return column_index.count(field, low, high, include_high)
+    return collection.count_documents(range_filter(field, low, high, include_high))
+
+
 @app.route('/articles_by_year/<int:year>', methods=['GET'])
 def articles_by_year(year):
     if collection is None:
@@ -289,25 +462,8 @@ def articles_by_year(year):
         if year < 1900 or year > datetime.now().year:
             return jsonify({"error": "Year out of range."}), 400
 
-        # Create start and end dates for the given year
-        start_date = datetime(year, 1, 1)
-        end_date = datetime(year + 1, 1, 1)
-
-        # Debug: Print the start and end dates
-        print(f"Querying for year: {year}")
-        print(f"Start Date: {start_date.isoformat()}")
-        print(f"End Date: {end_date.isoformat()}")
-
-        # Query the database for articles published in the given year
-        count = collection.count_documents({
-            'published_time': {
-                '$gte': start_date,
-                '$lt': end_date
-            }
-        })
-
-        # Debug: Print the count result
-        print(f"Count of articles: {count}")
+        # Count the articles published in the given year
+        count = range_count('published_time', *year_range(year))
 
         # Format the result
         result = {
@@ -318,8 +474,8 @@ def articles_by_year(year):
         return jsonify(result)
 
     except Exception as e:
-        # Print the exception and return a 500 status code with error message
-        print(f"An error occurred: {e}")
+        # Log and count the exception and return a 500 status code with error message
+        report_error(e)
         return jsonify({"error": f"An error occurred while fetching articles by year: {e}"}), 500
 
 
@@ -330,16 +486,7 @@ def longest_articles():
 
     try:
         # Aggregate query to get the top 10 articles by word count
-        pipeline = [
-            {"$sort": {"word_count": -1}},  # Sort by word_count in descending order
-            {"$group": {
-                "_id": "$title",  # Group by title to ensure uniqueness
-                "word_count": {"$first": "$word_count"}  # Get the word_count of the first document in each group
-            }},
-            {"$sort": {"word_count": -1}},  # Sort again after grouping
-            {"$limit": 10},  # Limit to the top 10 articles
-            {"$project": {"_id": 0, "title": "$_id", "word_count": 1}}  # Format the output
-        ]
+        pipeline = longest_articles_pipeline()
 
         # Execute the aggregation pipeline
         result = list(collection.aggregate(pipeline))
@@ -353,8 +500,8 @@ def longest_articles():
         return jsonify(formatted_result)
 
     except Exception as e:
-        # Print the exception and return a 500 status code with error message
-        print(f"An error occurred: {e}")
+        # Log and count the exception and return a 500 status code with error message
+        report_error(e)
         return jsonify({"error": f"An error occurred while fetching longest articles: {e}"}), 500
 
 
@@ -365,11 +512,7 @@ def shortest_articles():
 
     try:
         # Aggregate query to get the top 10 articles by lowest word count
-        pipeline = [
-            {"$sort": {"word_count": 1}},  # Sort by word_count in ascending order
-            {"$limit": 10},  # Limit to the top 10 articles
-            {"$project": {"title": 1, "word_count": 1}}  # Project only title and word_count
-        ]
+        pipeline = shortest_articles_pipeline()
 
         # Execute the aggregation pipeline
         result = list(collection.aggregate(pipeline))
@@ -383,41 +526,24 @@ def shortest_articles():
         return jsonify(formatted_result)
 
     except Exception as e:
-        # Print the exception and return a 500 status code with error message
-        print(f"An error occurred: {e}")
+        # Log and count the exception and return a 500 status code with error message
+        report_error(e)
         return jsonify({"error": f"An error occurred while fetching shortest articles: {e}"}), 500
 
 
 @app.route('/articles_by_keyword_count', methods=['GET'])
+@cache.cached(ttl=600)
 def articles_by_keyword_count():
     if collection is None:
         return jsonify({"error": "MongoDB connection error."}), 500
 
     try:
-        # Aggregate query to group articles by the number of keywords and count them
-        pipeline = [
-            {"$project": {"keyword_count": {"$size": "$keywords"}}},  # Count the number of keywords
-            {"$group": {
-                "_id": "$keyword_count",  # Group by the number of keywords
-                "count": {"$sum": 1}  # Count the number of articles for each keyword count
-            }},
-            {"$sort": {"_id": 1}}  # Sort by the number of keywords (ascending order)
-        ]
-
-        # Execute the aggregation pipeline
-        result = list(collection.aggregate(pipeline))
-
-        # Format the result
-        formatted_result = [
-            {"keyword_count": article.get('_id', 0), "article_count": article.get('count', 0)}
-            for article in result
-        ]
-
-        return jsonify(formatted_result)
+        # Articles per number of keywords, sorted by the number of keywords (ascending order)
+        return jsonify(STATISTICS['articles_by_keyword_count']())
 
     except Exception as e:
-        # Print the exception and return a 500 status code with error message
-        print(f"An error occurred: {e}")
+        # Log and count the exception and return a 500 status code with error message
+        report_error(e)
         return jsonify({"error": f"An error occurred while fetching articles by keyword count: {e}"}), 500
 
 
@@ -427,20 +553,15 @@ def articles_with_thumbnail():
         return jsonify({"error": "MongoDB connection error."}), 500
 
     try:
-        # Query to find articles with a non-null thumbnail
-        query = {"thumbnail": {"$exists": True, "$ne": None}}
-
-        # Find articles matching the query
-        articles = collection.find(query, {"title": 1, "_id": 0})  # Project only the title
-
-        # Format the result
-        formatted_result = [article.get('title', 'No Title') for article in articles]
+        # Query to find articles with a thumbnail (flag precomputed at ingest)
+        query = flag_filter('has_thumbnail')
 
-        return jsonify(formatted_result)
+        # Return the matching titles a page at a time
+        return list_titles(query)
 
     except Exception as e:
-        # Print the exception and return a 500 status code with error message
-        print(f"An error occurred: {e}")
+        # Log and count the exception and return a 500 status code with error message
+        report_error(e)
         return jsonify({"error": f"An error occurred while fetching articles with thumbnail: {e}"}), 500
 
 
@@ -451,23 +572,15 @@ def articles_updated_after_publication():
 
     try:
         # Query to find articles where last_updated is after published_time
-        query = {
-            "$expr": {
-                "$gt": ["$last_updated", "$published_time"]  # Check if last_updated > published_time
-            }
-        }
-
-        # Find articles matching the query
-        articles = collection.find(query, {"title": 1, "_id": 0})  # Project only the title
-
-        # Format the result
-        formatted_result = [article.get('title', 'No Title') for article in articles]
+        # (compared once at ingest, so this is an equality match instead of a $expr scan)
+        query = flag_filter('updated_after_publication')
 
-        return jsonify(formatted_result)
+        # Return the matching titles a page at a time
+        return list_titles(query)
 
     except Exception as e:
-        # Print the exception and return a 500 status code with error message
-        print(f"An error occurred: {e}")
+        # Log and count the exception and return a 500 status code with error message
+        report_error(e)
         return jsonify({"error": f"An error occurred while fetching articles updated after publication: {e}"}), 500
 
 
@@ -477,30 +590,18 @@ def articles_by_coverage(coverage):
         return jsonify({"error": "MongoDB connection error."}), 500
 
     try:
-        # Print the coverage parameter for debugging
-        print(f"Coverage parameter: {coverage}")
-
-        # Query to find articles where coverage is in the classes field
-        # Handle cases where 'classes' is an array or a single value
-        query = {"classes": {"$in": [coverage]}}
-
-        # Print the query for debugging
-        print(f"Query: {query}")
-
-        # Find articles matching the query
-        articles = collection.find(query, {"title": 1, "_id": 0})
+        # Query to find articles whose class ids include the coverage's id
+        # (equality on an array field matches any element, using the class_ids/_id index)
+        class_id = vocabulary.id_of('class', coverage, cache.generation())
+        if class_id is None:
+            return jsonify([])
+        query = coverage_filter(class_id)
 
-        # Convert articles to a list and format the result
-        formatted_result = [article.get('title', 'No Title') for article in articles]
-
-        # Print the result for debugging
-        print(f"Result: {formatted_result}")
-
-        return jsonify(formatted_result)
+        return list_titles(query)
 
     except Exception as e:
-        # Print the exception and return a 500 status code with error message
-        print(f"An error occurred: {e}")
+        # Log and count the exception and return a 500 status code with error message
+        report_error(e)
         return jsonify({"error": f"An error occurred while fetching articles by coverage: {e}"}), 500
 
 
@@ -509,37 +610,26 @@ def popular_keywords_last_X_days(days):
     if collection is None:
         return jsonify({"error": "MongoDB connection error."}), 500
 
+    if request.args.get('approx') == '1':
+        # Merges one stored sketch per day instead of unwinding every article in the range
+        return approximate_top('keyword', days)
+
+    # Served from the in-process hourly buckets once they are loaded (windows end at the current hour)
+    trending.start(collection)
+    if trending.ready and days * 24 <= trending.size:
+        return jsonify([{keyword: count} for keyword, count in trending.popular(days)])
+
     try:
         # Calculate the date range for the last X days
         end_date = datetime.now(timezone.utc)
         start_date = end_date - timedelta(days=days)
 
-        # Print the date range for debugging
-        print(f"Date Range: Start Date - {start_date}, End Date - {end_date}")
-
-        # Query to find articles published in the last X days
-        pipeline = [
-            {"$match": {
-                "published_time": {"$gte": start_date, "$lte": end_date},
-                "keywords": {"$exists": True}
-            }},
-            {"$unwind": "$keywords"},
-            {"$group": {
-                "_id": "$keywords",
-                "count": {"$sum": 1}
-            }},
-            {"$sort": {"count": -1}}
-        ]
-
-        # Print the aggregation pipeline for debugging
-        print(f"Aggregation Pipeline: {pipeline}")
+        # Count the keywords of the articles published in the last X days
+        pipeline = popular_keywords_pipeline(start_date, end_date)
 
         # Execute the aggregation pipeline
         result = list(collection.aggregate(pipeline))
 
-        # Print the result of the aggregation
-        print(f"Aggregation Result: {result}")
-
         # Format the result
         formatted_result = [
             {keyword["_id"]: keyword["count"]} for keyword in result
@@ -548,45 +638,35 @@ def popular_keywords_last_X_days(days):
         return jsonify(formatted_result)
 
     except Exception as e:
-        # Print the exception and return a 500 status code with error message
-        print(f"An error occurred: {e}")
+        # Log and count the exception and return a 500 status code with error message
+        report_error(e)
         return jsonify({"error": f"An error occurred while fetching popular keywords: {e}"}), 500
 
 
+@app.route('/trending_keywords/<int:days>', methods=['GET'])
+def trending_keywords(days):
+    """Keywords rising fastest in the last X days compared with the X days before (?limit=, default 20)."""
+    try:
+        limit = int(request.args.get('limit', 20))
+    except ValueError:
+        return jsonify({"error": "Invalid limit parameter."}), 400
+    if days < 1 or days * 48 > trending.size:
+        return jsonify({"error": f"days must be between 1 and {trending.size // 48}."}), 400
+
+    trending.start(collection)
+    if not trending.ready:
+        return jsonify({"error": "Trending counts are still loading, try again shortly."}), 503
+    return jsonify(trending.trending(days, limit=limit))
+
+
 @app.route('/articles_by_month/<int:year>/<int:month>', methods=['GET'])
 def articles_by_month(year, month):
     if collection is None:
         return jsonify({"error": "MongoDB connection error."}), 500
 
     try:
-        # Construct the start and end dates for the given month and year
-        start_date = datetime(year, month, 1, 0, 0, 0, tzinfo=timezone.utc)
-        next_month = month % 12 + 1
-        next_year = year + (month // 12)
-        end_date = datetime(next_year, next_month, 1, 0, 0, 0, tzinfo=timezone.utc) - timedelta(seconds=1)
-
-        # Debug: Print the date range
-        print(f"Date Range: Start Date - {start_date.isoformat()}, End Date - {end_date.isoformat()}")
-
-        # Query to find articles published in the specified month and year
-        pipeline = [
-            {"$match": {
-                "published_time": {"$gte": start_date, "$lte": end_date}
-            }},
-            {"$count": "article_count"}
-        ]
-
-        # Debug: Print the aggregation pipeline
-        print(f"Aggregation Pipeline: {pipeline}")
-
-        # Execute the aggregation pipeline
-        result = list(collection.aggregate(pipeline))
-
-        # Debug: Print the aggregation result
-        print(f"Aggregation Result: {result}")
-
-        # Extract count from the result
-        count = result[0]["article_count"] if result else 0
+        # Count the articles published in the specified month and year
+        count = range_count('published_time', *month_range(year, month))
 
         # Map month number to month name
         month_name = datetime(year, month, 1).strftime('%B')
@@ -599,8 +679,8 @@ def articles_by_month(year, month):
         return jsonify(formatted_result)
 
     except Exception as e:
-        # Print the exception and return a 500 status code with error message
-        print(f"An error occurred: {e}")
+        # Log and count the exception and return a 500 status code with error message
+        report_error(e)
         return jsonify({"error": f"An error occurred while fetching articles by month: {e}"}), 500
 
 
@@ -610,25 +690,8 @@ def articles_by_word_count_range(min_word_count, max_word_count):
         return jsonify({"error": "MongoDB connection error."}), 500
 
     try:
-        # Query to find articles with word count in the specified range
-        pipeline = [
-            {"$match": {
-                "word_count": {"$gte": min_word_count, "$lte": max_word_count}
-            }},
-            {"$count": "article_count"}
-        ]
-
-        # Print the aggregation pipeline for debugging
-        print(f"Aggregation Pipeline: {pipeline}")
-
-        # Execute the aggregation pipeline
-        result = list(collection.aggregate(pipeline))
-
-        # Print the result of the aggregation
-        print(f"Aggregation Result: {result}")
-
-        # Extract count from the result
-        count = result[0]["article_count"] if result else 0
+        # Count the articles with word count in the specified range
+        count = range_count('word_count', min_word_count, max_word_count)
 
         # Format the result
         formatted_result = {
@@ -638,8 +701,8 @@ def articles_by_word_count_range(min_word_count, max_word_count):
         return jsonify(formatted_result)
 
     except Exception as e:
-        # Print the exception and return a 500 status code with error message
-        print(f"An error occurred: {e}")
+        # Log and count the exception and return a 500 status code with error message
+        report_error(e)
         return jsonify({"error": f"An error occurred while fetching articles by word count range: {e}"}), 500
 
 
@@ -649,25 +712,8 @@ def articles_with_specific_keyword_count(count):
         return jsonify({"error": "MongoDB connection error."}), 500
 
     try:
-        # Query to find articles with exactly 'count' number of keywords
-        pipeline = [
-            {"$match": {
-                "keywords": {"$size": count}
-            }},
-            {"$count": "article_count"}
-        ]
-
-        # Print the aggregation pipeline for debugging
-        print(f"Aggregation Pipeline: {pipeline}")
-
-        # Execute the aggregation pipeline
-        result = list(collection.aggregate(pipeline))
-
-        # Print the result of the aggregation
-        print(f"Aggregation Result: {result}")
-
-        # Extract count from the result
-        article_count = result[0]["article_count"] if result else 0
+        # Count the articles with exactly 'count' number of keywords
+        article_count = range_count('keyword_count', count, count)
 
         # Format the result
         formatted_result = {
@@ -677,8 +723,8 @@ def articles_with_specific_keyword_count(count):
         return jsonify(formatted_result)
 
     except Exception as e:
-        # Print the exception and return a 500 status code with error message
-        print(f"An error occurred: {e}")
+        # Log and count the exception and return a 500 status code with error message
+        report_error(e)
         return jsonify({"error": f"An error occurred while fetching articles with specific keyword count: {e}"}), 500
 
 
@@ -691,28 +737,8 @@ def articles_by_specific_date(date):
         # Convert date from string to datetime object
         date_object = datetime.strptime(date, '%Y-%m-%d')
 
-        # Query to find articles published on the specified date
-        pipeline = [
-            {"$match": {
-                "published_time": {
-                    "$gte": date_object,
-                    "$lt": date_object + timedelta(days=1)
-                }
-            }},
-            {"$count": "article_count"}
-        ]
-
-        # Print the aggregation pipeline for debugging
-        print(f"Aggregation Pipeline: {pipeline}")
-
-        # Execute the aggregation pipeline
-        result = list(collection.aggregate(pipeline))
-
-        # Print the result of the aggregation
-        print(f"Aggregation Result: {result}")
-
-        # Extract count from the result
-        article_count = result[0]["article_count"] if result else 0
+        # Count the articles published on the specified date
+        article_count = range_count('published_time', *day_range(date_object))
 
         # Format the result
         formatted_result = {
@@ -722,8 +748,8 @@ def articles_by_specific_date(date):
         return jsonify(formatted_result)
 
     except Exception as e:
-        # Print the exception and return a 500 status code with error message
-        print(f"An error occurred: {e}")
+        # Log and count the exception and return a 500 status code with error message
+        report_error(e)
         return jsonify({"error": f"An error occurred while fetching articles by specific date: {e}"}), 500
 
 if __name__ == '__main__':
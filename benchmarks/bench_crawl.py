@@ -0,0 +1,104 @@
+"""End-to-end crawl benchmark against the local fixture site.
+
+Runs Task1.main() against benchmarks.fixture_site and reports pages/sec, parse
+ms/page, peak RSS and bytes written. Run from the repository root:
+
+    python -m benchmarks.bench_crawl --articles 2000 --concurrency 32
+    python -m benchmarks.bench_crawl --parsers 4 --format ndjson --compress gzip
+    python -m benchmarks.bench_crawl --latency-ms 50 --error-rate 0.05 --adaptive
+"""
+import argparse
+import contextlib
+import glob
+import io
+import json
+import os
+import tempfile
+import time
+
+try:
+    import resource
+except ImportError:
+    # Not available on Windows; peak RSS is reported as n/a there
+    resource = None
+
+import Task1
+from benchmarks.fixture_site import FixtureSite, make_article_page
+
+
+def count_articles(output_dir):
+    count = 0
+    for path in glob.glob(os.path.join(output_dir, 'articles_*')):
+        if '.ndjson' in path:
+            count += sum(1 for _ in Task1.iter_ndjson(path))
+        else:
+            with open(path, encoding='utf-8') as f:
+                count += len(json.load(f))
+    return count
+
+
+def bytes_written(output_dir):
+    return sum(os.path.getsize(path) for path in glob.glob(os.path.join(output_dir, '**'), recursive=True)
+               if os.path.isfile(path))
+
+
+def parse_ms_per_page(samples=50):
+    scraper = Task1.ArticleScraper('benchmark')
+    pages = [make_article_page(i) for i in range(samples)]
+    start = time.perf_counter()
+    for page in pages:
+        scraper.parse(page)
+    return (time.perf_counter() - start) * 1000 / len(pages)
+
+
+def peak_rss_mb():
+    if resource is None:
+        return None
+    # ru_maxrss is in kilobytes on Linux; children covers the parser processes
+    self_kb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    children_kb = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss
+    return self_kb / 1024, children_kb / 1024
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the crawler end-to-end against a local fixture site.')
+    parser.add_argument('--articles', type=int, default=500)
+    parser.add_argument('--months', type=int, default=2)
+    parser.add_argument('--latency-ms', type=float, default=0)
+    parser.add_argument('--error-rate', type=float, default=0.0)
+    parser.add_argument('--concurrency', type=int, default=Task1.DEFAULT_CONCURRENCY)
+    parser.add_argument('--parsers', type=int, default=0)
+    parser.add_argument('--format', choices=('json', 'ndjson'), default='json')
+    parser.add_argument('--compress', choices=('gzip', 'zstd'))
+    parser.add_argument('--adaptive', action='store_true', help='use the adaptive crawl controller')
+    parser.add_argument('--verbose', action='store_true', help="show the crawler's own output")
+    args = parser.parse_args()
+
+    with FixtureSite(articles=args.articles, months=args.months, latency_ms=args.latency_ms,
+                     error_rate=args.error_rate) as site, tempfile.TemporaryDirectory() as output_dir:
+        crawl_output = contextlib.nullcontext() if args.verbose else contextlib.redirect_stdout(io.StringIO())
+        start = time.perf_counter()
+        with crawl_output:
+            Task1.main(concurrency=args.concurrency, parsers=args.parsers, output_format=args.format,
+                       compression=args.compress, sitemap_url=site.sitemap_url, output_dir=output_dir,
+                       adaptive=args.adaptive)
+        elapsed = time.perf_counter() - start
+
+        scraped = count_articles(output_dir)
+        written = bytes_written(output_dir)
+        requests_served, errors_served = site.requests, site.errors
+
+    print(f"Articles scraped: {scraped}/{args.articles} in {elapsed:.2f}s")
+    print(f"Article requests: {requests_served} ({errors_served} answered with errors)")
+    print(f"Throughput:       {scraped / elapsed:.1f} pages/sec")
+    print(f"Parse time:       {parse_ms_per_page():.3f} ms/page")
+    rss = peak_rss_mb()
+    if rss is None:
+        print("Peak RSS:         n/a")
+    else:
+        print(f"Peak RSS:         {rss[0]:.1f} MB (parser processes: {rss[1]:.1f} MB)")
+    print(f"Bytes written:    {written} ({written / max(scraped, 1):.0f} per article)")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,56 @@
+"""Micro-benchmark for ArticleScraper.parse against the BeautifulSoup reference.
+
+Run from the repository root:
+
+    python -m benchmarks.bench_parse                 # synthetic article pages
+    python -m benchmarks.bench_parse page1.html ...  # saved article pages
+"""
+import argparse
+import time
+import warnings
+
+from Task1 import ArticleScraper
+from benchmarks.fixture_site import make_article_page
+
+
+def time_per_page(parse, pages, repeat):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        for page in pages:
+            parse(page)
+    return (time.perf_counter() - start) * 1000 / (repeat * len(pages))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Compare per-page parse time of the article extractors.')
+    parser.add_argument('pages', nargs='*', help='saved article HTML files (default: synthetic pages)')
+    parser.add_argument('--count', type=int, default=50, help='number of synthetic pages')
+    parser.add_argument('--repeat', type=int, default=5, help='passes over the page set')
+    args = parser.parse_args()
+
+    if args.pages:
+        pages = []
+        for path in args.pages:
+            with open(path, 'rb') as f:
+                pages.append(f.read())
+    else:
+        pages = [make_article_page(i) for i in range(args.count)]
+
+    scraper = ArticleScraper('benchmark')
+    warnings.simplefilter('ignore')
+
+    mismatches = sum(scraper.parse(page) != scraper.parse_with_soup(page) for page in pages)
+    if mismatches:
+        print(f"WARNING: {mismatches} of {len(pages)} pages extracted differently")
+
+    soup_ms = time_per_page(scraper.parse_with_soup, pages, args.repeat)
+    single_pass_ms = time_per_page(scraper.parse, pages, args.repeat)
+
+    print(f"Pages: {len(pages)} x {args.repeat} passes")
+    print(f"BeautifulSoup find() per field: {soup_ms:.3f} ms/page")
+    print(f"Single-pass lxml extractor:     {single_pass_ms:.3f} ms/page")
+    print(f"Speedup: {soup_ms / single_pass_ms:.1f}x")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,197 @@
+"""Local stand-in for almayadeen.net used by the offline benchmarks.
+
+Serves a sitemap index, monthly sitemaps and synthetic Arabic article pages with
+the same meta tags and tawsiyat script the scraper reads. Latency and error rate
+are configurable so retry and throttling behaviour can be exercised too.
+
+Run it on its own with:
+
+    python -m benchmarks.fixture_site --port 8000 --articles 500
+"""
+import argparse
+import json
+import random
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+WORDS = ('الميادين', 'لبنان', 'فلسطين', 'غزة', 'المقاومة', 'الاحتلال', 'سوريا', 'اليمن', 'العراق', 'إيران',
+         'الحكومة', 'الرئيس', 'الوزير', 'المجلس', 'الشعب', 'الحرب', 'السلام', 'الاقتصاد', 'الثقافة', 'الرياضة',
+         'قال', 'أكد', 'أعلن', 'اليوم', 'أمس', 'في', 'من', 'على', 'إلى', 'عن', 'مع', 'بعد', 'قبل', 'خلال')
+KEYWORDS = ('لبنان', 'غزة', 'المقاومة', 'الاحتلال', 'سوريا', 'اليمن', 'فلسطين', 'إيران', 'العراق', 'الضفة الغربية')
+CLASSES = ('سياسة', 'اقتصاد', 'ثقافة', 'رياضة', 'تقارير', 'مقالات', 'فيديو')
+AUTHORS = ('الميادين نت', 'وكالات', 'محمد علي', 'زينب حسن', 'علي أحمد')
+
+
+def make_article_page(i, paragraphs=None, published=None):
+    """Build a synthetic article page shaped like an almayadeen.net article.
+
+    Content is derived from `i`, so the same article id always gives the same page.
+    """
+    rng = random.Random(i)
+    if paragraphs is None:
+        paragraphs = rng.randint(5, 60)
+    if published is None:
+        published = datetime(2024, 8, 1, tzinfo=timezone(timedelta(hours=3))) + timedelta(minutes=37 * i)
+    modified = published + timedelta(minutes=rng.choice((0, 0, 15, 90)))
+
+    body = ''.join(
+        '<p>' + ' '.join(rng.choice(WORDS) for _ in range(rng.randint(15, 60)))
+        + f' <a href="/news/{rng.randint(1, 10 ** 6)}">{rng.choice(WORDS)}</a>.</p>'
+        for _ in range(paragraphs)
+    )
+    keywords = ', '.join(rng.sample(KEYWORDS, rng.randint(1, 6)))
+    classes = json.dumps({"classes": rng.sample(CLASSES, rng.randint(1, 3))}, ensure_ascii=False)
+    video = (f'<meta property="og:video_duration" content="{rng.randint(30, 900)}">'
+             if rng.random() < 0.2 else '')
+    menu = ''.join(f'<li><a href="/section/{n}">{WORDS[n % len(WORDS)]}</a></li>' for n in range(30))
+
+    return f'''<!DOCTYPE html>
+<html lang="ar" dir="rtl">
+<head>
+<meta charset="utf-8">
+<title>المقال {i}</title>
+<meta name="keywords" content="{keywords}">
+<meta name="postid" content="{i}">
+<meta name="author" content="{rng.choice(AUTHORS)}">
+<meta name="description" content="{' '.join(rng.choice(WORDS) for _ in range(20))}">
+<meta property="og:image" content="https://www.almayadeen.net/images/{i}.jpg">
+<meta property="article:published_time" content="{published.isoformat()}">
+<meta property="article:modified_time" content="{modified.isoformat()}">
+{video}
+<script type="text/tawsiyat">{classes}</script>
+<script>window.dataLayer = window.dataLayer || [];</script>
+</head>
+<body>
+<header><nav><ul>{menu}</ul></nav></header>
+<main><article><h2>{' '.join(rng.choice(WORDS) for _ in range(8))} {i}</h2>{body}</article></main>
+<footer><p>جميع الحقوق محفوظة</p></footer>
+</body>
+</html>'''.encode('utf-8')
+
+
+class FixtureSite:
+    """Serve `articles` synthetic articles split over `months` monthly sitemaps."""
+
+    def __init__(self, articles=200, months=2, latency_ms=0, error_rate=0.0, host='127.0.0.1', port=0, seed=0):
+        self.articles = articles
+        self.months = months
+        self.latency = latency_ms / 1000
+        self.error_rate = error_rate
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self.requests = 0
+        self.errors = 0
+        self.server = ThreadingHTTPServer((host, port), self._handler_class())
+        self.server.daemon_threads = True
+        self._thread = None
+
+    @property
+    def base_url(self):
+        host, port = self.server.server_address[:2]
+        return f'http://{host}:{port}'
+
+    @property
+    def sitemap_url(self):
+        return f'{self.base_url}/sitemaps/all.xml'
+
+    def start(self):
+        self._thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+    def month_articles(self, month_index):
+        per_month = -(-self.articles // self.months)
+        return range(month_index * per_month, min((month_index + 1) * per_month, self.articles))
+
+    def sitemap_index(self):
+        entries = ''.join(
+            f'<sitemap><loc>{self.base_url}/sitemaps/sitemap-2024-{m + 1}.xml</loc><lastmod>2024-{m + 1:02d}-28</lastmod></sitemap>'
+            for m in range(self.months)
+        )
+        return ('<?xml version="1.0" encoding="UTF-8"?>'
+                f'<sitemapindex xmlns="http://www.sitemaps.org/schemas/sitemap/0.9">{entries}</sitemapindex>')
+
+    def monthly_sitemap(self, month_index):
+        entries = ''.join(
+            f'<url><loc>{self.base_url}/news/{i}</loc><lastmod>2024-{month_index + 1:02d}-01T10:00:00+03:00</lastmod></url>'
+            for i in self.month_articles(month_index)
+        )
+        return ('<?xml version="1.0" encoding="UTF-8"?>'
+                f'<urlset xmlns="http://www.sitemaps.org/schemas/sitemap/0.9">{entries}</urlset>')
+
+    def _should_fail(self):
+        with self._lock:
+            self.requests += 1
+            fail = self._random.random() < self.error_rate
+            if fail:
+                self.errors += 1
+            return fail
+
+    def _handler_class(self):
+        site = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def log_message(self, *args):
+                pass
+
+            def do_GET(self):
+                if site.latency:
+                    time.sleep(site.latency)
+                path = self.path
+                if path.startswith('/news/'):
+                    if site._should_fail():
+                        return self._send(self._error_status(), b'', 'text/plain')
+                    return self._send(200, make_article_page(int(path.rsplit('/', 1)[1])), 'text/html; charset=utf-8')
+                if path == '/sitemaps/all.xml':
+                    return self._send(200, site.sitemap_index().encode('utf-8'), 'application/xml')
+                if path.startswith('/sitemaps/sitemap-2024-'):
+                    month_index = int(path.rsplit('-', 1)[1].split('.')[0]) - 1
+                    return self._send(200, site.monthly_sitemap(month_index).encode('utf-8'), 'application/xml')
+                self._send(404, b'', 'text/plain')
+
+            def _error_status(self):
+                return site._random.choice((429, 500, 503))
+
+            def _send(self, status, body, content_type):
+                self.send_response(status)
+                self.send_header('Content-Type', content_type)
+                self.send_header('Content-Length', str(len(body)))
+                if status == 429:
+                    self.send_header('Retry-After', '1')
+                self.end_headers()
+                self.wfile.write(body)
+
+        return Handler
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Serve a synthetic almayadeen.net for offline crawling.')
+    parser.add_argument('--port', type=int, default=8000)
+    parser.add_argument('--articles', type=int, default=500)
+    parser.add_argument('--months', type=int, default=2)
+    parser.add_argument('--latency-ms', type=float, default=0)
+    parser.add_argument('--error-rate', type=float, default=0.0)
+    args = parser.parse_args()
+
+    site = FixtureSite(articles=args.articles, months=args.months, latency_ms=args.latency_ms,
+                       error_rate=args.error_rate, port=args.port)
+    print(f"Serving {args.articles} articles; sitemap index at {site.sitemap_url}")
+    site.server.serve_forever()
+
+
+if __name__ == '__main__':
+    main()
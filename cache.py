@@ -0,0 +1,117 @@
+import threading
+import time
+from collections import OrderedDict
+from functools import wraps
+
+# Document in the `meta` collection holding the ingest generation counter
+GENERATION_ID = 'ingest_generation'
+
+
+def bump_generation(db):
+    """Called by the loader after it changes articles; invalidates every cached result."""
+    db['meta'].update_one({'_id': GENERATION_ID}, {'$inc': {'value': 1}}, upsert=True)
+
+
+def read_generation(db):
+    document = db['meta'].find_one({'_id': GENERATION_ID})
+    return document['value'] if document else 0
+
+
+class ResultCache:
+    """Bounded LRU of endpoint responses with per-entry TTLs.
+
+    Entries are tagged with the ingest generation they were computed under and
+    dropped as soon as the loader bumps it. The generation itself is re-read at
+    most every `generation_interval` seconds so a cache hit costs no round trip.
+    """
+
+    def __init__(self, db, maxsize=256, generation_interval=5.0):
+        self.db = db
+        self.maxsize = maxsize
+        self.generation_interval = generation_interval
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._generation = None
+        self._generation_checked = 0.0
+
+    def generation(self):
+        now = time.monotonic()
+        if self._generation is None or now - self._generation_checked >= self.generation_interval:
+            try:
+                generation = read_generation(self.db)
+            except Exception as e:
+                # Without the counter we can't tell whether entries are stale, so don't serve them
+                print(f"Could not read the ingest generation: {e}")
+                return None
+            with self._lock:
+                if generation != self._generation:
+                    self._entries.clear()
+                self._generation, self._generation_checked = generation, now
+        return self._generation
+
+    def get(self, key):
+        generation = self.generation()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or generation is None or entry[1] != generation or entry[2] <= time.monotonic():
+                if entry is not None:
+                    del self._entries[key]
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def set(self, key, value, ttl, generation=None):
+        """Store `value` under the generation it was computed under (read now if not given).
+
+        Pass the generation read before computing the value: if the loader bumped it
+        meanwhile, the entry is tagged with the older one and dropped on the next read.
+        """
+        if generation is None:
+            generation = self.generation()
+        if generation is None:
+            return
+        with self._lock:
+            self._entries[key] = (value, generation, time.monotonic() + ttl)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def __len__(self):
+        return len(self._entries)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def cached(self, ttl):
+        """Route decorator: serve successful responses from the cache for `ttl` seconds."""
+        # Imported here so the loader can bump the generation without Flask installed
+        from flask import current_app, request
+
+        def decorator(view):
+            @wraps(view)
+            def wrapper(*args, **kwargs):
+                key = (request.path, tuple(sorted(request.args.items(multi=True))))
+                response = self.get(key)
+                if response is not None:
+                    response = current_app.response_class(response[0], status=response[1], headers=response[2])
+                    response.headers['X-Cache'] = 'HIT'
+                    return response
+
+                # Read before the view runs, so a load finishing meanwhile can't tag a stale result as current
+                generation = self.generation()
+                response = view(*args, **kwargs)
+                # Error responses come back as (response, status) tuples and are never cached
+                if not isinstance(response, tuple) and response.status_code == 200:
+                    # Headers too: paginated responses carry the next page's cursor in them
+                    headers = [(name, value) for name, value in response.headers.items() if name != 'X-Cache']
+                    if generation is not None:
+                        self.set(key, (response.get_data(), response.status_code, headers), ttl, generation)
+                    response.headers['X-Cache'] = 'MISS'
+                return response
+            return wrapper
+        return decorator
@@ -0,0 +1,224 @@
+import argparse
+import os
+import threading
+import time
+from datetime import datetime, timezone
+
+import pymongo
+
+from cache import read_generation
+
+try:
+    import numpy as np
+except ImportError:
+    # The column index is optional; without NumPy the API keeps sending count queries to Mongo
+    np = None
+
+# Directory holding one sorted .npy file per column; the API memory-maps it read-only. Resolved
+# to an absolute path (by default next to this file) so the loader and the API always agree on it.
+COLUMN_INDEX_DIR = os.path.abspath(os.environ.get(
+    'COLUMN_INDEX_DIR', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'column_index')))
+# Columns kept; dates are stored as epoch seconds (UTC)
+COLUMNS = ('published_time', 'word_count', 'keyword_count')
+# Marker rewritten after every update, holding the ingest generation (see cache.py) the
+# index reflects; readers reload when its mtime changes
+_MARKER = 'updated'
+# Marker content while a load is patching the index
+_LOADING = 'loading'
+
+
+def _epoch(value):
+    if value.tzinfo is None:
+        value = value.replace(tzinfo=timezone.utc)
+    return int(value.timestamp())
+
+
+def column_values(document):
+    """(column, value) pairs an article contributes; missing values are left out."""
+    values = []
+    published_time = document.get('published_time')
+    if isinstance(published_time, datetime):
+        values.append(('published_time', _epoch(published_time)))
+    for column in ('word_count', 'keyword_count'):
+        if isinstance(document.get(column), int):
+            values.append((column, document[column]))
+    return values
+
+
+def _require_numpy():
+    if np is None:
+        raise RuntimeError("the column index needs the 'numpy' package")
+
+
+def _write(directory, columns, generation):
+    """Write every column atomically (temp file + rename), then stamp the marker with `generation`."""
+    os.makedirs(directory, exist_ok=True)
+    for column, values in columns.items():
+        path = os.path.join(directory, f'{column}.npy')
+        temp_path = path + '.tmp.npy'
+        np.save(temp_path, values)
+        os.replace(temp_path, path)
+    temp_path = os.path.join(directory, _MARKER + '.tmp')
+    with open(temp_path, 'w') as file:
+        file.write(str(generation))
+    os.replace(temp_path, os.path.join(directory, _MARKER))
+
+
+def index_generation(directory=COLUMN_INDEX_DIR):
+    """Ingest generation the index was last stamped with; None if missing or being updated."""
+    try:
+        with open(os.path.join(directory, _MARKER)) as file:
+            return int(file.read())
+    except (OSError, ValueError):
+        return None
+
+
+def build_index(collection, directory=COLUMN_INDEX_DIR):
+    """Load every article's columns from Mongo into sorted arrays on disk."""
+    _require_numpy()
+    values = {column: [] for column in COLUMNS}
+    for document in collection.find({}, {column: 1 for column in COLUMNS}):
+        for column, value in column_values(document):
+            values[column].append(value)
+    columns = {column: np.sort(np.array(items, dtype=np.int64)) for column, items in values.items()}
+    _write(directory, columns, read_generation(collection.database))
+    print(f"Built column index in {directory}: " + ', '.join(f'{c} ({len(v)})' for c, v in columns.items()))
+
+
+class ColumnIndexUpdates:
+    """Collects the column values added and removed during a load, then patches the index on disk.
+
+    Only applied when the index directory already exists; otherwise there is nothing to keep current.
+    The API only uses an index stamped with the current ingest generation, so creating one marks
+    the index as out of date until flush(), called after the loader bumps the generation, stamps
+    it again. If a previous load never flushed, its changes are missing from the index and it stays
+    unstamped (the API keeps querying Mongo) until build_index() runs.
+    """
+
+    def __init__(self, db, directory=COLUMN_INDEX_DIR):
+        self.db = db
+        self.directory = directory
+        self._added = {column: [] for column in COLUMNS}
+        self._removed = {column: [] for column in COLUMNS}
+        self._lock = threading.Lock()
+        self._complete = index_generation(directory) is not None
+        if np is not None and os.path.isdir(directory):
+            _write(directory, {}, _LOADING)
+
+    def add(self, document, old=None):
+        with self._lock:
+            for column, value in column_values(document):
+                self._added[column].append(value)
+            if old is not None:
+                for column, value in column_values(old):
+                    self._removed[column].append(value)
+
+    def flush(self):
+        with self._lock:
+            added, removed = self._added, self._removed
+            self._added = {column: [] for column in COLUMNS}
+            self._removed = {column: [] for column in COLUMNS}
+        if np is None or not os.path.isdir(self.directory):
+            return 0
+        generation = read_generation(self.db) if self._complete else _LOADING
+        if not self._complete:
+            print(f"The column index in {self.directory} missed an interrupted load; rebuild it with column_index.py")
+        if not any(added.values()) and not any(removed.values()):
+            _write(self.directory, {}, generation)
+            return 0
+
+        columns = {}
+        for column in COLUMNS:
+            path = os.path.join(self.directory, f'{column}.npy')
+            values = np.load(path) if os.path.exists(path) else np.empty(0, dtype=np.int64)
+            if removed[column]:
+                # Drop one occurrence per removed value
+                remove = np.sort(np.array(removed[column], dtype=np.int64))
+                positions = np.searchsorted(values, remove)
+                # Repeated removals of one value must hit consecutive slots
+                offsets = np.arange(len(remove)) - np.searchsorted(remove, remove)
+                positions = positions + offsets
+                valid = positions < len(values)
+                positions = positions[valid][values[positions[valid]] == remove[valid]]
+                values = np.delete(values, positions)
+            if added[column]:
+                insert = np.sort(np.array(added[column], dtype=np.int64))
+                values = np.insert(values, np.searchsorted(values, insert), insert)
+            columns[column] = values
+        _write(self.directory, columns, generation)
+        return sum(len(items) for items in added.values())
+
+
+class ColumnIndex:
+    """Read-only, memory-mapped view of the column index answering range counts with binary search.
+
+    Every worker maps the same files, so the arrays live once in the page cache. The
+    files are re-mapped when the loader updates them (checked at most every
+    `check_interval` seconds).
+    """
+
+    def __init__(self, directory=COLUMN_INDEX_DIR, check_interval=5.0):
+        self.directory = directory
+        self.check_interval = check_interval
+        self._columns = None
+        self._generation = None
+        self._loaded_mtime = None
+        self._checked = 0.0
+        self._lock = threading.Lock()
+
+    def _refresh(self):
+        now = time.monotonic()
+        if now - self._checked < self.check_interval:
+            return
+        self._checked = now
+        marker = os.path.join(self.directory, _MARKER)
+        try:
+            mtime = os.path.getmtime(marker)
+        except OSError:
+            self._columns = None
+            return
+        if mtime != self._loaded_mtime:
+            generation = index_generation(self.directory)
+            with self._lock:
+                self._columns = {column: np.load(os.path.join(self.directory, f'{column}.npy'), mmap_mode='r')
+                                 for column in COLUMNS}
+                self._generation = generation
+                self._loaded_mtime = mtime
+
+    @property
+    def available(self):
+        if np is None:
+            return False
+        self._refresh()
+        return self._columns is not None
+
+    def current(self, generation):
+        """Whether the index is built and reflects ingest generation `generation` (articles written
+        since, e.g. by a load still running or one that died before its flush, are not in it)."""
+        return generation is not None and self.available and self._generation == generation
+
+    def count(self, column, low=None, high=None, include_high=True):
+        """Number of values with low <= value <= high (or < high when include_high is False)."""
+        values = self._columns[column]
+        if isinstance(low, datetime):
+            low = _epoch(low)
+        if isinstance(high, datetime):
+            high = _epoch(high)
+        start = 0 if low is None else int(np.searchsorted(values, low, side='left'))
+        end = len(values) if high is None else int(np.searchsorted(values, high,
+                                                                   side='right' if include_high else 'left'))
+        return max(0, end - start)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Build the memory-mapped column index used for range counts.')
+    parser.add_argument('--mongo-uri', default="mongodb://localhost:27017/")
+    parser.add_argument('--dir', default=COLUMN_INDEX_DIR)
+    args = parser.parse_args()
+
+    collection = pymongo.MongoClient(args.mongo_uri)["almayadeen"]["articles"]
+    build_index(collection, args.dir)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,167 @@
+import random
+import threading
+import time
+from email.utils import parsedate_to_datetime
+from datetime import datetime, timezone
+from urllib.parse import urlsplit
+
+import requests
+
+# Responses worth retrying: throttling and transient server errors
+RETRY_STATUSES = frozenset([429, 500, 502, 503, 504])
+
+
+def parse_retry_after(value):
+    """Convert a Retry-After header (seconds or HTTP date) to seconds, or None."""
+    if not value:
+        return None
+    value = value.strip()
+    if value.isdigit():
+        return float(value)
+    try:
+        retry_at = parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    if retry_at.tzinfo is None:
+        retry_at = retry_at.replace(tzinfo=timezone.utc)
+    return max(0.0, (retry_at - datetime.now(timezone.utc)).total_seconds())
+
+
+def is_retryable(error):
+    if isinstance(error, (requests.ConnectionError, requests.Timeout)):
+        return True
+    response = getattr(error, 'response', None)
+    return response is not None and response.status_code in RETRY_STATUSES
+
+
+class _HostState:
+    def __init__(self, limit):
+        self.limit = float(limit)
+        self.in_flight = 0
+        self.paused_until = 0.0
+        self.last_decrease = 0.0
+
+
+class CrawlController:
+    """Adaptive per-host concurrency limit with retries (AIMD).
+
+    Every request to a host takes a slot; the number of slots grows by about one
+    per round of fast, successful responses and is halved when the host answers
+    429/5xx, times out, or slows down past `target_latency`. Retry-After pauses
+    the whole host. Failed requests are retried with jittered exponential backoff,
+    and URLs that still fail are kept in `failed` for a final pass.
+    """
+
+    def __init__(self, max_concurrency=16, initial_concurrency=4, min_concurrency=1, target_latency=2.0,
+                 max_retries=3, backoff_base=0.5, backoff_max=30.0, max_retry_after=300.0, timeout=10,
+                 metrics=None):
+        self.max_concurrency = max_concurrency
+        self.initial_concurrency = min(initial_concurrency, max_concurrency)
+        self.min_concurrency = min_concurrency
+        self.target_latency = target_latency
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.max_retry_after = max_retry_after
+        self.timeout = timeout
+        # Optional CrawlMetrics; every failed attempt is counted, not just final failures
+        self.metrics = metrics
+        self.retries = 0
+        self.failed = []
+        self._hosts = {}
+        self._condition = threading.Condition()
+
+    def limit(self, host):
+        with self._condition:
+            return int(self._host(host).limit)
+
+    def get(self, session, url, headers=None):
+        """GET `url` within the host's concurrency limit, retrying transient failures.
+
+        Returns the response (which may still be a non-retryable 4xx), or raises the
+        last error once the retries are used up.
+        """
+        host = urlsplit(url).netloc
+        for attempt in range(self.max_retries + 1):
+            self._acquire(host)
+            start = time.monotonic()
+            retry_after = None
+            try:
+                response = session.get(url, timeout=self.timeout, headers=headers)
+            except (requests.ConnectionError, requests.Timeout) as e:
+                self._release(host, time.monotonic() - start, ok=False)
+                error = e
+            else:
+                latency = time.monotonic() - start
+                if response.status_code not in RETRY_STATUSES:
+                    self._release(host, latency, ok=True)
+                    return response
+                self._release(host, latency, ok=False)
+                retry_after = parse_retry_after(response.headers.get('Retry-After'))
+                error = requests.HTTPError(f"{response.status_code} Error for url: {url}", response=response)
+
+            if self.metrics is not None:
+                self.metrics.error('attempt', error)
+            if attempt == self.max_retries:
+                raise error
+            with self._condition:
+                self.retries += 1
+            if retry_after is not None:
+                # Retry-After applies to the whole host; _acquire waits it out
+                self._pause(host, min(retry_after, self.max_retry_after))
+            else:
+                time.sleep(self._backoff(attempt))
+
+    def add_failed(self, entry, error):
+        """Queue an entry for the final retry pass if its error was transient."""
+        if is_retryable(error):
+            with self._condition:
+                self.failed.append(entry)
+
+    def take_failed(self):
+        with self._condition:
+            failed, self.failed = self.failed, []
+        return failed
+
+    def _backoff(self, attempt):
+        # Full jitter: spread retries out instead of hitting the host in lockstep
+        return random.uniform(0, min(self.backoff_max, self.backoff_base * 2 ** attempt))
+
+    def _host(self, host):
+        state = self._hosts.get(host)
+        if state is None:
+            state = self._hosts[host] = _HostState(self.initial_concurrency)
+        return state
+
+    def _acquire(self, host):
+        with self._condition:
+            state = self._host(host)
+            while True:
+                wait = state.paused_until - time.monotonic()
+                if wait > 0:
+                    self._condition.wait(wait)
+                elif state.in_flight < int(state.limit):
+                    state.in_flight += 1
+                    return
+                else:
+                    self._condition.wait()
+
+    def _release(self, host, latency, ok):
+        with self._condition:
+            state = self._host(host)
+            state.in_flight -= 1
+            now = time.monotonic()
+            if ok and latency <= self.target_latency:
+                # Additive increase: roughly +1 slot per limit's worth of good responses
+                state.limit = min(self.max_concurrency, state.limit + 1 / state.limit)
+            elif now - state.last_decrease > self.target_latency:
+                # Multiplicative decrease, at most once per latency window so one burst
+                # of errors doesn't collapse the limit to the minimum
+                state.limit = max(self.min_concurrency, state.limit / 2)
+                state.last_decrease = now
+            self._condition.notify_all()
+
+    def _pause(self, host, seconds):
+        with self._condition:
+            state = self._host(host)
+            state.paused_until = max(state.paused_until, time.monotonic() + seconds)
@@ -0,0 +1,106 @@
+import hashlib
+import json
+import sqlite3
+import threading
+from datetime import datetime, timezone
+
+# Commit to disk after this many recorded pages (and always on close)
+COMMIT_EVERY = 100
+
+
+def content_hash(article):
+    """Hash the extracted article fields, ignoring page chrome that changes on every request.
+
+    Accepts an Article or its dict form, so the loader can compare stored documents.
+    """
+    fields = article if isinstance(article, dict) else article.__dict__
+    payload = json.dumps(fields, ensure_ascii=False, sort_keys=True, default=str)
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+
+class CrawlState:
+    """Persistent per-URL crawl state used to skip or conditionally re-fetch articles.
+
+    For every article URL it records the sitemap <lastmod>, the ETag and
+    Last-Modified response headers, and a hash of the extracted content. It is
+    safe to share one instance between the scraper threads.
+    """
+
+    def __init__(self, path='crawl_state.sqlite'):
+        self.path = path
+        self._lock = threading.Lock()
+        self._pending_writes = 0
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        self.connection.execute('PRAGMA journal_mode=WAL')
+        self.connection.execute("""
+            CREATE TABLE IF NOT EXISTS pages (
+                url TEXT PRIMARY KEY,
+                post_id TEXT,
+                lastmod TEXT,
+                etag TEXT,
+                last_modified TEXT,
+                content_hash TEXT,
+                fetched_at TEXT
+            )
+        """)
+        self.connection.execute('CREATE INDEX IF NOT EXISTS pages_post_id ON pages (post_id)')
+        self.connection.commit()
+
+    def get(self, url):
+        with self._lock:
+            row = self.connection.execute('SELECT * FROM pages WHERE url = ?', (url,)).fetchone()
+        return self._to_dict(row)
+
+    def get_by_post_id(self, post_id):
+        with self._lock:
+            row = self.connection.execute('SELECT * FROM pages WHERE post_id = ?', (post_id,)).fetchone()
+        return self._to_dict(row)
+
+    def is_unchanged(self, url, lastmod):
+        """True if the sitemap <lastmod> matches the one recorded at the last fetch."""
+        if not lastmod:
+            return False
+        record = self.get(url)
+        return record is not None and record['lastmod'] == lastmod
+
+    def conditional_headers(self, url):
+        """Build If-None-Match/If-Modified-Since headers from the last response."""
+        record = self.get(url)
+        headers = {}
+        if record is not None:
+            if record['etag']:
+                headers['If-None-Match'] = record['etag']
+            if record['last_modified']:
+                headers['If-Modified-Since'] = record['last_modified']
+        return headers
+
+    def record(self, url, lastmod=None, etag=None, last_modified=None, post_id=None, content_hash=None):
+        """Store the outcome of a fetch. None values keep what was recorded before."""
+        fetched_at = datetime.now(timezone.utc).isoformat()
+        with self._lock:
+            self.connection.execute("""
+                INSERT INTO pages (url, post_id, lastmod, etag, last_modified, content_hash, fetched_at)
+                VALUES (?, ?, ?, ?, ?, ?, ?)
+                ON CONFLICT (url) DO UPDATE SET
+                    post_id = COALESCE(excluded.post_id, post_id),
+                    lastmod = COALESCE(excluded.lastmod, lastmod),
+                    etag = COALESCE(excluded.etag, etag),
+                    last_modified = COALESCE(excluded.last_modified, last_modified),
+                    content_hash = COALESCE(excluded.content_hash, content_hash),
+                    fetched_at = excluded.fetched_at
+            """, (url, post_id, lastmod, etag, last_modified, content_hash, fetched_at))
+            self._pending_writes += 1
+            if self._pending_writes >= COMMIT_EVERY:
+                self.connection.commit()
+                self._pending_writes = 0
+
+    def close(self):
+        with self._lock:
+            self.connection.commit()
+            self.connection.close()
+
+    def _to_dict(self, row):
+        if row is None:
+            return None
+        columns = ('url', 'post_id', 'lastmod', 'etag', 'last_modified', 'content_hash', 'fetched_at')
+        return dict(zip(columns, row))
@@ -0,0 +1,160 @@
+import argparse
+import sys
+from datetime import datetime, timedelta, timezone
+
+import pymongo
+from pymongo import IndexModel
+from pymongo.errors import OperationFailure
+
+from queries import (AUTHOR_COLLATION, article_details_query, author_filter, count_pipeline, coverage_filter,
+                     day_range, flag_filter, longest_articles_pipeline, month_range, popular_keywords_pipeline,
+                     range_filter, recent_articles_query, shortest_articles_pipeline, titles_query, year_range)
+from search import SEARCH_INDEX, search_query
+
+# Every index the API and the loader rely on. Names are fixed so re-running is a no-op.
+INDEXES = [
+    # Upserts look documents up by post_id; older documents without one are left out of the index
+    IndexModel('post_id', name='post_id_unique', unique=True,
+               partialFilterExpression={'post_id': {'$type': 'string'}}),
+    IndexModel([('published_time', pymongo.DESCENDING)], name='published_time'),
+    IndexModel('word_count', name='word_count'),
+    IndexModel('keyword_count', name='keyword_count'),
+    # Multikey over vocabulary ids (see vocabulary.py): one small int entry per keyword / class
+    IndexModel('keyword_ids', name='keyword_ids'),
+    # List endpoints page through their matches in _id order (keyset pagination), so the
+    # indexes they filter on carry _id as a second key
+    IndexModel([('class_ids', 1), ('_id', 1)], name='class_ids'),
+    IndexModel([('author', 1), ('_id', 1)], name='author_ci', collation=AUTHOR_COLLATION),
+    # Keyword search over the folded title/keywords/description and the lead of the body
+    SEARCH_INDEX,
+    # Boolean flags are only indexed where they are true, which is all the API asks for
+    IndexModel([('has_video', 1), ('_id', 1)], name='has_video', partialFilterExpression={'has_video': True}),
+    IndexModel([('has_thumbnail', 1), ('_id', 1)], name='has_thumbnail',
+               partialFilterExpression={'has_thumbnail': True}),
+    IndexModel([('updated_after_publication', 1), ('_id', 1)], name='updated_after_publication',
+               partialFilterExpression={'updated_after_publication': True}),
+]
+
+
+# Indexes since replaced (the string keywords/classes ones by the vocabulary id ones); dropped if present
+OBSOLETE_INDEXES = ['keywords', 'classes']
+
+
+def ensure_indexes(collection):
+    """Create the declared indexes and drop obsolete ones; existing ones with the same spec are left alone."""
+    existing = collection.index_information()
+    for name in OBSOLETE_INDEXES:
+        if name in existing:
+            collection.drop_index(name)
+            print(f"Dropped obsolete index {name}")
+    created = []
+    for index in INDEXES:
+        try:
+            created += collection.create_indexes([index])
+        except OperationFailure as e:
+            # Usually an index with the same name but other options, or duplicate post_ids
+            print(f"Could not create index {index.document['name']}: {e}")
+    return created
+
+
+def endpoint_queries():
+    """The query of each API endpoint, built by the same code app.py uses, with sample parameters.
+
+    Returns (name, kind, query): `kind` is 'find' (query is filter, projection, sort,
+    collation) or 'aggregate' (query is the pipeline). Counts are explained as the
+    aggregation count_documents() runs. Endpoints that group the whole collection
+    read every document by design and are not listed.
+    """
+    now = datetime.now(timezone.utc)
+    day = datetime(now.year, now.month, now.day)
+
+    def count(field, low, high, include_high):
+        return 'aggregate', count_pipeline(range_filter(field, low, high, include_high))
+
+    return [
+        ('recent_articles', 'find', recent_articles_query()),
+        ('articles_by_keyword', 'find', search_query('لبنان')),
+        ('search', 'find', search_query('لبنان')),
+        ('articles_by_author', 'find', titles_query(author_filter('author'), collation=AUTHOR_COLLATION)),
+        ('articles_with_video', 'find', titles_query(flag_filter('has_video'))),
+        ('article_details', 'find', article_details_query('1')),
+        ('articles_by_year', *count('published_time', *year_range(now.year))),
+        ('longest_articles', 'aggregate', longest_articles_pipeline()),
+        ('shortest_articles', 'aggregate', shortest_articles_pipeline()),
+        ('articles_with_thumbnail', 'find', titles_query(flag_filter('has_thumbnail'))),
+        ('articles_updated_after_publication', 'find', titles_query(flag_filter('updated_after_publication'))),
+        ('articles_by_coverage', 'find', titles_query(coverage_filter(1))),
+        ('popular_keywords_last_X_days', 'aggregate', popular_keywords_pipeline(now - timedelta(days=7), now)),
+        ('articles_by_month', *count('published_time', *month_range(now.year, now.month))),
+        ('articles_by_word_count_range', *count('word_count', 100, 500, True)),
+        ('articles_with_specific_keyword_count', *count('keyword_count', 5, 5, True)),
+        ('articles_by_specific_date', *count('published_time', *day_range(day))),
+    ]
+
+
+def explain(collection, kind, query):
+    if kind == 'find':
+        query_filter, projection, sort, collation = query
+        cursor = collection.find(query_filter, projection, collation=collation)
+        if sort:
+            cursor = cursor.sort(sort)
+        return cursor.explain()
+    return collection.database.command('aggregate', collection.name, pipeline=query, explain=True)
+
+
+def _winning_stages(plan):
+    """Yield every stage name under the winning plan(s) of an explain document."""
+    if isinstance(plan, dict):
+        for key, value in plan.items():
+            if key == 'winningPlan':
+                yield from _stages(value)
+            elif key != 'rejectedPlans':
+                yield from _winning_stages(value)
+    elif isinstance(plan, list):
+        for item in plan:
+            yield from _winning_stages(item)
+
+
+def _stages(plan):
+    if isinstance(plan, dict):
+        if 'stage' in plan:
+            yield plan['stage']
+        for value in plan.values():
+            yield from _stages(value)
+    elif isinstance(plan, list):
+        for item in plan:
+            yield from _stages(item)
+
+
+def check_query_plans(collection):
+    """Explain every endpoint query; returns the names of those whose plan is a COLLSCAN."""
+    failures = []
+    for name, kind, query in endpoint_queries():
+        stages = list(_winning_stages(explain(collection, kind, query)))
+        status = 'COLLSCAN' if 'COLLSCAN' in stages else 'ok'
+        print(f"{name}: {status} ({' <- '.join(stages)})")
+        if status == 'COLLSCAN':
+            failures.append(name)
+    return failures
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Create the articles indexes and verify the API query plans.')
+    parser.add_argument('--mongo-uri', default="mongodb://localhost:27017/")
+    parser.add_argument('--check', action='store_true', help='explain every endpoint query and fail on COLLSCAN')
+    args = parser.parse_args()
+
+    collection = pymongo.MongoClient(args.mongo_uri)["almayadeen"]["articles"]
+    created = ensure_indexes(collection)
+    print(f"Indexes in place ({len(created)} checked): {', '.join(sorted(collection.index_information()))}")
+
+    if args.check:
+        failures = check_query_plans(collection)
+        if failures:
+            print(f"{len(failures)} endpoint queries fall back to a collection scan: {', '.join(failures)}")
+            sys.exit(1)
+        print("All endpoint queries use an index.")
+
+
+if __name__ == '__main__':
+    main()
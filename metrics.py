@@ -0,0 +1,240 @@
+import json
+import threading
+import time
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Latency buckets in seconds, from sub-millisecond parsing up to slow fetches
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+class Histogram:
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+
+    def observe(self, value):
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[i] += 1
+                break
+        else:
+            self.counts[-1] += 1
+        self.count += 1
+        self.sum += value
+        self.max = max(self.max, value)
+
+    def quantile(self, q):
+        """Estimate a quantile from the buckets (upper bound of the bucket it falls in)."""
+        if not self.count:
+            return 0.0
+        rank = q * self.count
+        seen = 0
+        for bound, count in zip(self.buckets, self.counts):
+            seen += count
+            if seen >= rank:
+                return bound
+        return self.max
+
+
+def _label_text(labels):
+    if not labels:
+        return ''
+    pairs = ','.join('{}="{}"'.format(key, str(value).replace('\\', '\\\\').replace('"', '\\"'))
+                     for key, value in labels)
+    return '{' + pairs + '}'
+
+
+class MetricsRegistry:
+    """Thread-safe counters, gauges and histograms with Prometheus text export."""
+
+    def __init__(self, prefix):
+        self.prefix = prefix
+        self.started = time.time()
+        self._lock = threading.Lock()
+        self._counters = {}
+        self._gauges = {}
+        self._histograms = {}
+
+    def inc(self, name, amount=1, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + amount
+
+    def set_gauge(self, name, value, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self._gauges[key] = value
+
+    def observe(self, name, value, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = self._histograms[key] = Histogram()
+            histogram.observe(value)
+
+    @contextmanager
+    def timer(self, name, **labels):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - start, **labels)
+
+    def counter_value(self, name, **labels):
+        with self._lock:
+            if labels:
+                return self._counters.get((name, tuple(sorted(labels.items()))), 0)
+            return sum(value for (key, _), value in self._counters.items() if key == name)
+
+    def to_prometheus(self):
+        lines = []
+        with self._lock:
+            for kind, metrics in (('counter', self._counters), ('gauge', self._gauges)):
+                for name in sorted({name for name, _ in metrics}):
+                    full_name = f'{self.prefix}_{name}'
+                    lines.append(f'# TYPE {full_name} {kind}')
+                    for (metric, labels), value in sorted(metrics.items()):
+                        if metric == name:
+                            lines.append(f'{full_name}{_label_text(labels)} {value}')
+
+            for name in sorted({name for name, _ in self._histograms}):
+                full_name = f'{self.prefix}_{name}'
+                lines.append(f'# TYPE {full_name} histogram')
+                for (metric, labels), histogram in sorted(self._histograms.items()):
+                    if metric != name:
+                        continue
+                    cumulative = 0
+                    for bound, count in zip(histogram.buckets + ('+Inf',), histogram.counts):
+                        cumulative += count
+                        bucket_labels = labels + (('le', bound),)
+                        lines.append(f'{full_name}_bucket{_label_text(bucket_labels)} {cumulative}')
+                    lines.append(f'{full_name}_sum{_label_text(labels)} {histogram.sum}')
+                    lines.append(f'{full_name}_count{_label_text(labels)} {histogram.count}')
+        return '\n'.join(lines) + '\n'
+
+    def summary(self):
+        """JSON-friendly snapshot: counters, gauges and per-histogram count/mean/p50/p95/p99/max."""
+        def key_text(name, labels):
+            return name + _label_text(labels)
+
+        with self._lock:
+            return {
+                'elapsed_seconds': round(time.time() - self.started, 3),
+                'counters': {key_text(*key): value for key, value in sorted(self._counters.items())},
+                'gauges': {key_text(*key): value for key, value in sorted(self._gauges.items())},
+                'histograms': {
+                    key_text(*key): {
+                        'count': histogram.count,
+                        'mean': histogram.sum / histogram.count if histogram.count else 0.0,
+                        'p50': histogram.quantile(0.5),
+                        'p95': histogram.quantile(0.95),
+                        'p99': histogram.quantile(0.99),
+                        'max': histogram.max,
+                    }
+                    for key, histogram in sorted(self._histograms.items())
+                },
+            }
+
+    def write_prometheus(self, path):
+        with open(path, 'w', encoding='utf-8') as file:
+            file.write(self.to_prometheus())
+
+    def write_summary(self, path):
+        with open(path, 'w', encoding='utf-8') as file:
+            json.dump(self.summary(), file, ensure_ascii=False, indent=4)
+
+    def serve(self, port, host='127.0.0.1'):
+        """Expose /metrics (Prometheus) and /summary (JSON) on a background thread."""
+        registry = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, *args):
+                pass
+
+            def do_GET(self):
+                if self.path == '/metrics':
+                    body, content_type = registry.to_prometheus(), 'text/plain; version=0.0.4'
+                elif self.path == '/summary':
+                    body, content_type = json.dumps(registry.summary(), ensure_ascii=False), 'application/json'
+                else:
+                    self.send_error(404)
+                    return
+                payload = body.encode('utf-8')
+                self.send_response(200)
+                self.send_header('Content-Type', content_type)
+                self.send_header('Content-Length', str(len(payload)))
+                self.end_headers()
+                self.wfile.write(payload)
+
+        server = ThreadingHTTPServer((host, port), Handler)
+        server.daemon_threads = True
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        return server
+
+
+class StageRecorder:
+    """Collects stage timings inside a parser process so the parent can replay them."""
+
+    def __init__(self):
+        self.observations = []
+
+    def observe_stage(self, stage, seconds):
+        self.observations.append((stage, seconds))
+
+    @contextmanager
+    def stage(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe_stage(name, time.perf_counter() - start)
+
+
+class CrawlMetrics(MetricsRegistry):
+    """Crawler instrumentation: per-stage latency, bytes, pages, errors and queue depths.
+
+    Stages are `fetch` (whole download), `server` (time to response headers),
+    `parse` (lxml tree build), `extract` (field extraction), `classes_json`
+    (decoding the tawsiyat script) and `persist` (writing output).
+    """
+
+    def __init__(self):
+        super().__init__('crawler')
+
+    def observe_stage(self, stage, seconds):
+        self.observe('stage_seconds', seconds, stage=stage)
+
+    def stage(self, name):
+        return self.timer('stage_seconds', stage=name)
+
+    def replay(self, recorder):
+        for stage, seconds in recorder.observations:
+            self.observe_stage(stage, seconds)
+
+    def page_scraped(self):
+        self.inc('pages_total')
+
+    def error(self, stage, error):
+        response = getattr(error, 'response', None)
+        error_type = f'HTTP {response.status_code}' if response is not None else type(error).__name__
+        self.inc('errors_total', stage=stage, type=error_type)
+
+    def bytes_in(self, amount):
+        self.inc('bytes_in_total', amount)
+
+    def bytes_out(self, amount):
+        self.inc('bytes_out_total', amount)
+
+    def queue_depth(self, queue_name, depth):
+        self.set_gauge('queue_depth', depth, queue=queue_name)
+
+    def summary(self):
+        summary = super().summary()
+        pages = self.counter_value('pages_total')
+        summary['pages_per_second'] = round(pages / summary['elapsed_seconds'], 3) if summary['elapsed_seconds'] else 0.0
+        return summary
@@ -0,0 +1,302 @@
+import argparse
+import gzip
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+from collections import OrderedDict, deque
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, timezone
+
+from Task1 import ArticleScraper, sitemap_month
+
+# Commit the index after this many stored pages (and always on close)
+COMMIT_EVERY = 100
+# Chunks of pages queued per parser process during re-extraction
+CHUNKS_PER_PROCESS = 4
+# Monthly output files kept open at once while re-extracting
+MAX_OPEN_MONTHS = 32
+
+
+def _object_path(root, digest):
+    return os.path.join(root, 'objects', digest[:2], f'{digest}.html.gz')
+
+
+class PageArchive:
+    """On-disk, content-addressed archive of fetched article pages.
+
+    Page bodies are gzip-compressed under objects/<aa>/<sha256>.html.gz, so a page
+    that has not changed between crawls is only stored once. index.sqlite records
+    every capture (URL, post_id, digest, fetch time, headers, and the sitemap the
+    URL was found in), which lets extraction be re-run over the archive instead of
+    re-crawling the site.
+    """
+
+    def __init__(self, root='archive'):
+        self.root = root
+        os.makedirs(os.path.join(root, 'objects'), exist_ok=True)
+        self._lock = threading.Lock()
+        self._pending_writes = 0
+        self.connection = sqlite3.connect(os.path.join(root, 'index.sqlite'), check_same_thread=False)
+        self.connection.execute('PRAGMA journal_mode=WAL')
+        self.connection.execute("""
+            CREATE TABLE IF NOT EXISTS captures (
+                url TEXT NOT NULL,
+                post_id TEXT,
+                digest TEXT NOT NULL,
+                fetched_at TEXT NOT NULL,
+                content_type TEXT,
+                etag TEXT,
+                last_modified TEXT
+            )
+        """)
+        # Archives written before the sitemap was recorded lack the column
+        columns = [row[1] for row in self.connection.execute('PRAGMA table_info(captures)')]
+        if 'sitemap' not in columns:
+            self.connection.execute('ALTER TABLE captures ADD COLUMN sitemap TEXT')
+        self.connection.execute('CREATE INDEX IF NOT EXISTS captures_url ON captures (url, fetched_at)')
+        self.connection.execute('CREATE INDEX IF NOT EXISTS captures_post_id ON captures (post_id)')
+        self.connection.commit()
+
+    def object_path(self, digest):
+        return _object_path(self.root, digest)
+
+    def store(self, url, content, headers=None):
+        """Archive a page body and record the capture. Returns the content digest."""
+        digest = hashlib.sha256(content).hexdigest()
+        path = self.object_path(digest)
+        if not os.path.exists(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            # Write under a temporary name so a crash never leaves a truncated object
+            tmp_path = f'{path}.{threading.get_ident()}.tmp'
+            with gzip.open(tmp_path, 'wb') as file:
+                file.write(content)
+            os.replace(tmp_path, path)
+
+        headers = headers or {}
+        with self._lock:
+            self.connection.execute(
+                'INSERT INTO captures (url, digest, fetched_at, content_type, etag, last_modified) VALUES (?, ?, ?, ?, ?, ?)',
+                (url, digest, datetime.now(timezone.utc).isoformat(),
+                 headers.get('Content-Type'), headers.get('ETag'), headers.get('Last-Modified'))
+            )
+            self._commit_if_due()
+        return digest
+
+    def set_post_id(self, url, post_id):
+        """Attach the extracted post_id to the captures of `url`."""
+        if post_id is None:
+            return
+        with self._lock:
+            self.connection.execute('UPDATE captures SET post_id = ? WHERE url = ? AND post_id IS NULL', (post_id, url))
+            self._commit_if_due()
+
+    def set_sitemap(self, url, sitemap):
+        """Record the monthly sitemap `url` was crawled from, which names its output file."""
+        with self._lock:
+            self.connection.execute('UPDATE captures SET sitemap = ? WHERE url = ?', (sitemap, url))
+            self._commit_if_due()
+
+    def sitemap_of(self, url):
+        """The sitemap recorded for `url`, or None."""
+        with self._lock:
+            row = self.connection.execute(
+                'SELECT sitemap FROM captures WHERE url = ? AND sitemap IS NOT NULL ORDER BY fetched_at DESC LIMIT 1',
+                (url,)
+            ).fetchone()
+        return row[0] if row else None
+
+    def load(self, digest):
+        with gzip.open(self.object_path(digest), 'rb') as file:
+            return file.read()
+
+    def latest(self, url=None, post_id=None):
+        """Return (url, digest) of the newest capture of a URL or post_id, or None."""
+        column, value = ('url', url) if url is not None else ('post_id', post_id)
+        with self._lock:
+            return self.connection.execute(
+                f'SELECT url, digest FROM captures WHERE {column} = ? ORDER BY fetched_at DESC LIMIT 1', (value,)
+            ).fetchone()
+
+    def iter_latest(self):
+        """Yield (url, digest) for the newest capture of every archived URL."""
+        with self._lock:
+            rows = self.connection.execute("""
+                SELECT url, digest FROM captures AS c
+                WHERE fetched_at = (SELECT MAX(fetched_at) FROM captures WHERE url = c.url)
+                ORDER BY url
+            """).fetchall()
+        yield from rows
+
+    def close(self):
+        with self._lock:
+            self.connection.commit()
+            self.connection.close()
+
+    def _commit_if_due(self):
+        self._pending_writes += 1
+        if self._pending_writes >= COMMIT_EVERY:
+            self.connection.commit()
+            self._pending_writes = 0
+
+
+def _extract(root, url, digest):
+    """Re-extraction work item; runs in a worker process."""
+    try:
+        with gzip.open(_object_path(root, digest), 'rb') as file:
+            content = file.read()
+    except (OSError, EOFError) as e:
+        # Missing or truncated object (gzip.BadGzipFile is an OSError)
+        print(f"Skipping {url}: cannot read archived page {digest}: {e}")
+        return None
+    try:
+        return ArticleScraper(url).parse(content)
+    except Exception as e:
+        print(f"Error extracting {url}: {e}")
+        return None
+
+
+def _extract_chunk(root, captures):
+    """Returns (articles, number of captures skipped)."""
+    articles = [_extract(root, url, digest) for url, digest in captures]
+    extracted = [article for article in articles if article is not None]
+    return extracted, len(articles) - len(extracted)
+
+
+def output_month(archive, article):
+    """(year, month) of the crawler's output file for an article, as Task1.py derives it from the sitemap.
+
+    Captures archived before sitemaps were recorded fall back to the sitemap of the
+    article's publication month.
+    """
+    sitemap = archive.sitemap_of(article.url)
+    if sitemap is None:
+        try:
+            published = datetime.fromisoformat(article.publication_date)
+        except (TypeError, ValueError):
+            return ('unknown', 'unknown')
+        sitemap = f'sitemap-{published.year}-{published.month}.xml'
+    return sitemap_month(sitemap)
+
+
+def reextract(archive, processes=None, chunksize=16, stats=None):
+    """Run the current extraction rules over every archived page, yielding Articles.
+
+    Pages go to the workers in chunks, and only a few chunks per process are in
+    flight at a time, so memory stays flat however large the archive is. Pages that
+    cannot be read or parsed are skipped, and counted in stats['skipped'] if given.
+    """
+    processes = processes or os.cpu_count() or 1
+    stats = stats if stats is not None else {}
+    stats.setdefault('skipped', 0)
+
+    def results(future):
+        articles, skipped = future.result()
+        stats['skipped'] += skipped
+        return articles
+
+    with ProcessPoolExecutor(max_workers=processes) as executor:
+        in_flight = deque()
+        chunk = []
+        for capture in archive.iter_latest():
+            chunk.append(capture)
+            if len(chunk) < chunksize:
+                continue
+            in_flight.append(executor.submit(_extract_chunk, archive.root, chunk))
+            chunk = []
+            if len(in_flight) >= processes * CHUNKS_PER_PROCESS:
+                yield from results(in_flight.popleft())
+        if chunk:
+            in_flight.append(executor.submit(_extract_chunk, archive.root, chunk))
+        while in_flight:
+            yield from results(in_flight.popleft())
+
+
+class MonthlyJSONFiles:
+    """Write articles to the crawler's monthly files as they arrive.
+
+    Files are named as Task1.py names them after the monthly sitemap (articles_2024_1.xml.json
+    for sitemap-2024-1.xml; see output_month), so a rebuild replaces the crawler's output. Each month is streamed into a temporary file in the layout FileUtility.save_to_json
+    produces, and moved into place by close(). The least recently used month files
+    are closed (and reopened for appending) so no more than `max_open` are open.
+    """
+
+    def __init__(self, output_dir, max_open=MAX_OPEN_MONTHS):
+        os.makedirs(output_dir, exist_ok=True)
+        self.output_dir = output_dir
+        self.max_open = max_open
+        self.counts = {}
+        self._files = OrderedDict()
+
+    def _path(self, year, month):
+        return os.path.join(self.output_dir, f'articles_{year}_{month}.json')
+
+    def write(self, article, month):
+        """Append an article to the file of `month`, a (year, month) pair."""
+        file = self._files.pop(month, None)
+        if file is None:
+            if len(self._files) >= self.max_open:
+                self._files.popitem(last=False)[1].close()
+            file = open(f'{self._path(*month)}.tmp', 'a' if month in self.counts else 'w', encoding='utf-8')
+        self._files[month] = file
+        item = json.dumps(article.__dict__, ensure_ascii=False, indent=4).replace('\n', '\n    ')
+        file.write(('[\n    ' if month not in self.counts else ',\n    ') + item)
+        self.counts[month] = self.counts.get(month, 0) + 1
+
+    def close(self):
+        for file in self._files.values():
+            file.close()
+        self._files.clear()
+        for (year, month), count in sorted(self.counts.items()):
+            path = self._path(year, month)
+            with open(f'{path}.tmp', 'a', encoding='utf-8') as file:
+                file.write('\n]')
+            os.replace(f'{path}.tmp', path)
+            print(f"Saved {count} articles for {year}-{month}")
+
+
+def save_to_mongo(articles, mongo_uri, batch_size=500):
+    """Upsert the re-extracted articles through the loader, as if read from scraper output.
+
+    They get the same normalization, content-hash skipping, vocabulary ids and
+    rollup/sketch/column-index updates as Data_storage.py gives a file.
+    """
+    from Data_storage import connect, store_articles
+
+    stats, failed = store_articles(connect(mongo_uri), (dict(article.__dict__) for article in articles), batch_size)
+    for label, reason in failed:
+        print(f"Could not store {label}: {reason}")
+    return stats
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Rebuild scraper output from the raw page archive.')
+    parser.add_argument('--archive', default='archive', help='archive directory written by Task1.py --archive')
+    parser.add_argument('--output', default='output', help='directory for the rebuilt monthly JSON files')
+    parser.add_argument('--mongo', metavar='URI', help='write to MongoDB instead of JSON files')
+    parser.add_argument('--processes', type=int, default=None, help='parser processes (default: all cores)')
+    args = parser.parse_args()
+
+    archive = PageArchive(args.archive)
+    stats = {}
+    articles = reextract(archive, processes=args.processes, stats=stats)
+
+    if args.mongo:
+        stats = save_to_mongo(articles, args.mongo)
+        print(f"Re-extracted articles written to MongoDB: {stats['inserted']} inserted, {stats['updated']} updated, "
+              f"{stats['unchanged']} unchanged.")
+    else:
+        # One file per monthly sitemap, named as the crawler names them
+        monthly_files = MonthlyJSONFiles(args.output)
+        for article in articles:
+            monthly_files.write(article, output_month(archive, article))
+        monthly_files.close()
+
+    if stats['skipped']:
+        print(f"Skipped {stats['skipped']} archived pages that could not be read or parsed")
+    archive.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,181 @@
+import argparse
+import os
+import shutil
+import time
+from datetime import timezone
+
+import pymongo
+
+from Data_storage import discover_files, iter_documents, normalize_document
+from vocabulary import vocabulary_key
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:
+    # Snapshots are optional; the loader and the API never need pyarrow
+    pa = pq = None
+
+# Where snapshots are written by default: one Hive-style year=YYYY/month=M directory per month
+SNAPSHOT_DIR = 'snapshot'
+# Rows converted to Arrow at a time
+ROWS_PER_BATCH = 50000
+# Columns stored with dictionary encoding: few distinct values, repeated across many rows.
+# List columns are named by the path of their elements.
+DICTIONARY_COLUMNS = ['author', 'language', 'keywords.list.element', 'classes.list.element']
+# Fields exported; the full text stays in Mongo
+EXPORT_FIELDS = ('post_id', 'url', 'title', 'author', 'language', 'published_time', 'word_count',
+                 'keyword_count', 'keywords', 'classes', 'has_video', 'has_thumbnail',
+                 'updated_after_publication')
+
+
+def article_schema():
+    text = pa.dictionary(pa.int32(), pa.string())
+    return pa.schema([
+        ('post_id', pa.string()),
+        ('url', pa.string()),
+        ('title', pa.string()),
+        ('author', text),
+        ('language', text),
+        ('published_time', pa.timestamp('s', tz='UTC')),
+        ('word_count', pa.int32()),
+        ('keyword_count', pa.int32()),
+        ('keywords', pa.list_(text)),
+        ('classes', pa.list_(text)),
+        ('has_video', pa.bool_()),
+        ('has_thumbnail', pa.bool_()),
+        ('updated_after_publication', pa.bool_()),
+        ('year', pa.int32()),
+        ('month', pa.int32()),
+    ])
+
+
+def _require_pyarrow():
+    if pa is None:
+        raise RuntimeError("Parquet snapshots need the 'pyarrow' package")
+
+
+def _distinct(values):
+    """First spelling of each value, counting spellings with one vocabulary key as one (see vocabulary.py)."""
+    seen = {}
+    for value in values or []:
+        seen.setdefault(vocabulary_key(value), value)
+    return [value for key, value in seen.items() if key]
+
+
+def _row(document):
+    """One normalized article -> one snapshot row."""
+    row = {field: document.get(field) for field in EXPORT_FIELDS}
+    published_time = row['published_time']
+    if published_time is not None and published_time.tzinfo is None:
+        # Mongo hands back naive UTC datetimes
+        published_time = row['published_time'] = published_time.replace(tzinfo=timezone.utc)
+    # Counted once per article, as in the rollups
+    row['keywords'] = _distinct(row['keywords'])
+    row['classes'] = _distinct(row['classes'])
+    row['year'] = published_time.year if published_time else None
+    row['month'] = published_time.month if published_time else None
+    return row
+
+
+def mongo_documents(collection):
+    return collection.find({}, {field: 1 for field in EXPORT_FIELDS})
+
+
+def file_documents(files):
+    """Scraper output read directly, with the same normalization the loader applies."""
+    for file_path in files:
+        for document in iter_documents(file_path):
+            if isinstance(document, dict):
+                yield normalize_document(document)
+
+
+def _publish(staging_dir, out_dir):
+    """Make the finished snapshot in `staging_dir` the one at `out_dir`.
+
+    out_dir is a symlink to a versioned directory next to it; a new version is swapped
+    in by atomically replacing the link, so a reader (or a crash) never finds no
+    snapshot there. The previous version is removed afterwards. Where symlinks can't
+    be created (e.g. Windows without developer mode), the old directory is renamed
+    aside, the new one renamed in, and only then the old one removed.
+    """
+    version_dir = f"{out_dir}.{time.time_ns()}"
+    os.replace(staging_dir, version_dir)
+    previous = None
+    if os.path.islink(out_dir):
+        previous = os.path.join(os.path.dirname(os.path.abspath(out_dir)), os.readlink(out_dir))
+    elif os.path.isdir(out_dir):
+        # A directory written before snapshots were versioned (or without symlinks) can't be
+        # replaced by a link in one step; it is moved aside first
+        previous = f"{out_dir}.previous"
+        shutil.rmtree(previous, ignore_errors=True)
+        os.replace(out_dir, previous)
+    link = f"{out_dir}.link"
+    try:
+        if os.path.lexists(link):
+            os.remove(link)
+        os.symlink(os.path.basename(version_dir), link, target_is_directory=True)
+        os.replace(link, out_dir)
+    except OSError:
+        os.replace(version_dir, out_dir)
+    if previous is not None:
+        shutil.rmtree(previous, ignore_errors=True)
+
+
+def export(documents, out_dir=SNAPSHOT_DIR, rows_per_batch=ROWS_PER_BATCH):
+    """Write articles as Parquet partitioned by year/month; returns the number of rows.
+
+    The snapshot is built next to `out_dir` and published at the end (see _publish),
+    so readers never see a half-written or missing one.
+    """
+    _require_pyarrow()
+    schema = article_schema()
+    out_dir = out_dir.rstrip('/\\')
+    staging_dir = out_dir + '.tmp'
+    shutil.rmtree(staging_dir, ignore_errors=True)
+
+    rows, total, part = [], 0, 0
+
+    def write(rows, part):
+        table = pa.Table.from_pylist(rows, schema=schema)
+        pq.write_to_dataset(table, staging_dir, partition_cols=['year', 'month'],
+                            basename_template=f'part-{part}-{{i}}.parquet',
+                            use_dictionary=DICTIONARY_COLUMNS, compression='zstd')
+
+    for document in documents:
+        rows.append(_row(document))
+        if len(rows) >= rows_per_batch:
+            write(rows, part)
+            total, part, rows = total + len(rows), part + 1, []
+    if rows:
+        write(rows, part)
+        total += len(rows)
+
+    if total:
+        _publish(staging_dir, out_dir)
+    print(f"Exported {total} articles to {out_dir}")
+    return total
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Export articles to a Parquet snapshot partitioned by year/month.')
+    parser.add_argument('patterns', nargs='*',
+                        help='scraper JSON/NDJSON files or glob patterns to export instead of MongoDB')
+    parser.add_argument('--mongo-uri', default="mongodb://localhost:27017/")
+    parser.add_argument('--out', default=SNAPSHOT_DIR)
+    args = parser.parse_args()
+
+    if args.patterns:
+        files = discover_files(args.patterns)
+        if not files:
+            print("No files matched. Please check the file paths and patterns.")
+            return
+        documents = file_documents(files)
+    else:
+        collection = pymongo.MongoClient(args.mongo_uri)["almayadeen"]["articles"]
+        documents = mongo_documents(collection)
+    export(documents, args.out)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,199 @@
+import multiprocessing
+import os
+import queue
+import threading
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+
+from Task1 import DEFAULT_CONCURRENCY, ArticleScraper
+from metrics import StageRecorder
+
+# Marks the end of a stage's output on its queue
+_DONE = object()
+
+
+def _parse_page(url, content, instrument=False):
+    """Parser stage work item; runs in a worker process.
+
+    With `instrument`, the stage timings are returned alongside the article so the
+    parent process can add them to its metrics.
+    """
+    recorder = StageRecorder() if instrument else None
+    article = ArticleScraper(url, metrics=recorder).parse(content)
+    return article, recorder
+
+
+def _put(q, item, stop):
+    """Put `item` on a bounded queue, giving up if the pipeline is being stopped."""
+    while not stop.is_set():
+        try:
+            q.put(item, timeout=0.1)
+            return True
+        except queue.Full:
+            continue
+    return False
+
+
+def _get(q, stop):
+    """Take the next item from a queue, returning _DONE if the pipeline is being stopped."""
+    while not stop.is_set():
+        try:
+            return q.get(timeout=0.1)
+        except queue.Empty:
+            continue
+    return _DONE
+
+
+class CrawlPipeline:
+    """Staged crawler: fetcher threads -> parser processes -> writer.
+
+    Fetcher threads download raw page bytes over the shared session, a process
+    pool turns the bytes into Article objects, and the caller of `run()` is the
+    writer stage (FileUtility, the database, ...). Each stage has its own size and
+    the stages are joined by bounded queues, so a slow stage blocks the ones before
+    it instead of letting pages pile up in memory.
+    """
+
+    def __init__(self, session, fetchers=DEFAULT_CONCURRENCY, parsers=None, queue_size=None,
+                 crawl_state=None, archive=None, controller=None, metrics=None):
+        self.session = session
+        self.fetchers = fetchers
+        self.parsers = parsers or os.cpu_count() or 1
+        self.queue_size = queue_size or 2 * max(self.fetchers, self.parsers)
+        self.crawl_state = crawl_state
+        self.archive = archive
+        self.controller = controller
+        self.metrics = metrics
+        # Spawned rather than forked: the pool starts while fetcher threads are running
+        self.parse_pool = ProcessPoolExecutor(max_workers=self.parsers, mp_context=multiprocessing.get_context('spawn'))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        self.parse_pool.shutdown(cancel_futures=True)
+
+    def run(self, entries):
+        """Crawl sitemap entries, yielding (url, article, crawl_record) as parsed articles become available.
+
+        Articles come out in completion order, not sitemap order. Failed or
+        unchanged articles are not yielded. The caller records crawl_record in the
+        CrawlState once it has persisted the article. Closing the generator early
+        (e.g. when the article budget is reached) stops every stage. If reading the
+        entries fails, the articles already queued are still yielded, then the error
+        is raised here.
+        """
+        stop = threading.Event()
+        url_queue = queue.Queue(self.queue_size)
+        page_queue = queue.Queue(self.queue_size)
+        article_queue = queue.Queue(self.queue_size)
+        # Exception raised by `entries` in the feeder thread
+        feed_errors = []
+
+        threads = [threading.Thread(target=self._feed, args=(entries, url_queue, stop, feed_errors), daemon=True)]
+        threads += [
+            threading.Thread(target=self._fetch, args=(url_queue, page_queue, stop), daemon=True)
+            for _ in range(self.fetchers)
+        ]
+        threads.append(threading.Thread(target=self._dispatch, args=(page_queue, article_queue, stop), daemon=True))
+        for thread in threads:
+            thread.start()
+
+        try:
+            while True:
+                item = _get(article_queue, stop)
+                if item is _DONE:
+                    if feed_errors:
+                        raise feed_errors[0]
+                    break
+                scraper, headers, article = item
+                if self.metrics is not None:
+                    self.metrics.queue_depth('urls', url_queue.qsize())
+                    self.metrics.queue_depth('pages', page_queue.qsize())
+                    self.metrics.queue_depth('articles', article_queue.qsize())
+                if self.archive is not None:
+                    self.archive.set_post_id(scraper.url, article.post_id)
+                # Content hashes are checked and recorded here, in the writer stage; fetcher threads
+                # only record 304s (in scraper.fetch) and the feeder only reads (CrawlState is locked)
+                record = None
+                if self.crawl_state is not None:
+                    record = scraper.check_crawl_state(self.crawl_state, article, headers)
+                    if record is None:
+                        continue
+                yield scraper.url, article, record
+        finally:
+            stop.set()
+            for thread in threads:
+                thread.join()
+
+    def _feed(self, entries, url_queue, stop, errors):
+        try:
+            for entry in entries:
+                if self.crawl_state is not None and self.crawl_state.is_unchanged(entry.url, entry.lastmod):
+                    continue
+                if not _put(url_queue, entry, stop):
+                    return
+        except Exception as e:
+            # Handed to run(), which raises it once the stages have drained
+            errors.append(e)
+        finally:
+            # Without these the fetchers, and so run(), would wait forever
+            for _ in range(self.fetchers):
+                _put(url_queue, _DONE, stop)
+
+    def _fetch(self, url_queue, page_queue, stop):
+        while True:
+            entry = _get(url_queue, stop)
+            if entry is _DONE:
+                break
+            scraper = ArticleScraper(entry.url, self.session, lastmod=entry.lastmod, controller=self.controller,
+                                     metrics=self.metrics)
+            response = scraper.fetch(self.crawl_state, self.archive)
+            if response is None:
+                continue
+            if not _put(page_queue, (scraper, response.headers, response.content), stop):
+                return
+        _put(page_queue, _DONE, stop)
+
+    def _dispatch(self, page_queue, article_queue, stop):
+        # Keep the pool busy without queueing more pages than it can work through
+        max_in_flight = 2 * self.parsers
+        in_flight = {}
+        fetchers_done = 0
+
+        def drain():
+            done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+            for future in done:
+                scraper, headers = in_flight.pop(future)
+                try:
+                    article, recorder = future.result()
+                except Exception as e:
+                    print(f"Error parsing article {scraper.url}: {e}")
+                    if self.metrics is not None:
+                        self.metrics.error('parse', e)
+                    continue
+                if recorder is not None:
+                    self.metrics.replay(recorder)
+                if not _put(article_queue, (scraper, headers, article), stop):
+                    return False
+            return True
+
+        while fetchers_done < self.fetchers:
+            item = _get(page_queue, stop)
+            if stop.is_set():
+                return
+            if item is _DONE:
+                fetchers_done += 1
+                continue
+            scraper, headers, content = item
+            # Only the picklable URL and bytes cross the process boundary
+            in_flight[self.parse_pool.submit(_parse_page, scraper.url, content, self.metrics is not None)] = (scraper, headers)
+            if len(in_flight) >= max_in_flight and not drain():
+                return
+
+        while in_flight:
+            if not drain():
+                return
+        _put(article_queue, _DONE, stop)
@@ -0,0 +1,109 @@
+from datetime import datetime, timedelta, timezone
+
+# The MongoDB queries behind the API endpoints. app.py runs them and indexes.py --check
+# explains them, so the query plans checked are those of the queries actually served.
+# Find queries are (filter, projection, sort, collation); aggregations are pipelines;
+# counts are filters, run with count_documents(). Search builds its own (search.search_query).
+
+# Case-insensitive comparison for author lookups; queries must pass the same collation to use the index
+AUTHOR_COLLATION = {'locale': 'ar', 'strength': 2}
+# List endpoints return pages in _id order (keyset pagination)
+PAGE_SORT = [('_id', 1)]
+
+
+def recent_articles_query():
+    return {}, None, [('published_time', -1)], None
+
+
+def titles_query(query_filter, after=None, collation=None):
+    """One page of a list endpoint: titles of the matching articles after _id `after`."""
+    if after is not None:
+        query_filter = dict(query_filter, _id={'$gt': after})
+    return query_filter, {'title': 1}, PAGE_SORT, collation
+
+
+def author_filter(author_name):
+    # Exact match, case-insensitive under AUTHOR_COLLATION
+    return {'author': author_name}
+
+
+def flag_filter(flag):
+    # has_video, has_thumbnail and updated_after_publication are computed at ingest
+    return {flag: True}
+
+
+def coverage_filter(class_id):
+    # Equality on an array field matches any element
+    return {'class_ids': class_id}
+
+
+def article_details_query(post_id):
+    # The loader stores the scraper's Article.post_id under 'post_id'; no stored article has the
+    # 'postid' field the original endpoint queried, so it always answered 404.
+    # Only the fields the response uses (not full_text).
+    return {'post_id': post_id}, {'url': 1, 'title': 1, 'keywords': 1}, None, None
+
+
+def range_filter(field, low, high, include_high=True):
+    return {field: {'$gte': low, '$lte' if include_high else '$lt': high}}
+
+
+# The date ranges below are (low, high, include_high) of published_time, in UTC: published_time
+# is stored in UTC, and the column index converts naive datetimes as UTC as well.
+
+def year_range(year):
+    return datetime(year, 1, 1, tzinfo=timezone.utc), datetime(year + 1, 1, 1, tzinfo=timezone.utc), False
+
+
+def month_range(year, month):
+    start_date = datetime(year, month, 1, tzinfo=timezone.utc)
+    next_month = month % 12 + 1
+    next_year = year + (month // 12)
+    return start_date, datetime(next_year, next_month, 1, tzinfo=timezone.utc), False
+
+
+def day_range(day):
+    """The UTC day of `day`, a date or datetime."""
+    start_date = datetime(day.year, day.month, day.day, tzinfo=timezone.utc)
+    return start_date, start_date + timedelta(days=1), False
+
+
+def longest_articles_pipeline(limit=10):
+    return [
+        {"$sort": {"word_count": -1}},  # Sort by word_count in descending order
+        {"$group": {
+            "_id": "$title",  # Group by title to ensure uniqueness
+            "word_count": {"$first": "$word_count"}  # Get the word_count of the first document in each group
+        }},
+        {"$sort": {"word_count": -1}},  # Sort again after grouping
+        {"$limit": limit},  # Limit to the top articles
+        {"$project": {"_id": 0, "title": "$_id", "word_count": 1}}  # Format the output
+    ]
+
+
+def shortest_articles_pipeline(limit=10):
+    return [
+        {"$sort": {"word_count": 1}},  # Sort by word_count in ascending order
+        {"$limit": limit},  # Limit to the top articles
+        {"$project": {"title": 1, "word_count": 1}}  # Project only title and word_count
+    ]
+
+
+def popular_keywords_pipeline(start_date, end_date):
+    return [
+        {"$match": {
+            "published_time": {"$gte": start_date, "$lte": end_date},
+            "keywords": {"$exists": True}
+        }},
+        {"$unwind": "$keywords"},
+        {"$group": {
+            "_id": "$keywords",
+            "count": {"$sum": 1}
+        }},
+        {"$sort": {"count": -1}}
+    ]
+
+
+def count_pipeline(query_filter):
+    """The aggregation count_documents() sends, for explaining a count."""
+    return [{'$match': query_filter}, {'$group': {'_id': 1, 'n': {'$sum': 1}}}]
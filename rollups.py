@@ -0,0 +1,112 @@
+import argparse
+from collections import Counter
+
+import pymongo
+from pymongo import UpdateOne
+
+from cache import bump_generation
+
+# Rollup collections are named rollup_<dimension>; each document is {_id: key, count: n}.
+# Authors, classes and keywords are keyed by their vocabulary id (see vocabulary.py).
+DIMENSIONS = ('day', 'author', 'language', 'class', 'keyword', 'word_count', 'keyword_count')
+# Fields a stored article needs for rollup_keys(); used as the projection when reading old versions
+ROLLUP_FIELDS = {'published_time': 1, 'author_id': 1, 'language': 1, 'class_ids': 1, 'keyword_ids': 1,
+                 'word_count': 1, 'keyword_count': 1}
+
+
+def rollup_collection(db, dimension):
+    return db[f'rollup_{dimension}']
+
+
+def rollup_keys(document):
+    """The (dimension, key) pairs an article counts towards."""
+    keys = []
+    published_time = document.get('published_time')
+    # Same UTC day as $dateToString would give; undated articles are not counted per day
+    if published_time is not None and hasattr(published_time, 'strftime'):
+        keys.append(('day', published_time.strftime('%Y-%m-%d')))
+    keys.append(('author', document.get('author_id')))
+    keys.append(('language', document.get('language')))
+    keys.append(('word_count', document.get('word_count')))
+    keys.append(('keyword_count', document.get('keyword_count')))
+    keys.extend(('class', class_id) for class_id in set(document.get('class_ids') or []))
+    keys.extend(('keyword', keyword_id) for keyword_id in set(document.get('keyword_ids') or []))
+    return keys
+
+
+def count_changes(deltas, new=None, old=None):
+    """Add the effect of replacing `old` with `new` (either may be None) to a Counter of deltas."""
+    if old is not None:
+        deltas.subtract(rollup_keys(old))
+    if new is not None:
+        deltas.update(rollup_keys(new))
+    return deltas
+
+
+def apply_deltas(db, deltas):
+    """$inc the rollup counters; keys whose count drops to zero are removed."""
+    operations = {}
+    shrinking = set()
+    for (dimension, key), delta in deltas.items():
+        if delta:
+            operations.setdefault(dimension, []).append(
+                UpdateOne({'_id': key}, {'$inc': {'count': delta}}, upsert=True))
+        if delta < 0:
+            shrinking.add(dimension)
+    for dimension, dimension_operations in operations.items():
+        rollup = rollup_collection(db, dimension)
+        rollup.bulk_write(dimension_operations, ordered=False)
+        if dimension in shrinking:
+            rollup.delete_many({'count': {'$lte': 0}})
+
+
+def ensure_rollup_indexes(db):
+    for dimension in DIMENSIONS:
+        rollup_collection(db, dimension).create_index([('count', pymongo.DESCENDING)], name='count')
+
+
+def ensure_rollups(collection):
+    """Create the rollup indexes, and build the rollups once for articles loaded before they existed."""
+    db = collection.database
+    if (rollup_collection(db, 'author').estimated_document_count() == 0
+            and collection.estimated_document_count() > 0):
+        rebuild_rollups(collection)
+    else:
+        ensure_rollup_indexes(db)
+
+
+def rebuild_rollups(collection):
+    """Recompute every rollup from the articles collection (after a backfill or a manual edit)."""
+    db = collection.database
+    counts = Counter()
+    for document in collection.find({}, ROLLUP_FIELDS):
+        counts.update(rollup_keys(document))
+
+    by_dimension = {dimension: [] for dimension in DIMENSIONS}
+    for (dimension, key), count in counts.items():
+        by_dimension[dimension].append({'_id': key, 'count': count})
+    for dimension, documents in by_dimension.items():
+        # Build beside the live rollup and swap it in, so endpoints never see a half-built one
+        staging = db[f'rollup_{dimension}_rebuild']
+        staging.drop()
+        if documents:
+            staging.insert_many(documents, ordered=False)
+            staging.rename(rollup_collection(db, dimension).name, dropTarget=True)
+        else:
+            rollup_collection(db, dimension).delete_many({})
+    ensure_rollup_indexes(db)
+    bump_generation(db)
+    print(f"Rebuilt rollups: {', '.join(f'{d} ({len(docs)} keys)' for d, docs in by_dimension.items())}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Rebuild the rollup collections from the articles collection.')
+    parser.add_argument('--mongo-uri', default="mongodb://localhost:27017/")
+    args = parser.parse_args()
+
+    collection = pymongo.MongoClient(args.mongo_uri)["almayadeen"]["articles"]
+    rebuild_rollups(collection)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,127 @@
+import re
+
+from pymongo import IndexModel, UpdateOne
+
+from cache import bump_generation
+
+# Harakat, superscript alef and tatweel carry no meaning for matching
+_DIACRITICS = re.compile('[\u0610-\u061a\u064b-\u065f\u0670\u06d6-\u06ed\u0640]')
+# Letter variants folded to one form, as readers type them interchangeably
+_LETTER_VARIANTS = str.maketrans({
+    '\u0623': '\u0627', '\u0625': '\u0627', '\u0622': '\u0627', '\u0671': '\u0627',  # أ إ آ ٱ -> ا
+    '\u0624': '\u0648',  # ؤ -> و
+    '\u0626': '\u064a', '\u0649': '\u064a',  # ئ ى -> ي
+    '\u0629': '\u0647',  # ة -> ه
+})
+
+# The definite article, alone or after و/ف/ب/ك, and لل (ل + ال), at the start of a word. MongoDB's
+# text index has no Arabic stemmer and matches whole tokens only, so these are removed from the
+# indexed text and from queries alike ("حكومة" finds "الحكومة" and "للحكومة"). At least three
+# letters must remain, which keeps short words such as الله intact.
+_ARTICLE_PREFIX = re.compile(r'\b(?:[\u0648\u0641\u0628\u0643]?\u0627\u0644|[\u0648\u0641]?\u0644\u0644)(?=\w{3})')
+# Characters of the article body indexed; the title, keywords and description are indexed whole
+SEARCH_BODY_CHARS = 1000
+# Stored under search.version; documents normalized with an older search_fields() are
+# refolded by ensure_search() on the next load
+SEARCH_VERSION = 2
+# Document in `meta` recording the SEARCH_VERSION every stored article has been folded with
+SEARCH_VERSION_ID = 'search_version'
+# Article fields search_fields() reads; the projection of the backfill
+SEARCH_SOURCE_FIELDS = {'title': 1, 'keywords': 1, 'description': 1, 'full_text': 1}
+# Batch size of the backfill over existing articles
+BACKFILL_BATCH_SIZE = 1000
+
+# Relative weight of each searchable field in the relevance score
+SEARCH_WEIGHTS = {'search.title': 10, 'search.keywords': 5, 'search.description': 3, 'search.body': 1}
+
+# MongoDB has no Arabic stemmer; 'none' keeps the text index from stemming or dropping stop words.
+# language_override points at a field articles never have, because their own `language`
+# field ("ar") is not a language the text index accepts.
+SEARCH_INDEX = IndexModel([(field, 'text') for field in SEARCH_WEIGHTS], name='search_text',
+                          weights=SEARCH_WEIGHTS, default_language='none',
+                          language_override='search_language')
+
+
+def normalize_arabic(text):
+    """Fold diacritics, alef/hamza variants, alef maqsura and taa marbuta; lowercase Latin text."""
+    if not text:
+        return ''
+    return _DIACRITICS.sub('', str(text)).translate(_LETTER_VARIANTS).casefold()
+
+
+def strip_diacritics(text):
+    """Remove harakat, superscript alef and tatweel, leaving every letter as written."""
+    return _DIACRITICS.sub('', str(text))
+
+
+def search_text(text):
+    """normalize_arabic() with the article prefixes taken off every word: the form indexed and searched."""
+    return _ARTICLE_PREFIX.sub('', normalize_arabic(text))
+
+
+def _lead(text, limit=SEARCH_BODY_CHARS):
+    """The start of `text`, cut at the last space before `limit` characters."""
+    text = text or ''
+    if len(text) <= limit:
+        return text
+    cut = text.rfind(' ', 0, limit)
+    return text[:cut if cut > 0 else limit]
+
+
+def search_fields(document):
+    """Folded copies of the searchable fields, stored under `search` at ingest.
+
+    Only the lead of the body is kept, so the full text is not stored a second time.
+    """
+    return {
+        'title': search_text(document.get('title')),
+        'keywords': [search_text(keyword) for keyword in document.get('keywords') or []],
+        'description': search_text(document.get('description')),
+        'body': search_text(_lead(document.get('full_text'))),
+        'version': SEARCH_VERSION,
+    }
+
+
+def ensure_search(collection, batch_size=BACKFILL_BATCH_SIZE):
+    """Refold the search fields of articles stored under an older SEARCH_VERSION; returns how many changed.
+
+    Runs once per version (recorded in `meta`), so queries folded the current way
+    match every article, not only those loaded since.
+    """
+    db = collection.database
+    stored_version = db['meta'].find_one({'_id': SEARCH_VERSION_ID})
+    if (stored_version or {}).get('value') == SEARCH_VERSION:
+        return 0
+    updated, operations = 0, []
+    for document in collection.find({'search.version': {'$ne': SEARCH_VERSION}}, SEARCH_SOURCE_FIELDS):
+        operations.append(UpdateOne({'_id': document['_id']}, {'$set': {'search': search_fields(document)}}))
+        if len(operations) >= batch_size:
+            updated += collection.bulk_write(operations, ordered=False).modified_count
+            operations = []
+    if operations:
+        updated += collection.bulk_write(operations, ordered=False).modified_count
+    if updated:
+        bump_generation(db)
+        print(f"Refolded the search fields of {updated} articles")
+    # Recorded last, so an interrupted backfill starts over on the next run
+    db['meta'].update_one({'_id': SEARCH_VERSION_ID}, {'$set': {'value': SEARCH_VERSION}}, upsert=True)
+    return updated
+
+
+def search_query(query, projection=None):
+    """Find query (filter, projection, sort, collation) of a full-text search, best matches first."""
+    fields = dict(projection or {'title': 1, 'url': 1, 'post_id': 1})
+    fields['score'] = {'$meta': 'textScore'}
+    return {'$text': {'$search': search_text(query)}}, fields, [('score', {'$meta': 'textScore'})], None
+
+
+def search_articles(collection, query, limit=20, skip=0, projection=None):
+    """Articles matching `query`, best first, with their relevance under `score`.
+
+    The query goes through the same folding as the indexed text, so "مدرسة"
+    finds "مدرسه", "إعلان" finds "اعلان" and "حكومة" finds "الحكومة". MongoDB
+    text syntax ("exact phrase", -excluded) still applies. The body is matched
+    on its first SEARCH_BODY_CHARS characters only.
+    """
+    query_filter, fields, sort, _ = search_query(query, projection)
+    return list(collection.find(query_filter, fields).sort(sort).skip(skip).limit(limit))
@@ -0,0 +1,354 @@
+import argparse
+import hashlib
+import math
+import threading
+from datetime import datetime, timedelta, timezone
+
+import pymongo
+from pymongo import ReplaceOne
+
+try:
+    import numpy as np
+except ImportError:
+    # Sketches are optional: without NumPy the loader skips them and ?approx=1 answers are unavailable
+    np = None
+
+# Count-Min: estimates overshoot by at most e/width of the total count, with probability 1 - e^-depth
+CMS_WIDTH = 2048
+CMS_DEPTH = 4
+# Largest k a top-k query may ask for
+HEAVY_HITTERS = 200
+# HyperLogLog with 2^12 registers: about 1.6% standard error
+HLL_PRECISION = 12
+# Sketch documents: one per UTC publication day ("day:YYYY-MM-DD") plus one for the whole archive ("all")
+SKETCHES_COLLECTION = 'sketches'
+ALL_TIME = 'all'
+# Bumped when what the sketches count changes; stored sketches of another version are rebuilt.
+# Version 2 counts vocabulary ids (see vocabulary.py), like the rollups, instead of raw strings;
+# version 3 hashes the ids arithmetically and stores no heavy-hitter lists.
+SKETCH_VERSION = 3
+# Article fields the sketches read; used as the projection when rebuilding
+SKETCH_FIELDS = {'published_time': 1, 'keyword_ids': 1, 'class_ids': 1, 'author_id': 1}
+# Count-Min row r puts id x in column ((a_r * x + b_r) mod p) mod width; ids must be below 2^32
+_CMS_PRIME = (1 << 31) - 1
+
+
+def available():
+    """Whether the sketches can be used (NumPy is installed)."""
+    return np is not None
+
+
+def _require_numpy():
+    if np is None:
+        raise RuntimeError("the sketches need the 'numpy' package")
+
+
+def _row_coefficients(depth):
+    """(a, b) per Count-Min row, derived from fixed seeds so every process hashes ids alike."""
+    pairs = []
+    for row in range(depth):
+        digest = hashlib.blake2b(f'cms-row-{row}'.encode('utf-8'), digest_size=8).digest()
+        a = int.from_bytes(digest[:4], 'little') % (_CMS_PRIME - 1) + 1
+        b = int.from_bytes(digest[4:], 'little') % _CMS_PRIME
+        pairs.append((a, b))
+    return np.array([a for a, _ in pairs], dtype=np.uint64), np.array([b for _, b in pairs], dtype=np.uint64)
+
+
+def _ids(keys):
+    return np.atleast_1d(np.asarray(keys, dtype=np.uint64))
+
+
+def _mix64(values):
+    """splitmix64 finalizer over an array of uint64: a well-spread 64-bit hash of each id."""
+    x = values + np.uint64(0x9E3779B97F4A7C15)
+    x = (x ^ (x >> np.uint64(30))) * np.uint64(0xBF58476D1CE4E5B9)
+    x = (x ^ (x >> np.uint64(27))) * np.uint64(0x94D049BB133111EB)
+    return x ^ (x >> np.uint64(31))
+
+
+class CountMinSketch:
+    """Frequency estimates for integer keys (vocabulary ids) in fixed memory.
+
+    Counts are a depth x width NumPy array, so merging sketches is one vectorized
+    add and the top keys are found by estimating every candidate id at once.
+    """
+
+    def __init__(self, width=CMS_WIDTH, depth=CMS_DEPTH, counts=None, total=0):
+        self.width = width
+        self.depth = depth
+        self.counts = counts if counts is not None else np.zeros((depth, width), dtype=np.int32)
+        self.total = total
+        self._a, self._b = _row_coefficients(depth)
+
+    def _cells(self, keys):
+        """(len(keys), depth) array of the column each key maps to in each row."""
+        return (((self._a * _ids(keys).reshape(-1, 1) + self._b) % np.uint64(_CMS_PRIME))
+                % np.uint64(self.width)).astype(np.intp)
+
+    def add(self, keys, count=1):
+        """Add `count` (which may be negative) to each key of `keys`, an id or a sequence of ids."""
+        cells = self._cells(keys)
+        if len(cells):
+            np.add.at(self.counts, (np.arange(self.depth), cells), count)
+            self.total += count * len(cells)
+
+    def estimates(self, keys):
+        return np.maximum(self.counts[np.arange(self.depth), self._cells(keys)].min(axis=1), 0)
+
+    def estimate(self, key):
+        return int(self.estimates(key)[0])
+
+    def merge(self, other):
+        self.counts += other.counts
+        self.total += other.total
+        return self
+
+    def top(self, k, candidates):
+        """The k candidate ids with the highest estimates, as [(id, estimate)]; ids estimated at 0 are left out.
+
+        `candidates` should hold every key that may have been counted (for vocabulary ids,
+        all ids of the kind), so keys that are only heavy across several days are found.
+        """
+        candidates = _ids(candidates)
+        if not len(candidates):
+            return []
+        estimates = self.estimates(candidates)
+        if len(candidates) > k:
+            chosen = np.argpartition(-estimates, k - 1)[:k]
+            candidates, estimates = candidates[chosen], estimates[chosen]
+        ranked = sorted(zip(candidates.tolist(), estimates.tolist()), key=lambda item: (-item[1], item[0]))
+        return [(key, count) for key, count in ranked if count > 0]
+
+    def error_bound(self):
+        return {'max_overcount': math.ceil(math.e / self.width * self.total),
+                'probability': round(1 - math.exp(-self.depth), 4)}
+
+    def to_document(self):
+        return {'width': self.width, 'depth': self.depth, 'total': self.total,
+                'counts': self.counts.astype('<i4').tobytes()}
+
+    @classmethod
+    def from_document(cls, document):
+        counts = np.frombuffer(document['counts'], dtype='<i4').astype(np.int32)
+        return cls(document['width'], document['depth'],
+                   counts.reshape(document['depth'], document['width']), document['total'])
+
+
+class HyperLogLog:
+    """Distinct-count estimate of integer keys in 2^precision bytes."""
+
+    def __init__(self, precision=HLL_PRECISION, registers=None):
+        self.precision = precision
+        self.registers = registers if registers is not None else np.zeros(1 << precision, dtype=np.uint8)
+
+    def add(self, values):
+        """Add an id or a sequence of ids."""
+        x = _mix64(_ids(values))
+        if not len(x):
+            return
+        shift = np.uint64(64 - self.precision)
+        index = (x >> shift).astype(np.intp)
+        rest = x & np.uint64((1 << (64 - self.precision)) - 1)
+        # Position of the leftmost 1 bit of `rest`; rest < 2^52 converts to float exactly
+        rank = (64 - self.precision) - np.frexp(rest.astype(np.float64))[1] + 1
+        np.maximum.at(self.registers, index, rank.astype(np.uint8))
+
+    def merge(self, other):
+        np.maximum(self.registers, other.registers, out=self.registers)
+        return self
+
+    def count(self):
+        m = len(self.registers)
+        alpha = 0.7213 / (1 + 1.079 / m)
+        estimate = alpha * m * m / float(np.exp2(-self.registers.astype(np.float64)).sum())
+        zeros = int(np.count_nonzero(self.registers == 0))
+        if estimate <= 2.5 * m and zeros:
+            # Linear counting is more accurate while many registers are still empty
+            estimate = m * math.log(m / zeros)
+        return round(estimate)
+
+    def relative_error(self):
+        return round(1.04 / math.sqrt(len(self.registers)), 4)
+
+    def to_bytes(self):
+        return self.registers.tobytes()
+
+    @classmethod
+    def from_bytes(cls, registers):
+        registers = np.frombuffer(registers, dtype=np.uint8).copy()
+        return cls(int(math.log2(len(registers))), registers)
+
+
+class ArticleSketches:
+    """The sketches kept per day: keyword and class frequencies, distinct authors and keywords.
+
+    Keywords, classes and authors are counted by vocabulary id, so spellings the
+    vocabulary folds together count as one key, as they do in the rollups.
+    """
+
+    def __init__(self, keywords=None, classes=None, authors=None, distinct_keywords=None, articles=0):
+        self.keywords = keywords or CountMinSketch()
+        self.classes = classes or CountMinSketch()
+        self.authors = authors or HyperLogLog()
+        self.distinct_keywords = distinct_keywords or HyperLogLog()
+        self.articles = articles
+
+    def add(self, document, old=None):
+        """Count a new article, or the keyword/class changes of an updated one.
+
+        Count-Min counts can be decremented, so replaced keywords are taken back out;
+        HyperLogLog can't forget, so distinct counts may include values since removed.
+        """
+        old_keywords = set(old.get('keyword_ids') or []) if old else set()
+        old_classes = set(old.get('class_ids') or []) if old else set()
+        new_keywords = set(document.get('keyword_ids') or [])
+        new_classes = set(document.get('class_ids') or [])
+        added_keywords = list(new_keywords - old_keywords)
+        self.keywords.add(added_keywords)
+        self.distinct_keywords.add(added_keywords)
+        self.keywords.add(list(old_keywords - new_keywords), -1)
+        self.classes.add(list(new_classes - old_classes))
+        self.classes.add(list(old_classes - new_classes), -1)
+        if document.get('author_id') is not None:
+            self.authors.add(document['author_id'])
+        if old is None:
+            self.articles += 1
+
+    def remove(self, old):
+        """Take an article back out, e.g. when an update moved it to another day."""
+        self.add({}, old)
+        self.articles -= 1
+
+    def merge(self, other):
+        self.keywords.merge(other.keywords)
+        self.classes.merge(other.classes)
+        self.authors.merge(other.authors)
+        self.distinct_keywords.merge(other.distinct_keywords)
+        self.articles += other.articles
+        return self
+
+    def to_document(self):
+        return {
+            'keywords': self.keywords.to_document(),
+            'classes': self.classes.to_document(),
+            'authors': self.authors.to_bytes(),
+            'distinct_keywords': self.distinct_keywords.to_bytes(),
+            'articles': self.articles,
+            'version': SKETCH_VERSION,
+        }
+
+    @classmethod
+    def from_document(cls, document):
+        return cls(CountMinSketch.from_document(document['keywords']),
+                   CountMinSketch.from_document(document['classes']),
+                   HyperLogLog.from_bytes(document['authors']),
+                   HyperLogLog.from_bytes(document['distinct_keywords']),
+                   document['articles'])
+
+
+def _day_id(day):
+    return f'day:{day:%Y-%m-%d}'
+
+
+def _day_of(document):
+    published_time = document.get('published_time')
+    return _day_id(published_time) if isinstance(published_time, datetime) else None
+
+
+class SketchStore:
+    """Accumulates sketch updates during a load and merges them into the stored sketches.
+
+    Loader threads call add() per written article; flush() then merges each touched
+    day (and the all-time sketch) into its stored document. Sketches are additive,
+    so flushing deltas is equivalent to rebuilding, as long as one loader runs at a time.
+    """
+
+    def __init__(self, db):
+        self.collection = db[SKETCHES_COLLECTION]
+        self._pending = {}
+        self._lock = threading.Lock()
+
+    def add(self, document, old=None):
+        if np is None:
+            return
+        new_day, old_day = _day_of(document), _day_of(old) if old else None
+        with self._lock:
+            self._sketches(ALL_TIME).add(document, old)
+            if old is not None and old_day != new_day:
+                # The update moved the article to another day: count it there as new
+                if old_day:
+                    self._sketches(old_day).remove(old)
+                old = None
+            if new_day:
+                self._sketches(new_day).add(document, old)
+
+    def _sketches(self, key):
+        return self._pending.setdefault(key, ArticleSketches())
+
+    def flush(self):
+        with self._lock:
+            pending, self._pending = self._pending, {}
+        if not pending:
+            return 0
+        stored = {document['_id']: document for document in self.collection.find({'_id': {'$in': list(pending)}})}
+        operations = []
+        for key, delta in pending.items():
+            sketches = ArticleSketches.from_document(stored[key]) if key in stored else ArticleSketches()
+            operations.append(ReplaceOne({'_id': key}, dict(sketches.merge(delta).to_document(), _id=key),
+                                         upsert=True))
+        self.collection.bulk_write(operations, ordered=False)
+        return len(operations)
+
+
+def load_sketches(db, days=None):
+    """Merged sketches for the last `days` days (UTC, including today), or for the whole archive.
+
+    Each day merges in a few vectorized array operations. Sketches of another
+    SKETCH_VERSION (not yet rebuilt by the loader) are left out.
+    """
+    _require_numpy()
+    collection = db[SKETCHES_COLLECTION]
+    if days is None:
+        document = collection.find_one({'_id': ALL_TIME, 'version': SKETCH_VERSION})
+        return ArticleSketches.from_document(document) if document else ArticleSketches()
+
+    today = datetime.now(timezone.utc).date()
+    keys = [_day_id(today - timedelta(days=offset)) for offset in range(days + 1)]
+    merged = ArticleSketches()
+    for document in collection.find({'_id': {'$in': keys}, 'version': SKETCH_VERSION}):
+        merged.merge(ArticleSketches.from_document(document))
+    return merged
+
+
+def rebuild_sketches(collection):
+    """Recompute every stored sketch from the articles collection."""
+    if np is None:
+        print("Skipping the sketches: they need the 'numpy' package")
+        return
+    store = SketchStore(collection.database)
+    for document in collection.find({}, SKETCH_FIELDS):
+        store.add(document)
+    store.collection.delete_many({})
+    written = store.flush()
+    print(f"Rebuilt {written} sketch documents")
+
+
+def ensure_sketches(collection):
+    """Build the sketches for articles loaded before they existed, or counted by an older SKETCH_VERSION."""
+    db = collection.database
+    stored = db[SKETCHES_COLLECTION].find_one({'_id': ALL_TIME}, {'version': 1})
+    if (stored is None or stored.get('version') != SKETCH_VERSION) and collection.estimated_document_count() > 0:
+        rebuild_sketches(collection)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Rebuild the per-day keyword/author sketches.')
+    parser.add_argument('--mongo-uri', default="mongodb://localhost:27017/")
+    args = parser.parse_args()
+
+    collection = pymongo.MongoClient(args.mongo_uri)["almayadeen"]["articles"]
+    rebuild_sketches(collection)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,27 @@
+import inspect
+import os
+import sys
+
+import mongomock
+import pytest
+from mongomock.collection import BulkOperationBuilder
+
+# The modules live at the repository root
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+def _ignore_sort(add):
+    def add_without_sort(self, *args, sort=None, **kwargs):
+        return add(self, *args, **kwargs)
+    return add_without_sort
+
+
+# pymongo >= 4.9 passes sort= to bulk updates, which mongomock does not accept yet
+for name in ('add_update', 'add_replace'):
+    if 'sort' not in inspect.signature(getattr(BulkOperationBuilder, name)).parameters:
+        setattr(BulkOperationBuilder, name, _ignore_sort(getattr(BulkOperationBuilder, name)))
+
+
+@pytest.fixture
+def db():
+    return mongomock.MongoClient()['almayadeen']
@@ -0,0 +1,40 @@
+from datetime import datetime, timezone
+
+import pytest
+
+pytest.importorskip('numpy')
+
+from cache import bump_generation, read_generation
+from column_index import ColumnIndex, ColumnIndexUpdates, build_index
+
+
+def article(day, word_count):
+    return {'published_time': datetime(2024, 2, day, tzinfo=timezone.utc), 'word_count': word_count,
+            'keyword_count': 2}
+
+
+def test_index_is_only_current_after_a_finished_load(db, tmp_path):
+    db['articles'].insert_many([article(day, 100 * day) for day in range(1, 6)])
+    build_index(db['articles'], str(tmp_path))
+    index = ColumnIndex(str(tmp_path), check_interval=0)
+    assert index.current(read_generation(db)) and index.count('word_count', 200, 400) == 3
+
+    updates = ColumnIndexUpdates(db, str(tmp_path))
+    assert not index.current(read_generation(db))
+    updates.add(article(6, 300), old=article(5, 500))
+    bump_generation(db)
+    updates.flush()
+    assert index.current(read_generation(db))
+    assert index.count('word_count', 200, 400) == 4 and index.count('word_count', 500) == 0
+    assert index.count('published_time', datetime(2024, 2, 5, tzinfo=timezone.utc)) == 1
+
+
+def test_interrupted_load_leaves_the_index_stale(db, tmp_path):
+    db['articles'].insert_one(article(1, 100))
+    build_index(db['articles'], str(tmp_path))
+    ColumnIndexUpdates(db, str(tmp_path))
+    # The next load can't tell what the interrupted one changed
+    updates = ColumnIndexUpdates(db, str(tmp_path))
+    bump_generation(db)
+    updates.flush()
+    assert not ColumnIndex(str(tmp_path), check_interval=0).current(read_generation(db))
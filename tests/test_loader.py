@@ -0,0 +1,37 @@
+import copy
+
+from Data_storage import load_documents
+from rollups import rebuild_rollups, rollup_collection
+from vocabulary import Vocabulary
+
+
+def scraped(number, title=None):
+    return {'url': f'https://example.com/{number}', 'post_id': str(number), 'title': title or f'مقال {number}',
+            'keywords': ['لبنان', f'وسم {number % 3}'], 'thumbnail': '', 'publication_date': '2024-05-02T10:00:00Z',
+            'last_updated': '2024-05-02T11:00:00Z', 'author': 'الميادين', 'full_text': 'نص', 'video_duration': '',
+            'language': 'ar', 'word_count': '120', 'description': '', 'classes': ['أخبار']}
+
+
+def load(db, documents):
+    return load_documents(db['articles'], copy.deepcopy(documents), batch_size=4, vocabulary=Vocabulary(db))
+
+
+def test_reloading_unchanged_articles_writes_nothing(db):
+    documents = [scraped(number) for number in range(10)]
+    stats, failed = load(db, documents)
+    assert (stats['inserted'], failed) == (10, [])
+    stats, _ = load(db, documents)
+    assert (stats['inserted'], stats['updated'], stats['unchanged']) == (0, 0, 10)
+
+    documents[3] = scraped(3, title='عنوان جديد')
+    stats, _ = load(db, documents)
+    assert (stats['updated'], stats['unchanged']) == (1, 9)
+    keyword = {document['_id']: document['count'] for document in rollup_collection(db, 'keyword').find()}
+    rebuild_rollups(db['articles'])
+    assert {document['_id']: document['count'] for document in rollup_collection(db, 'keyword').find()} == keyword
+
+
+def test_only_the_last_version_in_a_batch_is_written(db):
+    stats, _ = load(db, [scraped(1), scraped(1, title='أحدث')])
+    assert (stats['inserted'], stats['superseded']) == (1, 1)
+    assert db['articles'].find_one({'post_id': '1'})['title'] == 'أحدث'
@@ -0,0 +1,45 @@
+import gzip
+
+import pytest
+
+from Task1 import NDJSON_SUFFIXES, NDJSONWriter, iter_ndjson, zstandard
+
+ARTICLES = [{'post_id': str(number), 'title': f'مقال {number}'} for number in range(20)]
+COMPRESSIONS = [None, 'gzip', pytest.param('zstd', marks=pytest.mark.skipif(zstandard is None,
+                                                                             reason="needs 'zstandard'"))]
+
+
+def write(path, compression, articles):
+    with NDJSONWriter(str(path), compression=compression, flush_every=5) as writer:
+        for article in articles:
+            writer.write(article)
+
+
+@pytest.mark.parametrize('compression', COMPRESSIONS)
+def test_reopened_file_appends_a_readable_member(tmp_path, compression):
+    path = tmp_path / f'articles_2024_1.ndjson{NDJSON_SUFFIXES[compression]}'
+    write(path, compression, ARTICLES[:10])
+    write(path, compression, ARTICLES[10:])
+    assert list(iter_ndjson(str(path))) == ARTICLES
+
+
+@pytest.mark.parametrize('compression', COMPRESSIONS)
+def test_truncated_tail_is_repaired_before_appending(tmp_path, compression):
+    path = tmp_path / f'articles_2024_1.ndjson{NDJSON_SUFFIXES[compression]}'
+    write(path, compression, ARTICLES[:10])
+    data = path.read_bytes()
+    # A crash mid-write: the last line (or compressed member) is cut short
+    path.write_bytes(data[:len(data) * 3 // 4])
+    readable = list(iter_ndjson(str(path)))
+    assert readable == ARTICLES[:len(readable)] and len(readable) < 10
+
+    write(path, compression, ARTICLES[10:])
+    assert list(iter_ndjson(str(path))) == readable + ARTICLES[10:]
+
+
+def test_truncated_member_keeps_complete_members(tmp_path):
+    path = tmp_path / 'articles_2024_1.ndjson.gz'
+    path.write_bytes(gzip.compress(b'{"post_id":"1"}\n') + gzip.compress(b'{"post_id":"2"}\n{"post_id":"3"}\n')[:-10])
+    assert list(iter_ndjson(str(path)))[0] == {'post_id': '1'}
+    write(path, 'gzip', [{'post_id': '4'}])
+    assert [article['post_id'] for article in iter_ndjson(str(path))][-1] == '4'
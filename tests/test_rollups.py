@@ -0,0 +1,40 @@
+from collections import Counter
+from datetime import datetime, timezone
+
+from rollups import DIMENSIONS, apply_deltas, count_changes, rebuild_rollups, rollup_collection
+
+
+def article(number, day, keyword_ids, author_id=1):
+    return {'_id': number, 'published_time': datetime(2024, 3, day, 8, tzinfo=timezone.utc),
+            'author_id': author_id, 'language': 'ar', 'class_ids': [number % 2], 'keyword_ids': keyword_ids,
+            'word_count': 100 + number, 'keyword_count': len(keyword_ids)}
+
+
+def rollups(db):
+    return {dimension: {document['_id']: document['count'] for document in rollup_collection(db, dimension).find()}
+            for dimension in DIMENSIONS}
+
+
+def test_incremental_deltas_match_a_rebuild(db):
+    articles = db['articles']
+    deltas = Counter()
+    for number in range(10):
+        document = article(number, 1 + number % 3, [number, number + 1, number + 1])
+        articles.insert_one(document)
+        count_changes(deltas, new=document)
+    apply_deltas(db, deltas)
+
+    deltas = Counter()
+    old = articles.find_one({'_id': 4})
+    new = article(4, 9, [50], author_id=2)
+    articles.replace_one({'_id': 4}, new)
+    count_changes(deltas, new=new, old=old)
+    count_changes(deltas, old=articles.find_one_and_delete({'_id': 0}))
+    apply_deltas(db, deltas)
+
+    incremental = rollups(db)
+    # Repeated keywords count once per article; keys no article has left are removed
+    assert incremental['keyword'][2] == 2 and 0 not in incremental['keyword']
+    assert all(count > 0 for counts in incremental.values() for count in counts.values())
+    rebuild_rollups(articles)
+    assert rollups(db) == incremental
@@ -0,0 +1,97 @@
+import random
+from collections import Counter
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+np = pytest.importorskip('numpy')
+
+from sketches import (ALL_TIME, ArticleSketches, CountMinSketch, HyperLogLog, SketchStore, SKETCHES_COLLECTION,
+                      rebuild_sketches)
+
+
+def test_count_min_never_undercounts_and_merges_like_one_stream():
+    rng = random.Random(7)
+    keys = [int(rng.paretovariate(1.2)) for _ in range(20000)]
+    whole, halves = CountMinSketch(), [CountMinSketch(), CountMinSketch()]
+    for index, key in enumerate(keys):
+        whole.add(key)
+        halves[index % 2].add([key])
+    merged = halves[0].merge(halves[1])
+    assert np.array_equal(merged.counts, whole.counts) and merged.total == whole.total
+    for key, count in Counter(keys).items():
+        assert count <= whole.estimate(key) <= count + whole.error_bound()['max_overcount']
+
+
+def test_count_min_decrements():
+    sketch = CountMinSketch()
+    sketch.add([1, 2, 2])
+    sketch.add([2], -1)
+    assert (sketch.estimate(1), sketch.estimate(2), sketch.total) == (1, 1, 2)
+
+
+def test_top_finds_keys_heavy_only_across_days():
+    merged = CountMinSketch()
+    for day in range(30):
+        sketch = CountMinSketch()
+        # Every day has its own leader; key 7 is never first on a day but leads the month
+        sketch.add([1000 + day] * 10 + [7] * 5 + list(range(2000, 2100)))
+        merged.merge(sketch)
+    top = merged.top(3, range(3000))
+    assert top[0][0] == 7 and top[0][1] >= 150
+    assert CountMinSketch().top(3, range(10)) == []
+
+
+def test_hyperloglog_estimates_and_unions():
+    first, second = HyperLogLog(), HyperLogLog()
+    first.add(range(20000))
+    second.add(range(10000, 30000))
+    error = 3 * first.relative_error()
+    assert abs(first.count() - 20000) <= error * 20000
+    assert abs(first.merge(second).count() - 30000) <= error * 30000
+    small = HyperLogLog()
+    small.add([5, 5, 6])
+    assert small.count() == 2
+
+
+def test_sketches_round_trip_through_documents():
+    sketches = ArticleSketches()
+    sketches.add({'keyword_ids': [1, 2], 'class_ids': [3], 'author_id': 4})
+    copy = ArticleSketches.from_document(sketches.to_document())
+    assert np.array_equal(copy.keywords.counts, sketches.keywords.counts)
+    assert np.array_equal(copy.authors.registers, sketches.authors.registers)
+    assert (copy.articles, copy.keywords.total) == (1, 2)
+
+
+def article(number, day, keyword_ids):
+    return {'_id': number, 'published_time': datetime(2024, 1, 1, 12, tzinfo=timezone.utc) + timedelta(days=day),
+            'keyword_ids': keyword_ids, 'class_ids': [number % 3], 'author_id': number % 5}
+
+
+def stored_counts(db):
+    documents = db[SKETCHES_COLLECTION].find()
+    return {document['_id']: (document['keywords']['counts'], document['classes']['counts'], document['articles'])
+            for document in documents}
+
+
+def test_flushed_deltas_match_a_rebuild(db):
+    articles = db['articles']
+    store = SketchStore(db)
+    for number in range(40):
+        document = article(number, number % 4, [number % 7, 100 + number % 11])
+        articles.insert_one(document)
+        store.add(document)
+    store.flush()
+    # Updates that change keywords, and one that moves an article to another day
+    for number, day, keyword_ids in [(1, 1, [1, 200]), (2, 6, [2]), (3, 3, [])]:
+        old = articles.find_one({'_id': number})
+        new = article(number, day, keyword_ids)
+        articles.replace_one({'_id': number}, new)
+        store.add(new, old)
+    store.flush()
+    incremental = stored_counts(db)
+    assert ALL_TIME in incremental and 'day:2024-01-07' in incremental
+
+    rebuild_sketches(articles)
+    rebuilt = stored_counts(db)
+    assert incremental == rebuilt
@@ -0,0 +1,37 @@
+from datetime import datetime, timedelta, timezone
+
+from trending import TrendingEngine
+
+NOW = datetime(2024, 6, 10, 12, 30, tzinfo=timezone.utc)
+
+
+def test_updates_replace_an_articles_counts():
+    engine = TrendingEngine(hours=48)
+    engine.add(1, NOW, ['لبنان', 'غزة', 'لبنان'], now=NOW)
+    engine.add(2, NOW - timedelta(hours=3), ['لبنان'], now=NOW)
+    assert engine.window(24, now=NOW) == [('لبنان', 2), ('غزة', 1)]
+    engine.add(1, NOW, ['غزة'], now=NOW)
+    engine.remove(2, now=NOW)
+    assert engine.window(24, now=NOW) == [('غزة', 1)]
+
+
+def test_hours_leaving_the_window_are_forgotten():
+    engine = TrendingEngine(hours=48)
+    engine.add(1, NOW - timedelta(hours=30), ['اليمن'], now=NOW)
+    engine.add(2, NOW - timedelta(hours=60), ['قديم'], now=NOW)
+    assert engine.window(24, offset=24, now=NOW) == [('اليمن', 1)]
+    later = NOW + timedelta(hours=20)
+    # Article 1's hour has left the 48 hours kept
+    engine.add(3, later, ['جديد'], now=later)
+    assert engine.window(24, now=later) == [('جديد', 1)]
+    assert engine.window(24, offset=24, now=later) == []
+    engine.remove(1, now=later)
+    assert engine.window(24, now=later) == [('جديد', 1)]
+
+
+def test_bad_published_times_and_keywords_are_skipped():
+    engine = TrendingEngine(hours=48)
+    engine.add(1, '2024-06-10', ['لبنان'], now=NOW)
+    engine.add(2, NOW, 'لبنان', now=NOW)
+    engine.add(3, NOW, ['لبنان', None, 5], now=NOW)
+    assert engine.window(48, now=NOW) == [('لبنان', 1)]
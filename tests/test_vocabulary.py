@@ -0,0 +1,60 @@
+import pytest
+from pymongo.errors import BulkWriteError
+
+from cache import bump_generation, read_generation
+from vocabulary import Vocabulary, ensure_vocabulary_indexes
+
+
+def encode(vocabulary, **fields):
+    document = dict({'author': None, 'keywords': [], 'classes': []}, **fields)
+    return vocabulary.encode_batch([document])[0]
+
+
+def test_spelling_variants_share_one_id(db):
+    vocabulary = Vocabulary(db)
+    document = encode(vocabulary, keywords=['أمن', ' امن ', 'Gaza', 'gaza'], classes=['أخبار'])
+    assert len(document['keyword_ids']) == 2
+    # Ids are unique across kinds and stay stable for a new reader
+    assert not set(document['keyword_ids']) & set(document['class_ids'])
+    assert encode(Vocabulary(db), keywords=['إمن'])['keyword_ids'] == document['keyword_ids'][:1]
+
+
+def test_preferred_spelling_is_displayed(db):
+    vocabulary = Vocabulary(db)
+    first = encode(vocabulary, author='john smith')['author_id']
+    assert encode(vocabulary, author='John Smith')['author_id'] == first
+    assert Vocabulary(db).values([first]) == {first: 'John Smith'}
+
+
+def test_lost_race_reuses_the_winners_ids(db, monkeypatch):
+    ensure_vocabulary_indexes(db)
+    winner, loser = Vocabulary(db), Vocabulary(db)
+    find = loser.collection.find
+    stale = iter([True])
+    # The loser looks up its values just before the winner stores them
+    monkeypatch.setattr(loser.collection, 'find',
+                        lambda *args, **kwargs: iter([]) if next(stale, False) else find(*args, **kwargs))
+    expected = encode(winner, keywords=['لبنان', 'سوريا'])['keyword_ids']
+    assert encode(loser, keywords=['لبنان', 'سوريا'])['keyword_ids'] == expected
+
+
+def test_other_write_errors_are_raised(db, monkeypatch):
+    vocabulary = Vocabulary(db)
+
+    def insert_many(*args, **kwargs):
+        raise BulkWriteError({'writeErrors': [{'index': 0, 'code': 121, 'errmsg': 'validation failed'}]})
+    monkeypatch.setattr(vocabulary.collection, 'insert_many', insert_many)
+    with pytest.raises(BulkWriteError):
+        encode(vocabulary, keywords=['لبنان'])
+
+
+def test_id_of_refreshes_when_the_generation_changes(db):
+    reader = Vocabulary(db)
+    first = encode(Vocabulary(db), keywords=['لبنان'])['keyword_ids'][0]
+    assert reader.id_of('keyword', 'لبنان', read_generation(db)) == first
+    # A re-encode assigns new ids and bumps the generation
+    db['vocabulary'].delete_many({})
+    db['vocabulary'].insert_one({'_id': first + 100, 'kind': 'keyword', 'key': 'لبنان', 'value': 'لبنان'})
+    assert reader.id_of('keyword', 'لبنان', read_generation(db)) == first
+    bump_generation(db)
+    assert reader.id_of('keyword', 'لبنان', read_generation(db)) == first + 100
@@ -0,0 +1,192 @@
+import threading
+import time
+import traceback
+from collections import Counter
+from datetime import datetime, timedelta, timezone
+
+from pymongo.errors import PyMongoError
+
+from cache import read_generation
+
+# Hours kept in the ring buffer; trending deltas can compare windows of up to half of this
+WINDOW_HOURS = 24 * 90
+# How often the fallback poller checks the ingest generation when change streams are unavailable
+POLL_SECONDS = 30
+# Wait before restarting the change stream after an unexpected error, doubled per failure up to the maximum
+RETRY_SECONDS = 1
+MAX_RETRY_SECONDS = 60
+
+
+def _hour(timestamp):
+    if timestamp.tzinfo is None:
+        timestamp = timestamp.replace(tzinfo=timezone.utc)
+    return int(timestamp.timestamp() // 3600)
+
+
+class TrendingEngine:
+    """Per-hour keyword counts of recently published articles, kept in a ring buffer.
+
+    Slot `hour % size` holds the counts of articles published in that hour; a slot is
+    reset when the ring wraps onto a new hour. Each article's last contribution is
+    remembered by id so updates replace it instead of counting twice, and forgotten
+    once its hour leaves the window. Window sums are memoized until the next change,
+    so repeated queries cost a dict lookup.
+    """
+
+    def __init__(self, hours=WINDOW_HOURS):
+        self.size = hours
+        self.buckets = [Counter() for _ in range(hours)]
+        self.bucket_hours = [None] * hours
+        self.ready = False
+        self._articles = {}
+        # hour -> ids of the articles counted in it, to forget them when the hour leaves the window
+        self._hour_articles = {}
+        self._oldest_hour = None
+        self._memo = {}
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def _bucket(self, hour):
+        slot = hour % self.size
+        if self.bucket_hours[slot] != hour:
+            self.buckets[slot] = Counter()
+            self.bucket_hours[slot] = hour
+        return self.buckets[slot]
+
+    def _evict(self, current_hour):
+        """Forget the articles published in hours that have left the window (once per new hour)."""
+        oldest = current_hour - self.size + 1
+        if self._oldest_hour == oldest:
+            return
+        self._oldest_hour = oldest
+        for hour in [hour for hour in self._hour_articles if hour < oldest]:
+            for article_id in self._hour_articles.pop(hour):
+                self._articles.pop(article_id, None)
+
+    def add(self, article_id, published_time, keywords, now=None):
+        """Count (or re-count, after an update) one article's keywords in its publication hour."""
+        current_hour = _hour(now or datetime.now(timezone.utc))
+        with self._lock:
+            self._evict(current_hour)
+            previous = self._articles.pop(article_id, None)
+            if previous is not None:
+                hour, old_keywords = previous
+                self._hour_articles[hour].discard(article_id)
+                if self.bucket_hours[hour % self.size] == hour:
+                    self.buckets[hour % self.size].subtract(old_keywords)
+            # Articles without a usable date or keyword list are left out rather than failing the reload
+            if isinstance(published_time, datetime):
+                hour = _hour(published_time)
+                if current_hour - self.size < hour <= current_hour:
+                    keywords = list(set(keyword for keyword in keywords if isinstance(keyword, str))
+                                    if isinstance(keywords, list) else [])
+                    self._bucket(hour).update(keywords)
+                    self._articles[article_id] = (hour, keywords)
+                    self._hour_articles.setdefault(hour, set()).add(article_id)
+            self._memo.clear()
+
+    def remove(self, article_id, now=None):
+        """Take a deleted article's keywords back out."""
+        self.add(article_id, None, None, now=now)
+
+    def window(self, hours, offset=0, now=None):
+        """Keyword counts over the `hours` hours ending `offset` hours before the current one."""
+        if hours + offset > self.size:
+            raise ValueError(f"window reaches back further than the {self.size} hours kept")
+        end = _hour(now or datetime.now(timezone.utc)) - offset
+        with self._lock:
+            key = (hours, end)
+            if key not in self._memo:
+                if len(self._memo) > 256:
+                    self._memo.clear()
+                totals = Counter()
+                for hour in range(end - hours + 1, end + 1):
+                    if self.bucket_hours[hour % self.size] == hour:
+                        totals.update(self.buckets[hour % self.size])
+                self._memo[key] = [(keyword, count) for keyword, count in totals.most_common() if count > 0]
+            return self._memo[key]
+
+    def popular(self, days, now=None):
+        return self.window(days * 24, now=now)
+
+    def trending(self, days, limit=20, now=None):
+        """Keywords rising fastest: counts in the last `days` days against the `days` before."""
+        current = dict(self.window(days * 24, now=now))
+        previous = dict(self.window(days * 24, offset=days * 24, now=now))
+        rising = [
+            {"keyword": keyword, "count": count, "previous": previous.get(keyword, 0),
+             "delta": count - previous.get(keyword, 0)}
+            for keyword, count in current.items()
+        ]
+        rising.sort(key=lambda item: (-item['delta'], -item['count'], item['keyword']))
+        return rising[:limit]
+
+    def load(self, collection):
+        """Rebuild the buffer from the articles published inside the window (uses the published_time index).
+
+        The new buffer is filled off to the side and swapped in at once, so queries during a
+        reload keep seeing the previous counts instead of a half-built window.
+        """
+        cutoff = datetime.now(timezone.utc) - timedelta(hours=self.size)
+        fresh = TrendingEngine(self.size)
+        for article in collection.find({'published_time': {'$gte': cutoff}}, {'published_time': 1, 'keywords': 1}):
+            fresh.add(article['_id'], article['published_time'], article.get('keywords'))
+        with self._lock:
+            self.buckets, self.bucket_hours = fresh.buckets, fresh.bucket_hours
+            self._articles, self._hour_articles = fresh._articles, fresh._hour_articles
+            self._oldest_hour = fresh._oldest_hour
+            self._memo.clear()
+        self.ready = True
+
+    def start(self, collection):
+        """Load once, then follow ingest in a background thread (idempotent)."""
+        with self._lock:
+            if self._thread is not None:
+                return
+            self._thread = threading.Thread(target=self._follow, args=(collection,), daemon=True)
+        self._thread.start()
+
+    def _follow(self, collection):
+        """Runs for the life of the process; any error is logged and the stream restarted after a backoff."""
+        delay = RETRY_SECONDS
+        while True:
+            try:
+                self._watch(collection)
+                delay = RETRY_SECONDS
+            except PyMongoError as e:
+                # Change streams need a replica set; otherwise reload whenever the loader bumps the generation
+                print(f"Trending: change stream unavailable ({e}), polling the ingest generation instead")
+                self._poll(collection)
+            except Exception as e:
+                # E.g. a malformed document: the counts so far stay served while the stream restarts
+                print(f"Trending: change stream failed ({e!r}), restarting in {delay}s")
+                traceback.print_exc()
+                time.sleep(delay)
+                delay = min(delay * 2, MAX_RETRY_SECONDS)
+
+    def _watch(self, collection):
+        pipeline = [{'$match': {'operationType': {'$in': ['insert', 'update', 'replace', 'delete']}}}]
+        with collection.watch(pipeline, full_document='updateLookup') as stream:
+            self.load(collection)
+            for change in stream:
+                if change['operationType'] == 'delete':
+                    self.remove(change['documentKey']['_id'])
+                    continue
+                article = change.get('fullDocument')
+                if article is not None:
+                    self.add(article['_id'], article.get('published_time'), article.get('keywords'))
+
+    def _poll(self, collection):
+        generation = None
+        while True:
+            try:
+                current = read_generation(collection.database)
+                if current != generation or not self.ready:
+                    self.load(collection)
+                    generation = current
+            except PyMongoError as e:
+                print(f"Trending: could not refresh ({e})")
+            except Exception as e:
+                print(f"Trending: refresh failed ({e!r})")
+                traceback.print_exc()
+            time.sleep(POLL_SECONDS)
@@ -0,0 +1,279 @@
+import argparse
+import threading
+
+import pymongo
+from pymongo import IndexModel, ReturnDocument, UpdateOne
+from pymongo.errors import BulkWriteError
+
+from rollups import rebuild_rollups
+from search import strip_diacritics
+from sketches import rebuild_sketches
+
+# Lookup collection: {_id: id, kind: 'keyword' | 'class' | 'author', key: normalized form, value: display form}
+VOCABULARY_COLLECTION = 'vocabulary'
+# Document in the `meta` collection holding the last id handed out
+NEXT_ID = 'vocabulary_next_id'
+# Article fields encoded at ingest: kind -> (source field, id field)
+ENCODED_FIELDS = {'keyword': ('keywords', 'keyword_ids'), 'class': ('classes', 'class_ids')}
+# Batch size of the backfill over existing articles
+BACKFILL_BATCH_SIZE = 1000
+# MongoDB error code of a unique index violation: another loader stored the key first
+DUPLICATE_KEY = 11000
+# Rounds of id allocation lost to concurrent loaders before giving up
+ASSIGN_ATTEMPTS = 5
+# Document in `meta` recording which vocabulary_key() the stored keys were made with; when it
+# differs from KEY_VERSION the vocabulary is rebuilt and every article re-encoded
+KEY_VERSION_ID = 'vocabulary_key_version'
+KEY_VERSION = 2
+# Only hamza on/under alef is folded: other letter variants (ى/ي, ة/ه) tell words apart, e.g. على and علي
+_ALEF_VARIANTS = str.maketrans({'\u0623': '\u0627', '\u0625': '\u0627', '\u0622': '\u0627', '\u0671': '\u0627'})
+
+
+def vocabulary_key(value):
+    """Form two spellings of one term share: no diacritics, bare alef, Latin lowercased, single-spaced."""
+    return ' '.join(strip_diacritics(value).translate(_ALEF_VARIANTS).casefold().split())
+
+
+def display_order(value):
+    """Sort key choosing the display form among spellings of one term; the smallest wins.
+
+    Mixed case beats all capitals, which beat all lowercase ("Ali", "ALI", "ali"); then
+    hamza written out, then no diacritics, then the value itself, so the choice never
+    depends on which spelling was ingested first.
+    """
+    if value == value.lower() and value != value.upper():
+        casing = 2
+    elif value == value.upper() and value != value.lower():
+        casing = 1
+    else:
+        casing = 0
+    hamzas = sum(value.count(letter) for letter in '\u0623\u0625\u0622')
+    return casing, -hamzas, len(value) - len(strip_diacritics(value)), value
+
+
+class Vocabulary:
+    """Stable integer ids for keywords, classes and authors.
+
+    Each distinct normalized value gets one id, allocated from a counter in `meta`
+    and never reused, so ids stored on articles and in the rollups stay valid. Ids
+    are unique across kinds. Entries are cached in memory once seen; a unique index
+    on (kind, key) keeps concurrent loaders from assigning two ids to one value.
+    The displayed value of an id is its preferred spelling by display_order() among
+    those ingested, and is updated when a preferred one turns up.
+
+    Articles keep their keyword, class and author strings next to the ids, since
+    search, article details, trending and the Parquet export read them; documents
+    therefore grow slightly. What shrinks are the multikey indexes and the rollup
+    keys, which hold small ints instead of repeated UTF-8 strings.
+    """
+
+    def __init__(self, db):
+        self.db = db
+        self.collection = db[VOCABULARY_COLLECTION]
+        self._ids = {}
+        self._values = {}
+        self._kind_ids = {}
+        self._generation = None
+        self._lock = threading.Lock()
+
+    def _remember(self, entry):
+        self._ids[(entry['kind'], entry['key'])] = entry['_id']
+        self._values[entry['_id']] = entry['value']
+
+    def _assign(self, missing, attempts=ASSIGN_ATTEMPTS):
+        """Give ids to {(kind, key): value} entries, reusing those another loader just stored."""
+        by_kind = {}
+        for kind, key in missing:
+            by_kind.setdefault(kind, []).append(key)
+        stored = self.collection.find({'$or': [{'kind': kind, 'key': {'$in': keys}}
+                                               for kind, keys in by_kind.items()]})
+        for entry in stored:
+            self._remember(entry)
+        missing = {pair: value for pair, value in missing.items() if pair not in self._ids}
+        if not missing:
+            return
+        last = self.db['meta'].find_one_and_update({'_id': NEXT_ID}, {'$inc': {'value': len(missing)}},
+                                                   upsert=True, return_document=ReturnDocument.AFTER)['value']
+        entries = [{'_id': last - len(missing) + 1 + offset, 'kind': kind, 'key': key, 'value': value}
+                   for offset, ((kind, key), value) in enumerate(missing.items())]
+        try:
+            self.collection.insert_many(entries, ordered=False)
+        except BulkWriteError as e:
+            errors = e.details.get('writeErrors', [])
+            lost_race = errors and all(error.get('code') == DUPLICATE_KEY for error in errors)
+            if not lost_race or e.details.get('writeConcernErrors') or attempts <= 1:
+                raise
+            # Lost a race for some keys; their ids are whatever the winner stored
+            self._assign(missing, attempts - 1)
+            return
+        for entry in entries:
+            self._remember(entry)
+
+    def _lookup(self, kind, values):
+        keys = {}
+        for value in values:
+            value = ' '.join(str(value).split())
+            key = vocabulary_key(value)
+            if key and (key not in keys or display_order(value) < display_order(keys[key])):
+                keys[key] = value
+        return [((kind, key), value) for key, value in keys.items()]
+
+    def _prefer(self, pending):
+        """Store the spellings in {(kind, key): value} that display better than their entry's current value."""
+        better = {}
+        for pair, value in pending.items():
+            entry_id = self._ids[pair]
+            current = self._values.get(entry_id)
+            if current is not None and display_order(value) < display_order(current):
+                better[entry_id] = (current, value)
+        if not better:
+            return
+        # Guarded by the current value, so a concurrent loader's choice is compared again next time
+        self.collection.bulk_write([UpdateOne({'_id': entry_id, 'value': current}, {'$set': {'value': value}})
+                                    for entry_id, (current, value) in better.items()], ordered=False)
+        for entry_id, (_, value) in better.items():
+            self._values[entry_id] = value
+
+    def encode_batch(self, documents):
+        """Set keyword_ids, class_ids and author_id on each document, assigning ids to new values."""
+        with self._lock:
+            pending = {}
+            for document in documents:
+                found = self._lookup('author', [document['author']] if document.get('author') else [])
+                for kind, (field, _) in ENCODED_FIELDS.items():
+                    found += self._lookup(kind, document.get(field) or [])
+                # Across the batch, too, the preferred spelling of each value is the one remembered
+                for pair, value in found:
+                    if pair not in pending or display_order(value) < display_order(pending[pair]):
+                        pending[pair] = value
+            missing = {pair: value for pair, value in pending.items() if pair not in self._ids}
+            if missing:
+                self._assign(missing)
+            self._prefer(pending)
+            for document in documents:
+                for kind, (field, id_field) in ENCODED_FIELDS.items():
+                    document[id_field] = [self._ids[pair] for pair, _ in self._lookup(kind, document.get(field) or [])]
+                authors = self._lookup('author', [document['author']] if document.get('author') else [])
+                document['author_id'] = self._ids[authors[0][0]] if authors else None
+        return documents
+
+    def _sync(self, generation):
+        """Forget every cached entry when the ingest generation (see cache.py) has changed.
+
+        A load may have switched an entry to a preferred spelling, and a re-encode after
+        a KEY_VERSION change (which rebuilds the rollups, bumping the generation)
+        assigns new ids to every value.
+        """
+        if generation is not None and generation != self._generation:
+            with self._lock:
+                self._ids = {}
+                self._values = {}
+                self._kind_ids = {}
+                self._generation = generation
+
+    def id_of(self, kind, value, generation=None):
+        """Id of an existing value (None if it was never ingested).
+
+        Long-running readers pass the ingest generation, as for values().
+        """
+        self._sync(generation)
+        key = vocabulary_key(value)
+        if (kind, key) not in self._ids:
+            entry = self.collection.find_one({'kind': kind, 'key': key})
+            if entry is None:
+                return None
+            with self._lock:
+                self._remember(entry)
+        return self._ids[(kind, key)]
+
+    def values(self, ids, generation=None):
+        """{id: display value}, fetching ids not yet cached in one query.
+
+        Passing the ingest generation drops the cached entries whenever it changes (see _sync).
+        """
+        self._sync(generation)
+        unknown = [i for i in set(ids) if i not in self._values]
+        if unknown:
+            entries = list(self.collection.find({'_id': {'$in': unknown}}))
+            with self._lock:
+                for entry in entries:
+                    self._remember(entry)
+        return {i: self._values.get(i) for i in ids}
+
+
+    def ids(self, kind, generation=None):
+        """Every id of `kind`, e.g. the candidate keys of an approximate top-k (see sketches.py)."""
+        self._sync(generation)
+        ids = self._kind_ids.get(kind)
+        if ids is None:
+            ids = [entry['_id'] for entry in self.collection.find({'kind': kind}, {'_id': 1})]
+            with self._lock:
+                self._kind_ids[kind] = ids
+        return ids
+
+
+def ensure_vocabulary_indexes(db):
+    db[VOCABULARY_COLLECTION].create_indexes([IndexModel([('kind', 1), ('key', 1)], name='kind_key', unique=True)])
+
+
+def encode_collection(collection, batch_size=BACKFILL_BATCH_SIZE):
+    """Add the id fields to every stored article; returns how many were updated."""
+    ensure_vocabulary_indexes(collection.database)
+    vocabulary = Vocabulary(collection.database)
+    projection = {'keywords': 1, 'classes': 1, 'author': 1}
+    updated, batch = 0, []
+
+    def write(batch):
+        vocabulary.encode_batch(batch)
+        operations = [UpdateOne({'_id': document['_id']}, {'$set': {
+            'keyword_ids': document['keyword_ids'], 'class_ids': document['class_ids'],
+            'author_id': document['author_id']}}) for document in batch]
+        return collection.bulk_write(operations, ordered=False).modified_count
+
+    for document in collection.find({}, projection):
+        batch.append(document)
+        if len(batch) >= batch_size:
+            updated += write(batch)
+            batch = []
+    if batch:
+        updated += write(batch)
+    print(f"Encoded vocabulary ids on {updated} articles")
+    return updated
+
+
+def ensure_vocabulary(collection):
+    """Backfill ids once for articles loaded before the vocabulary existed, then re-key the rollups and sketches.
+
+    A vocabulary keyed by an older vocabulary_key() is dropped first and rebuilt the
+    same way; its ids are not reused, since the counter in `meta` is kept.
+    """
+    db = collection.database
+    ensure_vocabulary_indexes(db)
+    stored_version = db['meta'].find_one({'_id': KEY_VERSION_ID})
+    outdated = (stored_version or {}).get('value') != KEY_VERSION
+    if outdated and db[VOCABULARY_COLLECTION].estimated_document_count() > 0:
+        print("Vocabulary keys changed; re-encoding every article")
+        db[VOCABULARY_COLLECTION].delete_many({})
+    if db[VOCABULARY_COLLECTION].estimated_document_count() == 0 and collection.estimated_document_count() > 0:
+        encode_collection(collection)
+        rebuild_rollups(collection)
+        rebuild_sketches(collection)
+    if outdated:
+        # Recorded last, so an interrupted re-encode starts over on the next run
+        db['meta'].update_one({'_id': KEY_VERSION_ID}, {'$set': {'value': KEY_VERSION}}, upsert=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Assign vocabulary ids to stored articles and rebuild the rollups and sketches.')
+    parser.add_argument('--mongo-uri', default="mongodb://localhost:27017/")
+    args = parser.parse_args()
+
+    collection = pymongo.MongoClient(args.mongo_uri)["almayadeen"]["articles"]
+    encode_collection(collection)
+    rebuild_rollups(collection)
+    rebuild_sketches(collection)
+
+
+if __name__ == '__main__':
+    main()